@@ -1,6 +1,6 @@
 import os
 import json
-import asyncio
+import hashlib
 from datetime import datetime
 from flask import Flask, render_template, request, redirect, url_for, session, flash, abort
 from dotenv import load_dotenv
@@ -9,8 +9,6 @@ import psycopg2.extras
 from psycopg2.extras import Json
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
-import tempfile
-import aiofiles
 
 # Принудительно задаём имя базы (для совместимости)
 os.environ['DB_NAME'] = 'db1_prod'
@@ -18,15 +16,19 @@ os.environ['DB_NAME'] = 'db1_prod'
 # Добавляем путь к корню проекта
 import sys
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
-from services.embeddings import process_document
-from services.db import init_db_pool, get_db_pool
+from services.vector_index import DOCUMENTS_CHANNEL, PROCESS_ID
+from config import settings
+from services.bulk_upload import expand_uploads
+from services.ingest_jobs import (
+    DUPLICATE_JOB_SQL, FINALIZE_JOB_SQL, INSERT_JOB_SQL, INSERT_PART_SQL, UploadTooLarge, pyformat,
+)
 from core.logger import logger
 
 load_dotenv()
 
 app = Flask(__name__)
 app.secret_key = os.getenv("FLASK_SECRET_KEY", "supersecretkey")
-app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # 50 MB
+app.config['MAX_CONTENT_LENGTH'] = settings.bulk_max_request_mb * 1024 * 1024
 
 # Подключение к PostgreSQL (синхронное, для работы Flask)
 DB_PARAMS = {
@@ -547,6 +549,42 @@ def client_documents(client_id):
     document_groups = list(documents_by_file.values())
     return render_template("documents.html", client_id=client_id, client_name=client_name[0], document_groups=document_groups)
 
+def enqueue_upload(conn, client_id, filename, content_type, stream, metadata):
+    """
+    Ставит файл в ingest_jobs, копируя его блоками в ingest_job_parts.
+    Возвращает (id задачи, None) или (None, id задачи-дубля), если тот же файл
+    клиента уже в очереди или в работе.
+    """
+    limit = settings.max_upload_mb * 1024 * 1024
+    digest = hashlib.sha256()
+    cur = conn.cursor()
+    try:
+        cur.execute(pyformat(INSERT_JOB_SQL), (client_id, filename, content_type, Json(metadata)))
+        job_id = cur.fetchone()[0]
+        size = 0
+        seq = 0
+        while block := stream.read(settings.upload_buffer_size):
+            size += len(block)
+            if size > limit:
+                raise UploadTooLarge(f"Файл больше {settings.max_upload_mb} МБ")
+            digest.update(block)
+            cur.execute(pyformat(INSERT_PART_SQL), (job_id, seq, psycopg2.Binary(block)))
+            seq += 1
+        sha = digest.hexdigest()
+        cur.execute(pyformat(DUPLICATE_JOB_SQL), (client_id, sha, job_id))
+        duplicate = cur.fetchone()
+        if duplicate:
+            conn.rollback()
+            return None, duplicate[0]
+        cur.execute(pyformat(FINALIZE_JOB_SQL), (size, sha, job_id))
+        conn.commit()
+        return job_id, None
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
 @app.route("/client/<client_id>/upload", methods=["GET", "POST"])
 def upload_document(client_id):
     redirect_resp = check_auth('manager')
@@ -563,62 +601,41 @@ def upload_document(client_id):
         return redirect(url_for("clients"))
 
     if request.method == "POST":
-        if 'file' not in request.files:
-            flash("Файл не выбран")
-            return redirect(request.url)
-        file = request.files['file']
-        if file.filename == '':
+        files = [f for f in request.files.getlist('file') if f.filename]
+        if not files:
             flash("Файл не выбран")
             return redirect(request.url)
 
-        allowed_extensions = {'.txt', '.pdf'}
-        ext = os.path.splitext(file.filename)[1].lower()
-        if ext not in allowed_extensions:
-            flash("Поддерживаются только .txt и .pdf файлы")
-            return redirect(request.url)
-
-        # Сохраняем во временный файл
-        with tempfile.NamedTemporaryFile(delete=False, suffix=ext) as tmp:
-            file.save(tmp.name)
-            tmp_path = tmp.name
-
-        # Асинхронная функция ингеста
-        async def ingest():
-            try:
-                get_db_pool()
-            except RuntimeError:
-                await init_db_pool()
-            try:
-                pool = get_db_pool()
-                logger.info(f"✅ Пул получен: {pool}")
-            except Exception as e:
-                logger.error(f"❌ Не удалось получить пул после инициализации: {e}")
-                raise
-            async with aiofiles.open(tmp_path, 'rb') as f:
-                content = await f.read()
-            class FakeFile:
-                def __init__(self, filename, content, content_type):
-                    self.filename = filename
-                    self.content = content
-                    self.content_type = content_type
-                async def read(self):
-                    return self.content
-            fake_file = FakeFile(file.filename, content, file.content_type)
-            metadata = {"uploaded_by": session.get('admin_username', 'admin')}
-            try:
-                result = await process_document(client_id, fake_file, metadata)
-                return result
-            except Exception as e:
-                logger.error(f"Ошибка ингеста: {e}", exc_info=True)
-                raise
-
+        # Обработку (чанки, эмбеддинги) выполняют воркеры API-сервиса параллельно;
+        # страница не ждёт её окончания. ZIP-архивы разворачиваются в отдельные задачи.
+        metadata = {"uploaded_by": session.get('admin_username', 'admin')}
+        queued, duplicates, skipped = [], [], []
+        conn = get_db_connection()
         try:
-            result = loop.run_until_complete(ingest())
-            flash(f"Документ загружен, создано {result} чанков")
-        except Exception as e:
-            flash(f"Ошибка при обработке документа: {str(e)}")
+            for item in expand_uploads((f.filename, f.content_type, f.stream) for f in files):
+                if item.skipped:
+                    skipped.append(f"{item.filename} ({item.skipped})")
+                    continue
+                try:
+                    with item.open() as stream:
+                        job_id, duplicate_of = enqueue_upload(conn, client_id, item.filename, item.content_type, stream, metadata)
+                except ValueError as e:
+                    skipped.append(f"{item.filename} ({e})")
+                    continue
+                if duplicate_of:
+                    duplicates.append(item.filename)
+                else:
+                    queued.append(job_id)
+                    logger.info(f"📥 Админка: задача загрузки #{job_id} для клиента {client_id}: {item.filename}")
         finally:
-            os.unlink(tmp_path)
+            conn.close()
+
+        if queued:
+            flash(f"Поставлено в очередь документов: {len(queued)} (задачи #{queued[0]}–#{queued[-1]})")
+        if duplicates:
+            flash(f"Уже загружены или в очереди: {', '.join(duplicates)}")
+        if skipped:
+            flash(f"Пропущены: {', '.join(skipped)}")
 
         return redirect(url_for('client_documents', client_id=client_id))
 
@@ -642,6 +659,8 @@ def delete_document_by_filename(client_id):
         WHERE client_id = %s AND metadata->>'filename' = %s
     """, (client_id, filename))
     deleted = cur.rowcount
+    # Индексы в памяти API-процессов сбрасываются по уведомлению (доставляется при commit)
+    cur.execute("SELECT pg_notify(%s, %s)", (DOCUMENTS_CHANNEL, json.dumps({"client_id": client_id, "origin": PROCESS_ID})))
     conn.commit()
     cur.close()
     conn.close()
@@ -683,14 +702,5 @@ def logs():
     conn.close()
     return render_template("logs.html", logs=logs, clients=clients_list, selected_client=client_filter)
 
-# ---------- Глобальный цикл событий и инициализация пула ----------
-loop = asyncio.new_event_loop()
-asyncio.set_event_loop(loop)
-try:
-    loop.run_until_complete(init_db_pool())
-    logger.info("✅ Пул БД инициализирован в глобальном цикле")
-except Exception as e:
-    logger.error(f"❌ Ошибка инициализации пула БД: {e}", exc_info=True)
-
 if __name__ == "__main__":
     app.run(debug=True, port=5000)
\ No newline at end of file
@@ -7,6 +7,8 @@ class Settings(BaseSettings):
     # DeepSeek (для генерации ответов)
     deepseek_api_key: str = ""
     deepseek_api_url: str = "https://api.deepseek.com/v1"
+    openai_api_key: str = ""
+    openai_api_url: str = "https://api.openai.com/v1"
 
     # Yandex Cloud (для эмбеддингов)
     yc_folder_id: str = ""
@@ -19,15 +21,104 @@ class Settings(BaseSettings):
     db_user: str = "user1"
     db_password: str = ""
 
+    # HTTP-клиент эмбеддингов
+    embedding_pool_limit: int = 20             # одновременных соединений к API эмбеддингов
+    embedding_dns_ttl: int = 300               # кэш DNS, сек
+    embedding_keepalive_timeout: float = 60.0  # простой keep-alive соединения, сек
+    embedding_concurrency: int = 8             # одновременных запросов эмбеддингов на процесс
+    embedding_rps: float = 10.0                # квота API эмбеддингов, запросов в секунду
+    embedding_burst: int = 10                  # допустимый всплеск сверх rps
+    embedding_batch_window_ms: float = 5.0     # окно накопления одновременных запросов
+    embedding_batch_size: int = 32             # максимум текстов в одной пачке
+
+    # Кэш эмбеддингов (память процесса + таблица embedding_cache)
+    embedding_cache_size: int = 10000          # записей в памяти
+    embedding_cache_ttl: int = 30 * 24 * 3600  # сек
+    embedding_cache_persistent: bool = True
+    embedding_cache_max_rows: int = 500000
+
+    # Извлечение текста из PDF (пул процессов)
+    extraction_workers: int = 2
+    pdf_max_pages: int = 1000
+    pdf_timeout: float = 300.0                 # сек на весь файл
+    pdf_pages_per_task: int = 8
+
+    # Загрузка файлов: читаются и хранятся блоками, память не растёт с размером файла
+    upload_buffer_size: int = 1024 * 1024     # байт на блок чтения / строку ingest_job_parts
+    upload_spool_memory: int = 4 * 1024 * 1024  # сверх этого временный файл воркера уходит на диск
+    max_upload_mb: int = 50
+    bulk_max_files: int = 200                  # документов в одной пакетной загрузке (с учётом ZIP)
+    bulk_max_request_mb: int = 500
+
+    # Фоновая очередь загрузки документов (таблица ingest_jobs)
+    ingest_workers: int = 4                    # файлов параллельно; общий лимит эмбеддингов — embedding_concurrency
+    ingest_poll_interval: float = 1.0          # сек между опросами пустой очереди
+    ingest_heartbeat_interval: float = 5.0     # сек между сохранениями прогресса
+    ingest_stale_after: float = 120.0          # сек без heartbeat — задача возвращается в очередь
+    ingest_max_attempts: int = 3
+
+    # Полная переиндексация папки клиента (services/ingest_client_docs.py)
+    client_docs_dir: str = "client_docs"      # локальный корень: <client_docs_dir>/<папка>/<файлы>
+    folder_ingest_concurrency: int = 4         # файлов одновременно
+
     # Модели
+    embedding_provider: str = "yandex"        # yandex | openai | local
     embedding_model: str = "text-search-doc"  # для YandexGPT
+    llm_provider: str = "deepseek"            # deepseek | openai (services/llm.py)
+    llm_providers: str = ""                   # порядок для роутера, напр. "deepseek,openai"; пусто — только llm_provider
+    openai_chat_model: str = "gpt-4o-mini"
     chat_model: str = "deepseek-chat"         # оставляем DeepSeek
     vector_dimension: int = 256                # размерность эмбеддингов YandexGPT
 
+    # OpenAI-совместимый провайдер эмбеддингов (embedding_provider="openai")
+    embedding_api_url: str = "https://api.openai.com/v1"
+    embedding_api_key: str = ""
+    embedding_api_model: str = "text-embedding-3-small"
+    embedding_api_dimensions: int = 256        # 0 — размерность модели по умолчанию
+
+    # Локальный детерминированный провайдер (embedding_provider="local"): размерность — vector_dimension
+    local_embedding_latency_ms: float = 0.0    # имитация сетевой задержки
+    local_embedding_jitter_ms: float = 0.0
+
+    # HTTP-клиент LLM: один на провайдера, HTTP/2 и keep-alive пул
+    llm_http2: bool = True
+    llm_pool_limit: int = 20
+    llm_keepalive_expiry: float = 60.0         # сек простоя до закрытия соединения
+    llm_connect_timeout: float = 5.0
+    llm_read_timeout: float = 60.0
+    llm_singleflight: bool = True              # одинаковые одновременные запросы — один вызов API
+    llm_singleflight_ttl: float = 5.0          # сек, сколько готовый ответ отдаётся повторам (0 — только одновременные)
+
+    # Роутер LLM: хедж-запрос к резервному провайдеру после p95 задержки основного
+    llm_hedge: bool = True
+    llm_hedge_delay: float = 3.0               # сек, пока не набралось статистики для p95
+    llm_hedge_min_delay: float = 0.5
+    llm_hedge_max_delay: float = 15.0
+    llm_ewma_alpha: float = 0.2
+
+    # Планировщик вызовов LLM: общий лимит и справедливая очередь по client_id
+    llm_max_concurrency: int = 16
+    llm_tenant_weights: str = ""               # "client_a:2,client_b:0.5"; остальные — вес 1
+    llm_queue_deadline: float = 30.0           # сек ожидания слота, дольше — отказ (0 — без ограничения)
+
     # Обработка документов
     chunk_size: int = 1000
     chunk_overlap: int = 200
 
+    # Индекс эмбеддингов в памяти процесса
+    vector_index_max_mb: int = 512             # бюджет памяти, сверх него — LRU-вытеснение клиентов
+
+    # Векторный поиск: "memory" — индекс в процессе, "pgvector" — HNSW в PostgreSQL
+    rag_backend: str = "memory"
+    hnsw_ef_search: int = 64
+    hnsw_iterative_scan: str = ""              # "relaxed_order" / "strict_order" (pgvector >= 0.8)
+
+    # Кэш готовых ответов /chat/ без контекста диалога (частые вопросы, перефразы)
+    answer_cache_enabled: bool = True
+    answer_cache_threshold: float = 0.92       # косинусная близость вопроса к закэшированному
+    answer_cache_ttl: int = 3600               # сек
+    answer_cache_max_per_tenant: int = 500
+
     # Логирование
     log_level: str = "INFO"
 
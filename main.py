@@ -22,6 +22,14 @@ from telegram_bot import start, handle_message
 
 # Импорт для работы с PostgreSQL
 from services.db import init_db_pool, close_db_pool, get_all_active_clients
+from services.vector_index import start_index_listener, stop_index_listener, vector_index
+from services.embeddings import close_embedding_session, get_embedding_batcher
+from services.embedding_cache import embedding_cache
+from services.extraction import shutdown_extraction_executor
+from services.ingest_jobs import start_ingest_workers, stop_ingest_workers
+from services.answer_cache import answer_cache
+from services.llm_scheduler import llm_scheduler_stats
+from services.llm import close_llm_clients, get_llm_router, llm_singleflight_stats, prompt_cache_stats
 
 # Импорт воркера Avito
 from avito_worker import avito_worker_loop
@@ -130,6 +138,12 @@ async def lifespan(app: FastAPI):
     # 1. Инициализация пула соединений с PostgreSQL
     await init_db_pool()
 
+    # 1.1. Подписка на изменения документов (сброс индексов эмбеддингов в памяти)
+    start_index_listener()
+
+    # 1.2. Воркеры фоновой загрузки документов
+    start_ingest_workers()
+
     # 2. Запуск фонового воркера Avito
     asyncio.create_task(avito_worker_loop())
 
@@ -188,6 +202,11 @@ async def lifespan(app: FastAPI):
         except Exception as e:
             logger.error(f"Ошибка shutdown для {token[:8]}: {e}")
 
+    await stop_ingest_workers()
+    await stop_index_listener()
+    await close_embedding_session()
+    await close_llm_clients()
+    shutdown_extraction_executor()
     await close_db_pool()
     logger.info("✅ Lifespan shutdown completed")
 
@@ -244,4 +263,12 @@ async def health_check():
         "status": "healthy",
         "model": settings.chat_model,
         "bots_loaded": len(telegram_apps),
+        "vector_index": vector_index.stats(),
+        "embedding_cache": embedding_cache.stats(),
+        "embedding_batcher": get_embedding_batcher().stats(),
+        "llm_prompt_cache": prompt_cache_stats.stats(),
+        "llm_singleflight": llm_singleflight_stats(),
+        "llm_router": get_llm_router().stats(),
+        "llm_scheduler": llm_scheduler_stats(),
+        "answer_cache": answer_cache.stats(),
     }
\ No newline at end of file
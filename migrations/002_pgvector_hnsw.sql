@@ -0,0 +1,56 @@
+-- Векторный поиск на стороне PostgreSQL (RAG_BACKEND=pgvector).
+--
+-- В рабочей базе documents.embedding хранится как jsonb, поэтому
+-- нативный вектор добавляется отдельной колонкой embedding_vec.
+-- Размерность совпадает с settings.vector_dimension (YandexGPT text-search-doc: 256).
+--
+-- Индексы создаются CONCURRENTLY, чтобы не блокировать запись во время работы сервиса:
+-- выполнять через psql без -1 / --single-transaction.
+
+CREATE EXTENSION IF NOT EXISTS vector;
+
+ALTER TABLE public.documents ADD COLUMN IF NOT EXISTS embedding_vec vector(256);
+
+-- Фильтр по клиенту (загрузка индекса в память, удаление по файлу)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_documents_client_id
+ON public.documents USING btree (client_id);
+
+-- HNSW по косинусному расстоянию
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_documents_embedding_vec_hnsw
+ON public.documents
+USING hnsw (embedding_vec vector_cosine_ops)
+WITH (m = 16, ef_construction = 64);
+
+-- Поиск по косинусному сходству в рамках клиента.
+-- Сортировка по расстоянию без условия на порог, чтобы работал индекс;
+-- порог применяется к уже найденным k строкам.
+DROP FUNCTION IF EXISTS match_documents(vector, float, int, text);
+
+CREATE OR REPLACE FUNCTION match_documents(
+    query_embedding vector(256),
+    match_threshold float,
+    match_count int,
+    filter_client_id text DEFAULT NULL
+)
+RETURNS TABLE(
+    id bigint,
+    content text,
+    metadata jsonb,
+    similarity float
+)
+LANGUAGE sql STABLE
+AS $$
+    SELECT * FROM (
+        SELECT
+            d.id,
+            d.content,
+            d.metadata,
+            1 - (d.embedding_vec <=> query_embedding) AS similarity
+        FROM public.documents d
+        WHERE d.embedding_vec IS NOT NULL
+          AND (filter_client_id IS NULL OR d.client_id = filter_client_id)
+        ORDER BY d.embedding_vec <=> query_embedding
+        LIMIT match_count
+    ) nearest
+    WHERE nearest.similarity > match_threshold;
+$$;
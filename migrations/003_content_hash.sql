@@ -0,0 +1,10 @@
+-- Инкрементальная переиндексация: хэш содержимого чанка и модель эмбеддинга.
+-- При повторной загрузке документа эмбеддинги запрашиваются только для
+-- новых/изменённых чанков (sha256 текста), исчезнувшие чанки удаляются.
+-- Выполнять через psql без -1 / --single-transaction (CONCURRENTLY).
+
+ALTER TABLE public.documents ADD COLUMN IF NOT EXISTS content_hash text;
+ALTER TABLE public.documents ADD COLUMN IF NOT EXISTS embedding_model text;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_documents_client_filename
+ON public.documents USING btree (client_id, (metadata->>'filename'));
@@ -0,0 +1,13 @@
+-- Persistent-слой кэша эмбеддингов (services/embedding_cache.py).
+-- Ключ — URI модели и sha256 текста, вектор хранится как float32 в bytea.
+
+CREATE TABLE IF NOT EXISTS public.embedding_cache (
+    model text NOT NULL,
+    text_hash text NOT NULL,
+    embedding bytea NOT NULL,
+    created_at timestamp with time zone DEFAULT now() NOT NULL,
+    PRIMARY KEY (model, text_hash)
+);
+
+CREATE INDEX IF NOT EXISTS idx_embedding_cache_created_at
+ON public.embedding_cache USING btree (created_at);
@@ -0,0 +1,32 @@
+-- Очередь фоновой загрузки документов (services/ingest_jobs.py).
+-- Файл лежит в payload до окончания обработки; воркеры забирают задачи
+-- через SELECT ... FOR UPDATE SKIP LOCKED, зависшие (без heartbeat) возвращаются в очередь.
+
+CREATE TABLE IF NOT EXISTS public.ingest_jobs (
+    id bigserial PRIMARY KEY,
+    client_id text NOT NULL,
+    filename text NOT NULL,
+    content_type text,
+    metadata jsonb DEFAULT '{}'::jsonb NOT NULL,
+    payload bytea,
+    status text DEFAULT 'queued' NOT NULL,   -- queued | running | done | failed
+    attempts integer DEFAULT 0 NOT NULL,
+    worker text,
+    chunks_total integer,
+    chunks_done integer DEFAULT 0 NOT NULL,
+    chunks_failed integer DEFAULT 0 NOT NULL,
+    error text,
+    created_at timestamp with time zone DEFAULT now() NOT NULL,
+    started_at timestamp with time zone,
+    heartbeat_at timestamp with time zone,
+    finished_at timestamp with time zone
+);
+
+CREATE INDEX IF NOT EXISTS idx_ingest_jobs_queued
+ON public.ingest_jobs USING btree (id) WHERE status = 'queued';
+
+CREATE INDEX IF NOT EXISTS idx_ingest_jobs_running
+ON public.ingest_jobs USING btree (heartbeat_at) WHERE status = 'running';
+
+CREATE INDEX IF NOT EXISTS idx_ingest_jobs_client
+ON public.ingest_jobs USING btree (client_id, created_at DESC);
@@ -0,0 +1,13 @@
+-- Теневые строки для полной переиндексации клиента (services/ingest_client_docs.py).
+-- Новая версия базы знаний собирается здесь, затем одной транзакцией заменяет
+-- строки клиента в documents — клиент не видит пустую или наполовину загруженную базу.
+-- UNLOGGED: после сбоя PostgreSQL содержимое теряется, переиндексацию достаточно перезапустить.
+
+CREATE UNLOGGED TABLE IF NOT EXISTS public.documents_staging (
+    LIKE public.documents INCLUDING DEFAULTS
+);
+
+ALTER TABLE public.documents_staging ADD COLUMN IF NOT EXISTS run_id text NOT NULL;
+
+CREATE INDEX IF NOT EXISTS idx_documents_staging_run
+ON public.documents_staging USING btree (client_id, run_id);
@@ -0,0 +1,12 @@
+-- Содержимое загруженных файлов блоками по upload_buffer_size (services/ingest_jobs.py):
+-- ни API, ни админка, ни воркер не держат файл в памяти целиком.
+-- Колонка ingest_jobs.payload остаётся для задач, поставленных до этой миграции.
+
+CREATE TABLE IF NOT EXISTS public.ingest_job_parts (
+    job_id bigint NOT NULL REFERENCES public.ingest_jobs (id) ON DELETE CASCADE,
+    seq integer NOT NULL,
+    data bytea NOT NULL,
+    PRIMARY KEY (job_id, seq)
+);
+
+ALTER TABLE public.ingest_jobs ADD COLUMN IF NOT EXISTS size_bytes bigint;
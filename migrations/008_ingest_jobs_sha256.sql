@@ -0,0 +1,6 @@
+-- sha256 содержимого файла задачи: пакетная загрузка пропускает одинаковые файлы.
+
+ALTER TABLE public.ingest_jobs ADD COLUMN IF NOT EXISTS content_sha256 text;
+
+CREATE INDEX IF NOT EXISTS idx_ingest_jobs_client_sha256
+ON public.ingest_jobs USING btree (client_id, content_sha256);
@@ -0,0 +1,11 @@
+-- Ход переноса эмбеддингов из jsonb в embedding_vec по клиентам (scripts/migrate_embeddings.py).
+-- status = 'verified' — векторы клиента проверены, индекс и бэкенд pgvector используют embedding_vec.
+
+CREATE TABLE IF NOT EXISTS public.embedding_migrations (
+    client_id text PRIMARY KEY,
+    last_id bigint DEFAULT 0 NOT NULL,
+    converted integer DEFAULT 0 NOT NULL,
+    skipped integer DEFAULT 0 NOT NULL,
+    status text DEFAULT 'in_progress' NOT NULL,   -- in_progress | verified
+    updated_at timestamp with time zone DEFAULT now()
+);
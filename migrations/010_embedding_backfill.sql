@@ -0,0 +1,13 @@
+-- Контрольные точки заполнения эмбеддингов (scripts/backfill_embeddings.py):
+-- на клиента и модель; прерванный запуск продолжается с last_id.
+
+CREATE TABLE IF NOT EXISTS public.embedding_backfill (
+    client_id text NOT NULL,
+    model text NOT NULL,
+    last_id bigint DEFAULT 0 NOT NULL,
+    updated integer DEFAULT 0 NOT NULL,
+    failed integer DEFAULT 0 NOT NULL,
+    status text DEFAULT 'in_progress' NOT NULL,   -- in_progress | done
+    updated_at timestamp with time zone DEFAULT now(),
+    PRIMARY KEY (client_id, model)
+);
@@ -2,26 +2,47 @@
 CREATE EXTENSION IF NOT EXISTS vector;
 
 -- Таблица документов
+-- embedding — исходный формат рабочей базы (jsonb), embedding_vec — нативный вектор
+-- для поиска на стороне PostgreSQL (см. 002_pgvector_hnsw.sql)
 CREATE TABLE IF NOT EXISTS documents (
     id BIGSERIAL PRIMARY KEY,
     content TEXT NOT NULL,
     metadata JSONB DEFAULT '{}',
-    embedding vector(1024),
-    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+    embedding JSONB,
+    embedding_vec vector(256),
+    content_hash TEXT,
+    embedding_model TEXT,
+    created_at TIMESTAMP WITHOUT TIME ZONE DEFAULT NOW(),
+    client_id TEXT NOT NULL
 );
 
--- Индекс для быстрого поиска (IVFFlat)
-CREATE INDEX IF NOT EXISTS idx_documents_embedding 
-ON documents 
-USING ivfflat (embedding vector_cosine_ops)
-WITH (lists = 100);
+CREATE INDEX IF NOT EXISTS idx_documents_client_id
+ON documents (client_id);
 
--- Функция поиска по косинусному сходству
+CREATE INDEX IF NOT EXISTS idx_documents_client_filename
+ON documents (client_id, (metadata->>'filename'));
+
+-- Теневые строки полной переиндексации клиента (см. 006_documents_staging.sql)
+CREATE UNLOGGED TABLE IF NOT EXISTS documents_staging (
+    LIKE documents INCLUDING DEFAULTS,
+    run_id TEXT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_documents_staging_run
+ON documents_staging (client_id, run_id);
+
+-- Индекс для быстрого поиска (HNSW, косинусное расстояние)
+CREATE INDEX IF NOT EXISTS idx_documents_embedding_vec_hnsw
+ON documents
+USING hnsw (embedding_vec vector_cosine_ops)
+WITH (m = 16, ef_construction = 64);
+
+-- Функция поиска по косинусному сходству в рамках клиента
 CREATE OR REPLACE FUNCTION match_documents(
-    query_embedding vector(1024),
+    query_embedding vector(256),
     match_threshold float,
     match_count int,
-    filter_user_id text DEFAULT NULL
+    filter_client_id text DEFAULT NULL
 )
 RETURNS TABLE(
     id bigint,
@@ -29,23 +50,89 @@ RETURNS TABLE(
     metadata jsonb,
     similarity float
 )
-LANGUAGE plpgsql
+LANGUAGE sql STABLE
 AS $$
-BEGIN
-    RETURN QUERY
-    SELECT
-        documents.id,
-        documents.content,
-        documents.metadata,
-        1 - (documents.embedding <=> query_embedding) as similarity
-    FROM documents
-    WHERE 
-        1 - (documents.embedding <=> query_embedding) > match_threshold
-        AND (
-            filter_user_id IS NULL 
-            OR documents.metadata->>'user_id' = filter_user_id
-        )
-    ORDER BY similarity DESC
-    LIMIT match_count;
-END;
-$$;
\ No newline at end of file
+    SELECT * FROM (
+        SELECT
+            d.id,
+            d.content,
+            d.metadata,
+            1 - (d.embedding_vec <=> query_embedding) AS similarity
+        FROM documents d
+        WHERE d.embedding_vec IS NOT NULL
+          AND (filter_client_id IS NULL OR d.client_id = filter_client_id)
+        ORDER BY d.embedding_vec <=> query_embedding
+        LIMIT match_count
+    ) nearest
+    WHERE nearest.similarity > match_threshold;
+$$;
+
+-- Кэш эмбеддингов (см. 004_embedding_cache.sql)
+CREATE TABLE IF NOT EXISTS embedding_cache (
+    model TEXT NOT NULL,
+    text_hash TEXT NOT NULL,
+    embedding BYTEA NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW() NOT NULL,
+    PRIMARY KEY (model, text_hash)
+);
+
+CREATE INDEX IF NOT EXISTS idx_embedding_cache_created_at
+ON embedding_cache (created_at);
+
+-- Очередь фоновой загрузки документов (см. 005_ingest_jobs.sql)
+CREATE TABLE IF NOT EXISTS ingest_jobs (
+    id BIGSERIAL PRIMARY KEY,
+    client_id TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    content_type TEXT,
+    metadata JSONB DEFAULT '{}'::jsonb NOT NULL,
+    payload BYTEA,
+    status TEXT DEFAULT 'queued' NOT NULL,
+    attempts INTEGER DEFAULT 0 NOT NULL,
+    worker TEXT,
+    chunks_total INTEGER,
+    chunks_done INTEGER DEFAULT 0 NOT NULL,
+    chunks_failed INTEGER DEFAULT 0 NOT NULL,
+    error TEXT,
+    size_bytes BIGINT,
+    content_sha256 TEXT,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW() NOT NULL,
+    started_at TIMESTAMP WITH TIME ZONE,
+    heartbeat_at TIMESTAMP WITH TIME ZONE,
+    finished_at TIMESTAMP WITH TIME ZONE
+);
+
+CREATE INDEX IF NOT EXISTS idx_ingest_jobs_queued ON ingest_jobs (id) WHERE status = 'queued';
+CREATE INDEX IF NOT EXISTS idx_ingest_jobs_running ON ingest_jobs (heartbeat_at) WHERE status = 'running';
+CREATE INDEX IF NOT EXISTS idx_ingest_jobs_client ON ingest_jobs (client_id, created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_ingest_jobs_client_sha256 ON ingest_jobs (client_id, content_sha256);
+
+-- Содержимое файлов задач блоками (см. 007_ingest_job_parts.sql)
+CREATE TABLE IF NOT EXISTS ingest_job_parts (
+    job_id BIGINT NOT NULL REFERENCES ingest_jobs (id) ON DELETE CASCADE,
+    seq INTEGER NOT NULL,
+    data BYTEA NOT NULL,
+    PRIMARY KEY (job_id, seq)
+);
+
+-- Перенос эмбеддингов в embedding_vec по клиентам (см. 009_embedding_migrations.sql)
+CREATE TABLE IF NOT EXISTS embedding_migrations (
+    client_id TEXT PRIMARY KEY,
+    last_id BIGINT DEFAULT 0 NOT NULL,
+    converted INTEGER DEFAULT 0 NOT NULL,
+    skipped INTEGER DEFAULT 0 NOT NULL,
+    status TEXT DEFAULT 'in_progress' NOT NULL,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+-- Контрольные точки заполнения эмбеддингов (см. 010_embedding_backfill.sql)
+CREATE TABLE IF NOT EXISTS embedding_backfill (
+    client_id TEXT NOT NULL,
+    model TEXT NOT NULL,
+    last_id BIGINT DEFAULT 0 NOT NULL,
+    updated INTEGER DEFAULT 0 NOT NULL,
+    failed INTEGER DEFAULT 0 NOT NULL,
+    status TEXT DEFAULT 'in_progress' NOT NULL,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    PRIMARY KEY (client_id, model)
+);
@@ -5,13 +5,15 @@ class ChatRequest(BaseModel):
     user_id: str
     message: str
     use_rag: bool = True
-    system_extra: Optional[str] = None
+    system_extra: Optional[str] = None        # неизменные между ходами инструкции (кэшируемый префикс)
     context_info: Optional[str] = None
+    system_dynamic: Optional[str] = None      # меняющееся каждый ход: история, состояние анкеты
 
 class ChatResponse(BaseModel):
     reply: str
     sources: List[str] = Field(default_factory=list)
     new_state: Optional[Dict[str, Any]] = None
+    cached: bool = False
 
 class DocumentUploadResponse(BaseModel):
     filename: str
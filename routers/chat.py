@@ -1,7 +1,13 @@
+import json
+
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
 from models.schemas import ChatRequest, ChatResponse
-from services.deepseek import ask_with_rag
+from services.deepseek import ask_with_rag, ask_with_rag_cached, build_rag_messages, stream_deepseek
+from services.lead_json import LeadJsonStripper
+from services.llm_scheduler import LLMQueueTimeout
 from core.logger import logger
+from config import settings
 
 router = APIRouter(prefix="/chat", tags=["Chat"])
 
@@ -9,12 +15,22 @@ router = APIRouter(prefix="/chat", tags=["Chat"])
 @router.post("/", response_model=ChatResponse)
 async def chat_endpoint(request: ChatRequest):
     try:
+        # Без контекста диалога ответ зависит только от вопроса и документов клиента
+        if settings.answer_cache_enabled and request.use_rag and not request.context_info and not request.system_dynamic:
+            reply, sources, cached = await ask_with_rag_cached(
+                user_message=request.message,
+                user_id=request.user_id,
+                system_extra=request.system_extra,
+            )
+            return ChatResponse(reply=reply, sources=sources, cached=cached)
+
         reply, sources = await ask_with_rag(
             user_message=request.message,
             user_id=request.user_id,
             use_rag=request.use_rag,
             system_extra=request.system_extra,
             context_info=request.context_info,
+            system_dynamic=request.system_dynamic,
         )
 
         return ChatResponse(
@@ -22,6 +38,65 @@ async def chat_endpoint(request: ChatRequest):
             sources=sources,
         )
 
+    except LLMQueueTimeout as e:
+        logger.warning(f"Chat endpoint: {e}")
+        raise HTTPException(status_code=503, detail="LLM перегружен, повторите запрос позже", headers={"Retry-After": "5"})
+
     except Exception as e:
         logger.exception("Chat endpoint error")
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+def _event(payload: dict) -> bytes:
+    return (json.dumps(payload, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+@router.post("/stream")
+async def chat_stream_endpoint(request: ChatRequest):
+    """
+    Ответ по мере генерации, NDJSON (по событию JSON на строку):
+    {"type": "delta", "text": ...} — очередной видимый фрагмент (блок <LEAD_JSON> вырезан);
+    {"type": "done", "reply": ..., "patch": {...}, "sources": [...]} — итог;
+    {"type": "error", "detail": ...} — сбой посреди генерации.
+    """
+    try:
+        messages, sources = await build_rag_messages(
+            user_message=request.message,
+            user_id=request.user_id,
+            use_rag=request.use_rag,
+            system_extra=request.system_extra,
+            context_info=request.context_info,
+            system_dynamic=request.system_dynamic,
+        )
+    except Exception as e:
+        logger.exception("Chat stream endpoint error")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    async def events():
+        stripper = LeadJsonStripper()
+        parts = []
+        try:
+            async for delta in stream_deepseek(messages, client_id=request.user_id):
+                visible = stripper.feed(delta)
+                if visible:
+                    parts.append(visible)
+                    yield _event({"type": "delta", "text": visible})
+            tail, patch = stripper.finish()
+            if tail:
+                parts.append(tail)
+                yield _event({"type": "delta", "text": tail})
+            yield _event({
+                "type": "done",
+                "reply": "".join(parts).strip(),
+                "patch": patch,
+                "sources": sources,
+            })
+        except Exception as e:
+            logger.exception("Chat stream error")
+            yield _event({"type": "error", "detail": str(e)})
+
+    return StreamingResponse(
+        events(),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -1,8 +1,10 @@
 from fastapi import APIRouter, UploadFile, File, Form, HTTPException
-from services.embeddings import process_document
+from services.db import get_db_pool
+from services.ingest_jobs import DuplicateUpload, UploadTooLarge, enqueue_ingest_job, get_ingest_job
+from services.bulk_upload import AsyncReader, expand_uploads, is_supported
 from core.logger import logger
 import json
-from typing import Optional
+from typing import List, Optional
 
 router = APIRouter(prefix="/documents", tags=["Documents"])
 
@@ -26,17 +28,77 @@ async def upload_document(
             logger.error(f"Ошибка парсинга metadata: {e}")
             raise HTTPException(status_code=400, detail=f"Неверный формат JSON в metadata: {str(e)}")
         
-        # Обрабатываем документ
-        chunks = await process_document(user_id, file, metadata_dict)
-        
-        logger.info(f"Файл {file.filename} успешно загружен, создано {chunks} чанков")
+        if not is_supported(file.filename or ""):
+            raise HTTPException(status_code=400, detail=f"Неподдерживаемый тип файла: {file.filename}")
+
+        # Обработка идёт в фоновом воркере; прогресс — GET /documents/jobs/{job_id}.
+        # Файл копируется в очередь блоками, целиком в памяти не оказывается.
+        try:
+            async with get_db_pool().acquire() as conn:
+                job_id = await enqueue_ingest_job(conn, user_id, file.filename, file.content_type, file, metadata_dict)
+        except UploadTooLarge as e:
+            raise HTTPException(status_code=413, detail=str(e))
+
         return {
-            "status": "success",
+            "status": "queued",
             "filename": file.filename,
-            "chunks": chunks
+            "job_id": job_id
         }
     except HTTPException:
         raise
     except Exception as e:
         logger.error(f"Неожиданная ошибка при загрузке {file.filename}: {e}", exc_info=True)
-        raise HTTPException(status_code=500, detail=f"Внутренняя ошибка сервера: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Внутренняя ошибка сервера: {str(e)}")
+
+
+@router.post("/upload/bulk")
+async def upload_documents_bulk(
+    user_id: str = Form(...),
+    files: List[UploadFile] = File(...),
+    metadata: Optional[str] = Form("{}")
+):
+    """
+    Пакетная загрузка: несколько .txt/.pdf и/или ZIP-архивов. Каждый документ —
+    отдельная задача очереди; воркеры обрабатывают их параллельно под общим лимитом
+    запросов эмбеддингов. Одинаковые по содержимому файлы ставятся один раз.
+    """
+    try:
+        metadata_dict = json.loads(metadata)
+    except json.JSONDecodeError as e:
+        raise HTTPException(status_code=400, detail=f"Неверный формат JSON в metadata: {str(e)}")
+
+    summary = []
+    uploads = ((f.filename, f.content_type, f.file) for f in files if f.filename)
+    async with get_db_pool().acquire() as conn:
+        for item in expand_uploads(uploads):
+            entry = {"filename": item.filename, "size": item.size}
+            if item.skipped:
+                summary.append({**entry, "status": "skipped", "reason": item.skipped})
+                continue
+            try:
+                with item.open() as fileobj:
+                    job_id = await enqueue_ingest_job(
+                        conn, user_id, item.filename, item.content_type, AsyncReader(fileobj), metadata_dict, dedupe=True
+                    )
+                summary.append({**entry, "status": "queued", "job_id": job_id})
+            except DuplicateUpload as e:
+                summary.append({**entry, "status": "duplicate", "job_id": e.job_id})
+            except UploadTooLarge as e:
+                summary.append({**entry, "status": "skipped", "reason": str(e)})
+            except Exception as e:
+                logger.error(f"Пакетная загрузка: ошибка постановки {item.filename}: {e}", exc_info=True)
+                summary.append({**entry, "status": "error", "reason": str(e)})
+
+    counts = {}
+    for entry in summary:
+        counts[entry["status"]] = counts.get(entry["status"], 0) + 1
+    logger.info(f"📦 Пакетная загрузка для {user_id}: {counts}")
+    return {"status": "accepted", "counts": counts, "files": summary}
+
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: int):
+    job = await get_ingest_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Задача не найдена")
+    return job
@@ -0,0 +1,77 @@
+"""
+Заполнение эмбеддингов documents: строки без эмбеддинга, а с --reembed — и посчитанные
+другой моделью (после смены модели эмбеддингов).
+
+- строки каждого клиента идут keyset-пачками (id > last_id);
+- эмбеддинги пачки запрашиваются параллельно под общими семафором и rate limit;
+- пачка записывается одним UPDATE ... FROM (VALUES ...) вместе с контрольной точкой
+  в таблице embedding_backfill; прерванный запуск продолжается с последнего id;
+- по окончании клиента API-процессы перечитывают его индекс (уведомление documents_changed).
+
+Перед запуском выполните migrations/010_embedding_backfill.sql.
+
+Примеры:
+    python scripts/backfill_embeddings.py                         # все клиенты
+    python scripts/backfill_embeddings.py --client-id <uuid>      # один клиент
+    python scripts/backfill_embeddings.py --reembed --tenants 4   # после смены модели
+"""
+import argparse
+import asyncio
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from services.db import init_db_pool, close_db_pool, get_db_pool
+from services.embeddings import close_embedding_session, embedding_model_id, update_missing_embeddings
+from core.logger import logger
+
+
+async def list_tenants(conn, reembed: bool, model: str) -> list[str]:
+    if reembed:
+        rows = await conn.fetch("""
+            SELECT DISTINCT client_id FROM documents
+            WHERE embedding IS NULL OR embedding_model IS DISTINCT FROM $1
+            ORDER BY client_id
+        """, model)
+    else:
+        rows = await conn.fetch("SELECT DISTINCT client_id FROM documents WHERE embedding IS NULL ORDER BY client_id")
+    return [r["client_id"] for r in rows]
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Заполнение эмбеддингов документов")
+    parser.add_argument("--client-id", action="append", help="клиент (можно несколько); по умолчанию все")
+    parser.add_argument("--batch-size", type=int, default=256, help="строк в пачке (один UPDATE)")
+    parser.add_argument("--tenants", type=int, default=2, help="сколько клиентов обрабатывать одновременно")
+    parser.add_argument("--reembed", action="store_true", help="пересчитать строки другой модели")
+    args = parser.parse_args()
+
+    await init_db_pool()
+    try:
+        async with get_db_pool().acquire() as conn:
+            tenants = args.client_id or await list_tenants(conn, args.reembed, embedding_model_id())
+        logger.info(f"🚀 Backfill эмбеддингов: клиентов {len(tenants)}, модель {embedding_model_id()}")
+
+        # Лимиты запросов к API общие, параллельность по клиентам лишь не даёт простаивать на записи
+        semaphore = asyncio.Semaphore(max(1, args.tenants))
+
+        async def run(client_id: str) -> int:
+            async with semaphore:
+                return await update_missing_embeddings(client_id, args.batch_size, args.reembed)
+
+        results = await asyncio.gather(*(run(c) for c in tenants), return_exceptions=True)
+        failed = [c for c, r in zip(tenants, results) if isinstance(r, BaseException)]
+        for client_id, result in zip(tenants, results):
+            if isinstance(result, BaseException):
+                logger.error(f"❌ Клиент {client_id}: {result}")
+        updated = sum(r for r in results if not isinstance(r, BaseException))
+        logger.info(f"🏁 Готово: обновлено {updated} строк, клиентов с ошибками {len(failed)}")
+        if failed:
+            sys.exit(1)
+    finally:
+        await close_embedding_session()
+        await close_db_pool()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,94 @@
+"""
+Бенчмарк разбивки на чанки: прежний split_text против StreamingChunker
+на текстах в несколько мегабайт.
+
+    python scripts/bench_chunker.py --mb 1 4 16
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.chunking import StreamingChunker  # noqa: E402
+
+SENTENCES = [
+    "Доставка по Москве занимает от одного до трёх рабочих дней.",
+    "Оплата возможна картой, по счёту или наличными при получении.",
+    "Гарантия на всё оборудование — 12 месяцев, т.е. один год с даты покупки.",
+    "The warranty covers manufacturing defects only.",
+    "Подробности уточняйте у менеджера по телефону или в чате!",
+    "Можно ли вернуть товар?",
+]
+
+
+def make_text(size: int, seed: int = 0) -> str:
+    rnd = random.Random(seed)
+    parts, length = [], 0
+    while length < size:
+        paragraph = " ".join(rnd.choice(SENTENCES) for _ in range(rnd.randint(3, 12)))
+        parts.append(paragraph)
+        length += len(paragraph) + 2
+    return "\n\n".join(parts)[:size]
+
+
+def legacy_split_text(text: str, chunk_size: int = 1000, overlap: int = 200):
+    """Прежняя реализация из services/embeddings.py — для сравнения."""
+    chunks = []
+    start = 0
+    text_length = len(text)
+    while start < text_length:
+        end = min(start + chunk_size, text_length)
+        if end < text_length:
+            last_period = text.rfind('.', start, end)
+            last_space = text.rfind(' ', start, end)
+            cut_point = max(last_period, last_space)
+            if cut_point > start:
+                end = cut_point + 1
+        chunks.append(text[start:end].strip())
+        start = end - overlap if end < text_length else text_length
+    return chunks
+
+
+def run_streaming(text: str, chunk_size: int, overlap: int, piece: int):
+    chunker = StreamingChunker(chunk_size, overlap)
+    chunks = []
+    for i in range(0, len(text), piece):
+        chunks.extend(chunker.feed(text[i:i + piece]))
+    chunks.extend(chunker.finish())
+    return chunks
+
+
+def bench(name: str, fn, text: str, repeat: int):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        chunks = fn(text)
+        best = min(best, time.perf_counter() - started)
+    mb = len(text.encode("utf-8")) / 2 ** 20
+    print(f"  {name:<28} {len(chunks):>7} чанков  {best * 1000:>9.1f} мс  {mb / best:>7.1f} МБ/с")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mb", type=float, nargs="+", default=[1, 4, 16], help="размеры текста в МБ (UTF-8)")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--overlap", type=int, default=200)
+    parser.add_argument("--piece", type=int, default=3000, help="размер куска для потоковой подачи (≈ страница PDF)")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    sample = make_text(100_000)
+    bytes_per_char = len(sample.encode("utf-8")) / len(sample)
+    for mb in args.mb:
+        text = make_text(int(mb * 2 ** 20 / bytes_per_char))
+        print(f"{len(text.encode('utf-8')) / 2 ** 20:.1f} МБ, {len(text)} символов:")
+        bench("split_text (прежний)", lambda t: legacy_split_text(t, args.chunk_size, args.overlap), text, args.repeat)
+        bench("StreamingChunker, целиком", lambda t: run_streaming(t, args.chunk_size, args.overlap, len(t)), text, args.repeat)
+        bench(f"StreamingChunker, по {args.piece}", lambda t: run_streaming(t, args.chunk_size, args.overlap, args.piece), text, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
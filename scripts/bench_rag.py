@@ -0,0 +1,88 @@
+"""
+Офлайн-бенчмарк пути ingest → индекс → поиск на локальном провайдере эмбеддингов
+(без сети и без БД): скорость эмбеддинга чанков через общий путь get_embedding
+(лимиты, батчер), память индекса клиента и задержка поиска.
+
+    python scripts/bench_rag.py --docs 200 --latency-ms 20 --queries 500
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import settings  # noqa: E402
+from services import embeddings  # noqa: E402
+from services.chunking import chunk_text  # noqa: E402
+from services.embedding_cache import EmbeddingCache  # noqa: E402
+from services.embedding_providers import LocalHashEmbeddingProvider  # noqa: E402
+from services.vector_index import TenantIndex  # noqa: E402
+
+WORDS = (
+    "доставка оплата гарантия возврат цена скидка заказ каталог склад курьер самовывоз "
+    "менеджер телефон адрес график акция бонус рассрочка карта счёт договор сервис ремонт"
+).split()
+
+
+def make_document(rnd: random.Random, sentences: int) -> str:
+    return " ".join(
+        " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(6, 14))).capitalize() + "."
+        for _ in range(sentences)
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=200)
+    parser.add_argument("--sentences", type=int, default=150, help="предложений в документе")
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="задержка провайдера на запрос")
+    parser.add_argument("--jitter-ms", type=float, default=5.0)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--top-k", type=int, default=5)
+    args = parser.parse_args()
+
+    embeddings.set_embedding_provider(LocalHashEmbeddingProvider(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms))
+    embeddings.embedding_cache = EmbeddingCache(
+        max_entries=settings.embedding_cache_size, ttl=settings.embedding_cache_ttl, persistent=False, max_rows=0
+    )
+
+    rnd = random.Random(0)
+    chunks = [c.text for _ in range(args.docs) for c in chunk_text(make_document(rnd, args.sentences))]
+    print(f"Документов {args.docs}, чанков {len(chunks)}, провайдер {embeddings.embedding_model_id()}, "
+          f"задержка {args.latency_ms}±{args.jitter_ms} мс, concurrency {settings.embedding_concurrency}, "
+          f"rps {settings.embedding_rps}")
+
+    started = time.perf_counter()
+    vectors = await embeddings.embed_chunks(chunks)
+    elapsed = time.perf_counter() - started
+    print(f"  эмбеддинги: {elapsed:.2f} с, {len(chunks) / elapsed:.1f} чанков/с, "
+          f"батчер {embeddings.get_embedding_batcher().stats()}")
+
+    rows = [
+        {"id": i, "content": text, "metadata": {"chunk_index": i}, "embedding": vector}
+        for i, (text, vector) in enumerate(zip(chunks, vectors))
+    ]
+    index = TenantIndex.from_rows("bench", rows)
+    print(f"  индекс: {len(index)} строк, {index.nbytes / 2 ** 20:.1f} МБ")
+
+    provider = embeddings.get_embedding_provider()
+    queries = [np.asarray(provider.vector(make_document(rnd, 1)), dtype=np.float32) for _ in range(args.queries)]
+    timings = []
+    for query in queries:
+        t = time.perf_counter()
+        index.search(query, k=args.top_k, threshold=0.0)
+        timings.append((time.perf_counter() - t) * 1000)
+    p50, p95, p99 = np.percentile(timings, [50, 95, 99])
+    print(f"  поиск top-{args.top_k}: p50 {p50:.3f} мс, p95 {p95:.3f} мс, p99 {p99:.3f} мс")
+
+    t = time.perf_counter()
+    index.search_batch(np.stack(queries), k=args.top_k, threshold=0.0)
+    print(f"  поиск пачкой {len(queries)} запросов: {(time.perf_counter() - t) * 1000:.1f} мс")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
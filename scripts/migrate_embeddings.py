@@ -0,0 +1,199 @@
+"""
+Перенос documents.embedding (jsonb) в нативную колонку embedding_vec (vector).
+
+Работает без остановки сервиса:
+- строки конвертируются небольшими пачками по keyset-пагинации (id > last_id),
+  каждая пачка — отдельная короткая транзакция;
+- прогресс хранится в таблице embedding_migrations, прерванный запуск
+  продолжается с последнего id;
+- конвертация идёт на стороне PostgreSQL (jsonb::text::vector), данные по сети не гоняются;
+- после проверки выборки клиент помечается verified, и API-процессы
+  (по уведомлению documents_changed) переключаются на embedding_vec;
+  клиент со строками другой размерности не помечается без --force.
+
+Перед запуском выполните migrations/002_pgvector_hnsw.sql и 009_embedding_migrations.sql.
+
+Примеры:
+    python scripts/migrate_embeddings.py                      # все клиенты
+    python scripts/migrate_embeddings.py --client-id <uuid>   # один клиент
+    python scripts/migrate_embeddings.py --verify-only
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from services.db import init_db_pool, close_db_pool, get_db_pool
+from services.embedding_migration import STATUS_TABLE
+from services.vector_index import decode_embedding, notify_documents_changed
+from core.logger import logger
+from config import settings
+
+
+async def list_tenants(conn) -> list[str]:
+    rows = await conn.fetch("SELECT DISTINCT client_id FROM documents ORDER BY client_id")
+    return [r["client_id"] for r in rows]
+
+
+async def migrate_tenant(client_id: str, batch_size: int, pause: float):
+    pool = get_db_pool()
+    async with pool.acquire() as conn:
+        state = await conn.fetchrow(f"""
+            INSERT INTO {STATUS_TABLE} (client_id) VALUES ($1)
+            ON CONFLICT (client_id) DO UPDATE SET updated_at = now()
+            RETURNING last_id, converted, skipped, status
+        """, client_id)
+        total = await conn.fetchval("""
+            SELECT count(*) FROM documents
+            WHERE client_id = $1 AND embedding IS NOT NULL AND embedding_vec IS NULL
+        """, client_id)
+
+    if state["status"] == "verified" and not total:
+        logger.info(f"⏭ Клиент {client_id}: уже перенесён")
+        return
+
+    last_id, converted, skipped = state["last_id"], state["converted"], state["skipped"]
+    logger.info(f"🚚 Клиент {client_id}: осталось {total} строк, продолжаем с id > {last_id}")
+    started = time.monotonic()
+    done = 0
+
+    while True:
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                batch = await conn.fetch("""
+                    SELECT id,
+                           CASE WHEN jsonb_typeof(embedding) = 'array'
+                                THEN jsonb_array_length(embedding) = $4
+                                ELSE false END AS valid
+                    FROM documents
+                    WHERE client_id = $1 AND id > $2 AND embedding IS NOT NULL
+                    ORDER BY id
+                    LIMIT $3
+                """, client_id, last_id, batch_size, settings.vector_dimension)
+                if not batch:
+                    break
+                valid_ids = [r["id"] for r in batch if r["valid"]]
+                if valid_ids:
+                    await conn.execute("""
+                        UPDATE documents
+                        SET embedding_vec = (embedding::text)::vector
+                        WHERE id = ANY($1::bigint[]) AND embedding_vec IS NULL
+                    """, valid_ids)
+                last_id = batch[-1]["id"]
+                converted += len(valid_ids)
+                skipped += len(batch) - len(valid_ids)
+                await conn.execute(f"""
+                    UPDATE {STATUS_TABLE}
+                    SET last_id = $2, converted = $3, skipped = $4, updated_at = now()
+                    WHERE client_id = $1
+                """, client_id, last_id, converted, skipped)
+
+        done += len(batch)
+        rate = done / max(time.monotonic() - started, 1e-6)
+        logger.info(f"  {client_id}: {done}/{total} строк (id ≤ {last_id}), {rate:.0f} строк/с, пропущено {skipped}")
+        if pause:
+            # Даём дышать рабочей нагрузке
+            await asyncio.sleep(pause)
+
+    if skipped:
+        logger.warning(f"⚠️ Клиент {client_id}: {skipped} строк с размерностью != {settings.vector_dimension} пропущено")
+    logger.info(f"✅ Клиент {client_id}: конвертация завершена ({converted} строк)")
+
+
+async def verify_tenant(client_id: str, sample: int, force: bool = False) -> bool:
+    """
+    Сравнивает jsonb и vector на случайной выборке и помечает клиента verified.
+    Строки с другой размерностью не переносятся, а после verified индекс и pgvector
+    читают только embedding_vec — такие строки пропали бы из поиска, поэтому
+    при их наличии клиент не помечается (разве что с force).
+    """
+    pool = get_db_pool()
+    async with pool.acquire() as conn:
+        skipped_ids = [r["id"] for r in await conn.fetch("""
+            SELECT id FROM documents
+            WHERE client_id = $1 AND embedding IS NOT NULL AND embedding_vec IS NULL
+              AND NOT CASE WHEN jsonb_typeof(embedding) = 'array'
+                           THEN jsonb_array_length(embedding) = $2
+                           ELSE false END
+            ORDER BY id
+        """, client_id, settings.vector_dimension)]
+        if skipped_ids:
+            message = (
+                f"Клиент {client_id}: {len(skipped_ids)} строк с размерностью != {settings.vector_dimension} "
+                f"не перенесены и выпадут из поиска: {skipped_ids[:20]}"
+            )
+            if not force:
+                logger.error(f"❌ {message}; пересчитайте их эмбеддинги или запустите с --force")
+                return False
+            logger.warning(f"⚠️ {message} (--force)")
+
+        pending = await conn.fetchval("""
+            SELECT count(*) FROM documents
+            WHERE client_id = $1 AND embedding IS NOT NULL AND embedding_vec IS NULL
+              AND CASE WHEN jsonb_typeof(embedding) = 'array'
+                       THEN jsonb_array_length(embedding) = $2
+                       ELSE false END
+        """, client_id, settings.vector_dimension)
+        rows = await conn.fetch("""
+            SELECT id, embedding, embedding_vec
+            FROM documents
+            WHERE client_id = $1 AND embedding_vec IS NOT NULL
+            ORDER BY random()
+            LIMIT $2
+        """, client_id, sample)
+
+        mismatched = [
+            r["id"] for r in rows
+            if not np.allclose(decode_embedding(r["embedding"]), decode_embedding(r["embedding_vec"]), atol=1e-6)
+        ]
+        if pending or mismatched:
+            logger.error(
+                f"❌ Клиент {client_id}: не перенесено {pending}, расхождения в {len(mismatched)} из {len(rows)}: {mismatched[:10]}"
+            )
+            return False
+
+        await conn.execute(f"""
+            UPDATE {STATUS_TABLE} SET status = 'verified', updated_at = now() WHERE client_id = $1
+        """, client_id)
+        # API-процессы перечитают индекс клиента уже из embedding_vec
+        await notify_documents_changed(conn, client_id)
+    logger.info(f"🔎 Клиент {client_id}: проверено {len(rows)} векторов, переключён на embedding_vec")
+    return True
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Перенос эмбеддингов из jsonb в vector")
+    parser.add_argument("--client-id", action="append", help="клиент (можно несколько); по умолчанию все")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--pause", type=float, default=0.05, help="пауза между пачками, сек")
+    parser.add_argument("--verify-sample", type=int, default=50)
+    parser.add_argument("--verify-only", action="store_true")
+    parser.add_argument("--force", action="store_true",
+                        help="помечать verified, даже если есть строки с другой размерностью (они выпадут из поиска)")
+    args = parser.parse_args()
+
+    await init_db_pool()
+    try:
+        async with get_db_pool().acquire() as conn:
+            tenants = args.client_id or await list_tenants(conn)
+
+        failed = []
+        for client_id in tenants:
+            if not args.verify_only:
+                await migrate_tenant(client_id, args.batch_size, args.pause)
+            if not await verify_tenant(client_id, args.verify_sample, args.force):
+                failed.append(client_id)
+
+        logger.info(f"🏁 Готово: клиентов {len(tenants)}, с ошибками проверки {len(failed)}")
+        if failed:
+            sys.exit(1)
+    finally:
+        await close_db_pool()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
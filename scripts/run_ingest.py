@@ -1,13 +1,36 @@
+"""
+Полная переиндексация базы знаний клиента из локальной папки
+<CLIENT_DOCS_DIR>/<folder>/ (.txt, .pdf).
+
+    python scripts/run_ingest.py --client-id <uuid> --folder feedtech
+"""
+import argparse
 import asyncio
-from services.ingest_client_docs import ingest_client_folder
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from services.db import init_db_pool, close_db_pool
+from services.embeddings import close_embedding_session
+from services.extraction import shutdown_extraction_executor
+from services.ingest_client_docs import LocalFolderSource, ingest_client_folder
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Переиндексация папки клиента")
+    parser.add_argument("--client-id", required=True)
+    parser.add_argument("--folder", required=True, help="имя папки внутри корня")
+    parser.add_argument("--root", help="корень папок клиентов (по умолчанию settings.client_docs_dir)")
+    args = parser.parse_args()
+
+    await init_db_pool()
+    try:
+        await ingest_client_folder(args.client_id, args.folder, LocalFolderSource(args.root))
+    finally:
+        await close_embedding_session()
+        shutdown_extraction_executor()
+        await close_db_pool()
 
-CLIENT_ID = "4c019799-2c8b-40d3-9966-589097810e99"
-FOLDER_NAME = "feedtech"
 
 if __name__ == "__main__":
-    asyncio.run(
-        ingest_client_folder(
-            CLIENT_ID,
-            FOLDER_NAME,
-        )
-    )
\ No newline at end of file
+    asyncio.run(main())
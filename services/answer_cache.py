@@ -0,0 +1,118 @@
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+
+from config import settings
+
+
+@dataclass
+class _Entry:
+    vector: np.ndarray      # float32, единичной длины
+    scope: Hashable         # всё, кроме вопроса, что влияет на ответ (например, system_extra)
+    reply: str
+    sources: List[str]
+    expires: float
+
+
+@dataclass
+class _TenantAnswers:
+    version: Any
+    entries: List[_Entry] = field(default_factory=list)
+    _matrix: Optional[np.ndarray] = None
+
+    def matrix(self) -> np.ndarray:
+        if self._matrix is None:
+            self._matrix = np.stack([e.vector for e in self.entries])
+        return self._matrix
+
+
+class AnswerCache:
+    """
+    Готовые ответы по client_id с поиском по смыслу: новый вопрос сравнивается
+    с эмбеддингами закэшированных, при косинусной близости >= threshold
+    возвращается сохранённый ответ без поиска по документам и генерации.
+    Записи клиента привязаны к версии его документов (vector_index.version) —
+    после любого изменения документов весь кэш клиента сбрасывается.
+    """
+
+    def __init__(self, threshold: float, ttl: float, max_per_tenant: int):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_per_tenant = max_per_tenant
+        self._tenants: Dict[str, _TenantAnswers] = {}
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _normalize(vector) -> Optional[np.ndarray]:
+        vec = np.asarray(vector, dtype=np.float32)
+        norm = float(np.linalg.norm(vec))
+        return vec / norm if norm else None
+
+    def _tenant(self, client_id: str, version: Any) -> Optional[_TenantAnswers]:
+        tenant = self._tenants.get(client_id)
+        if tenant is not None and tenant.version != version:
+            del self._tenants[client_id]
+            self.invalidations += 1
+            return None
+        return tenant
+
+    def lookup(self, client_id: str, scope: Hashable, vector, version: Any) -> Optional[Tuple[str, List[str], float]]:
+        """(ответ, источники, близость) или None."""
+        tenant = self._tenant(client_id, version)
+        query = self._normalize(vector)
+        if tenant is None or query is None or tenant.matrix().shape[1] != query.shape[0]:
+            self.misses += 1
+            return None
+        scores = tenant.matrix() @ query
+        now = time.monotonic()
+        for i in np.argsort(-scores):
+            if scores[i] < self.threshold:
+                break
+            entry = tenant.entries[i]
+            if entry.scope == scope and entry.expires > now:
+                self.hits += 1
+                return entry.reply, entry.sources, float(scores[i])
+        self.misses += 1
+        return None
+
+    def store(self, client_id: str, scope: Hashable, vector, reply: str, sources: List[str], version: Any):
+        vec = self._normalize(vector)
+        if vec is None:
+            return
+        tenant = self._tenant(client_id, version)
+        if tenant is None:
+            tenant = self._tenants[client_id] = _TenantAnswers(version)
+        now = time.monotonic()
+        entries = [
+            e for e in tenant.entries
+            if e.expires > now and e.vector.shape == vec.shape
+        ]
+        entries.append(_Entry(vec, scope, reply, list(sources), now + self.ttl))
+        # Старые записи вытесняются первыми
+        tenant.entries = entries[-self.max_per_tenant:]
+        tenant._matrix = None
+        self.stores += 1
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "tenants": len(self._tenants),
+            "entries": sum(len(t.entries) for t in self._tenants.values()),
+            "hits": self.hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "invalidations": self.invalidations,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+answer_cache = AnswerCache(
+    threshold=settings.answer_cache_threshold,
+    ttl=settings.answer_cache_ttl,
+    max_per_tenant=settings.answer_cache_max_per_tenant,
+)
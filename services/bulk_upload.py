@@ -0,0 +1,91 @@
+import asyncio
+import mimetypes
+import zipfile
+from dataclasses import dataclass
+from pathlib import PurePosixPath
+from typing import BinaryIO, Callable, Iterable, Iterator, Optional, Tuple
+
+from config import settings
+
+SUPPORTED_EXTENSIONS = (".txt", ".pdf")
+# Флаг 0x800 в zip: имя в UTF-8. Без него Windows-архиваторы пишут имена в cp866
+_ZIP_UTF8_FLAG = 0x800
+
+
+@dataclass
+class BulkItem:
+    """Один файл пакетной загрузки: обычный или извлекаемый из ZIP."""
+    filename: str
+    content_type: Optional[str]
+    size: Optional[int]
+    open: Optional[Callable[[], BinaryIO]] = None
+    skipped: Optional[str] = None  # причина, если файл не обрабатывается
+
+
+class AsyncReader:
+    """Синхронный файл с интерфейсом async read(size); распаковка идёт в потоке."""
+
+    def __init__(self, file: BinaryIO):
+        self._file = file
+
+    async def read(self, size: int = -1) -> bytes:
+        return await asyncio.to_thread(self._file.read, size)
+
+
+def is_supported(filename: str) -> bool:
+    return filename.lower().endswith(SUPPORTED_EXTENSIONS)
+
+
+def zip_member_name(info: zipfile.ZipInfo) -> str:
+    name = info.filename
+    if not info.flag_bits & _ZIP_UTF8_FLAG:
+        try:
+            name = name.encode("cp437").decode("cp866")
+        except (UnicodeEncodeError, UnicodeDecodeError):
+            pass
+    return PurePosixPath(name).name
+
+
+def _zip_items(archive_name: str, fileobj: BinaryIO) -> Iterator[BulkItem]:
+    try:
+        archive = zipfile.ZipFile(fileobj)
+    except zipfile.BadZipFile:
+        yield BulkItem(archive_name, None, None, skipped="повреждённый ZIP")
+        return
+    limit = settings.max_upload_mb * 1024 * 1024
+    for info in archive.infolist():
+        name = zip_member_name(info)
+        if info.is_dir() or not name or info.filename.startswith("__MACOSX/") or name.startswith("."):
+            continue
+        if not is_supported(name):
+            yield BulkItem(name, None, info.file_size, skipped="неподдерживаемый тип файла")
+        elif info.file_size > limit:
+            yield BulkItem(name, None, info.file_size, skipped=f"больше {settings.max_upload_mb} МБ")
+        else:
+            yield BulkItem(
+                name, mimetypes.guess_type(name)[0], info.file_size,
+                open=lambda info=info: archive.open(info),
+            )
+
+
+def expand_uploads(files: Iterable[Tuple[str, Optional[str], BinaryIO]]) -> Iterator[BulkItem]:
+    """
+    Разворачивает загруженные файлы (имя, content-type, файл) в список документов:
+    ZIP-архивы — в содержащиеся .txt/.pdf, неподдерживаемые файлы помечаются skipped.
+    Не больше bulk_max_files документов; остальные тоже skipped.
+    """
+    count = 0
+    for filename, content_type, fileobj in files:
+        if filename.lower().endswith(".zip"):
+            items = _zip_items(filename, fileobj)
+        elif is_supported(filename):
+            items = iter([BulkItem(filename, content_type, None, open=lambda f=fileobj: f)])
+        else:
+            items = iter([BulkItem(filename, content_type, None, skipped="неподдерживаемый тип файла")])
+        for item in items:
+            if item.skipped is None:
+                count += 1
+                if count > settings.bulk_max_files:
+                    item.open = None
+                    item.skipped = f"больше {settings.bulk_max_files} файлов в одной загрузке"
+            yield item
@@ -0,0 +1,148 @@
+import hashlib
+import json
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from services.vector_index import vector_index, notify_documents_changed
+from core.logger import logger
+
+# Строки, сохранённые до появления колонки embedding_model, посчитаны этой моделью
+LEGACY_EMBEDDING_MODEL = "yandex:text-search-doc"
+
+COLUMNS = ["id", "content", "metadata", "embedding", "embedding_vec", "client_id", "content_hash", "embedding_model"]
+
+
+def chunk_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+async def reserve_document_ids(conn, count: int) -> List[int]:
+    """id из последовательности documents заранее: COPY не умеет RETURNING, а индексу в памяти нужны id строк."""
+    rows = await conn.fetch(
+        "SELECT nextval(pg_get_serial_sequence('documents', 'id')) AS id FROM generate_series(1, $1)",
+        count,
+    )
+    return [r["id"] for r in rows]
+
+
+def document_record(doc_id: int, client_id: str, model: str, content: str, metadata: Dict[str, Any], embedding) -> tuple:
+    """Кортеж значений в порядке COLUMNS для copy_records_to_table."""
+    return (
+        doc_id,
+        content,
+        json.dumps(metadata, ensure_ascii=False),
+        json.dumps([float(x) for x in embedding]),
+        np.asarray(embedding, dtype=np.float32),
+        str(client_id),
+        chunk_hash(content),
+        model,
+    )
+
+
+class ExistingChunks:
+    """
+    Уже сохранённые чанки документа, сгруппированные по sha256 текста.
+    match() забирает строку под новый чанк, stale() — всё, что не пригодилось.
+    Строки другой модели эмбеддингов или без эмбеддинга не переиспользуются.
+    """
+
+    def __init__(self, rows, model: str):
+        self._available = defaultdict(list)
+        self._stale = []
+        for row in rows:
+            row_model = row["embedding_model"] or LEGACY_EMBEDDING_MODEL
+            if row["has_embedding"] and row_model == model:
+                self._available[row["content_hash"] or chunk_hash(row["content"])].append(row["id"])
+            else:
+                self._stale.append(row["id"])
+
+    def match(self, chunk: str) -> Optional[int]:
+        ids = self._available.get(chunk_hash(chunk))
+        return ids.pop(0) if ids else None
+
+    def stale(self) -> List[int]:
+        return self._stale + [doc_id for ids in self._available.values() for doc_id in ids]
+
+
+async def load_existing_chunks(conn, client_id: str, filename: str, model: str) -> ExistingChunks:
+    rows = await conn.fetch("""
+        SELECT id, content, content_hash, embedding_model, embedding IS NOT NULL AS has_embedding
+        FROM documents
+        WHERE client_id = $1 AND metadata->>'filename' = $2
+        ORDER BY id
+    """, str(client_id), filename)
+    return ExistingChunks(rows, model)
+
+
+class ChunkWriter:
+    """
+    Изменения чанков одного документа. flush() применяет их одной транзакцией:
+    новые строки — через COPY, неизменившиеся — обновлением метаданных,
+    исчезнувшие — удалением. Если документ упал, в таблице не остаётся
+    половины чанков, а тысяча чанков — это несколько запросов вместо тысячи INSERT.
+    """
+
+    def __init__(self, client_id: str, embedding_model: str):
+        self.client_id = str(client_id)
+        self.embedding_model = embedding_model
+        self._rows: List[Dict[str, Any]] = []
+        self._kept: Dict[int, Dict[str, Any]] = {}
+        self._deleted: List[int] = []
+
+    def __len__(self) -> int:
+        return len(self._rows) + len(self._kept)
+
+    def add(self, content: str, embedding: List[float], metadata: Dict[str, Any]):
+        self._rows.append({"content": content, "metadata": metadata, "embedding": embedding})
+
+    def keep(self, doc_id: int, content: str, metadata: Dict[str, Any]):
+        """Существующая строка с тем же текстом: эмбеддинг остаётся, метаданные обновляются."""
+        self._kept[doc_id] = {"content": content, "metadata": metadata}
+
+    def delete(self, ids: List[int]):
+        self._deleted.extend(ids)
+
+    async def flush(self, conn) -> int:
+        """Применяет изменения и возвращает число актуальных чанков документа."""
+        rows, self._rows = self._rows, []
+        kept, self._kept = self._kept, {}
+        deleted, self._deleted = self._deleted, []
+        if not (rows or kept or deleted):
+            return 0
+
+        async with conn.transaction():
+            if deleted:
+                await conn.execute("DELETE FROM documents WHERE id = ANY($1::bigint[])", deleted)
+            if kept:
+                await conn.executemany("""
+                    UPDATE documents
+                    SET metadata = $2::jsonb, content_hash = $3, embedding_model = $4
+                    WHERE id = $1
+                """, [
+                    (doc_id, json.dumps(k["metadata"], ensure_ascii=False), chunk_hash(k["content"]), self.embedding_model)
+                    for doc_id, k in kept.items()
+                ])
+            if rows:
+                ids = await reserve_document_ids(conn, len(rows))
+                records = []
+                for row, doc_id in zip(rows, ids):
+                    row["id"] = doc_id
+                    records.append(document_record(
+                        doc_id, self.client_id, self.embedding_model, row["content"], row["metadata"], row["embedding"]
+                    ))
+                await conn.copy_records_to_table("documents", records=records, columns=COLUMNS)
+            # Уведомление уйдёт другим процессам только после commit
+            await notify_documents_changed(conn, self.client_id)
+
+        if deleted:
+            vector_index.remove(self.client_id, deleted)
+        if kept:
+            vector_index.update_metadata(self.client_id, {doc_id: k["metadata"] for doc_id, k in kept.items()})
+        if rows:
+            vector_index.upsert(self.client_id, rows)
+        logger.info(
+            f"💾 Клиент {self.client_id}: новых чанков {len(rows)}, без изменений {len(kept)}, удалено {len(deleted)}"
+        )
+        return len(rows) + len(kept)
@@ -0,0 +1,149 @@
+import re
+from dataclasses import dataclass
+from typing import AsyncIterator, Iterator, List, Optional
+
+from config import settings
+
+# Границы в порядке предпочтения: абзац, конец предложения, пробел.
+# Предложение кончается на .!?… (возможно с закрывающей кавычкой/скобкой),
+# а следующее начинается с заглавной буквы, цифры, кавычки или тире.
+_PARAGRAPH = re.compile(r"\n[ \t]*\n\s*")
+_SENTENCE = re.compile(r"(\w*)[.!?…]+[\"'»”)\]]*\s+(?=[A-ZА-ЯЁ0-9«\"'(\[—–-])")
+_SPACE = re.compile(r"\s+")
+
+# Точка после сокращения или инициала — не конец предложения («г. Москва», «А. С. Пушкин»)
+_ABBREVIATIONS = {
+    "гг", "вв", "ул", "стр", "рис", "табл", "см", "им", "др", "проф", "руб", "коп", "тыс", "млн",
+    "mr", "mrs", "ms", "dr", "prof", "vs", "fig", "no",
+}
+
+
+@dataclass(frozen=True)
+class Chunk:
+    """Чанк и его положение в исходном тексте: text == source[start:end]."""
+    text: str
+    start: int
+    end: int
+
+
+def _last_boundary(pattern: re.Pattern, text: str, lo: int, hi: int) -> Optional[int]:
+    """Позиция после последнего совпадения pattern, целиком лежащего в text[lo:hi]."""
+    cut = None
+    for match in pattern.finditer(text, lo, hi):
+        cut = match.end()
+    return cut
+
+
+def _last_sentence_end(text: str, lo: int, hi: int) -> Optional[int]:
+    cut = None
+    for match in _SENTENCE.finditer(text, lo, hi):
+        word = match.group(1)
+        if text[match.end(1)] == "." and (len(word) == 1 or word.lower() in _ABBREVIATIONS):
+            continue
+        cut = match.end()
+    return cut
+
+
+class StreamingChunker:
+    """
+    Потоковая разбивка текста на чанки не длиннее chunk_size с перекрытием
+    не больше overlap символов. Режет по абзацам, затем по предложениям,
+    затем по пробелам; длинное слово без пробелов режется жёстко.
+    Текст подаётся кусками через feed(), остаток отдаёт finish().
+    Каждая граница ищется только в пределах одного окна, поэтому время линейно
+    от длины текста, а память ограничена окном и последним куском.
+    """
+
+    def __init__(self, chunk_size: Optional[int] = None, overlap: Optional[int] = None):
+        self.chunk_size = chunk_size or settings.chunk_size
+        self.overlap = settings.chunk_overlap if overlap is None else overlap
+        if not 0 <= self.overlap < self.chunk_size:
+            raise ValueError("chunk_overlap должен быть меньше chunk_size")
+        self._buffer = ""
+        self._offset = 0  # позиция _buffer[0] в исходном тексте
+        self._pos = 0     # начало следующего чанка внутри _buffer
+
+    def feed(self, text: str) -> Iterator[Chunk]:
+        if self._pos:
+            self._offset += self._pos
+            self._buffer = self._buffer[self._pos:]
+            self._pos = 0
+        self._buffer += text
+        # Ждём хотя бы один символ за окном, чтобы знать, что окно заполнено
+        while len(self._buffer) - self._pos > self.chunk_size:
+            chunk = self._cut()
+            if chunk is not None:
+                yield chunk
+
+    def finish(self) -> Iterator[Chunk]:
+        while self._pos < len(self._buffer):
+            if len(self._buffer) - self._pos > self.chunk_size:
+                chunk = self._cut()
+            else:
+                chunk = self._emit(self._pos, len(self._buffer))
+                self._pos = len(self._buffer)
+            if chunk is not None:
+                yield chunk
+        self._offset += len(self._buffer)
+        self._buffer = ""
+        self._pos = 0
+
+    def _cut(self) -> Optional[Chunk]:
+        start = self._pos
+        hi = start + self.chunk_size
+        # Граница абзаца/предложения — не раньше середины окна, чтобы не плодить огрызки
+        half = start + self.chunk_size // 2
+        end = (
+            _last_boundary(_PARAGRAPH, self._buffer, half, hi)
+            or _last_sentence_end(self._buffer, half, hi)
+            or _last_boundary(_SPACE, self._buffer, start + self.overlap + 1, hi)
+            or hi
+        )
+        chunk = self._emit(start, end)
+
+        # Перекрытие: отступаем на overlap символов и выравниваем вперёд до начала слова.
+        # Если граница нашлась раньше конца окна, перекрытие урезается на этот запас,
+        # чтобы шаг был не меньше chunk_size - overlap, как у полного окна
+        slack = hi - end
+        next_start = max(end - max(self.overlap - slack, 0), start + 1)
+        at_word = self._buffer[next_start - 1].isspace() and not self._buffer[next_start].isspace()
+        if next_start < end and not at_word:
+            space = _SPACE.search(self._buffer, next_start, end)
+            next_start = space.end() if space else end
+        self._pos = next_start
+        return chunk
+
+    def _emit(self, start: int, end: int) -> Optional[Chunk]:
+        raw = self._buffer[start:end]
+        text = raw.strip()
+        if not text:
+            return None
+        lead = len(raw) - len(raw.lstrip())
+        begin = self._offset + start + lead
+        return Chunk(text, begin, begin + len(text))
+
+
+def chunk_text(text: str, chunk_size: Optional[int] = None, overlap: Optional[int] = None) -> List[Chunk]:
+    chunker = StreamingChunker(chunk_size, overlap)
+    return [*chunker.feed(text), *chunker.finish()]
+
+
+async def iter_chunks(
+    pieces: AsyncIterator[str],
+    chunk_size: Optional[int] = None,
+    overlap: Optional[int] = None,
+    separator: str = "",
+) -> AsyncIterator[Chunk]:
+    """
+    Чанки текста, приходящего кусками (блоками .txt, страницами PDF). Куски
+    склеиваются через separator (по умолчанию — как есть, см. iter_document_text);
+    смещения чанков считаются в склеенном тексте.
+    """
+    chunker = StreamingChunker(chunk_size, overlap)
+    first = True
+    async for piece in pieces:
+        for chunk in chunker.feed(piece if first else separator + piece):
+            yield chunk
+        first = False
+    for chunk in chunker.finish():
+        yield chunk
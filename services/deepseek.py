@@ -1,8 +1,13 @@
-import httpx
+import hashlib
 import json
-from typing import Tuple, List, Optional
-from config import settings
+import time
+from typing import AsyncIterator, Tuple, List, Optional
 from services.rag import retrieve_relevant_docs
+from services.embeddings import get_embedding
+from services.vector_index import vector_index
+from services.answer_cache import answer_cache
+from services.prompt import PromptSegment, STATIC, SESSION, VOLATILE, build_messages
+from services.llm import chat_completion, extract_content, stream_chat_completion
 from core.logger import logger
 
 
@@ -13,59 +18,47 @@ from core.logger import logger
 async def ask_deepseek(
     messages: list,
     temperature: float = 0.1,
-    max_tokens: int = 2000
+    max_tokens: int = 2000,
+    client_id: Optional[str] = None
 ) -> str:
 
-    async with httpx.AsyncClient(timeout=60.0) as client:
-        resp = await client.post(
-            f"{settings.deepseek_api_url}/chat/completions",
-            headers={
-                "Authorization": f"Bearer {settings.deepseek_api_key}",
-                "Content-Type": "application/json",
-            },
-            json={
-                "model": settings.chat_model,
-                "messages": messages,
-                "temperature": temperature,
-                "max_tokens": max_tokens,
-            },
-        )
-
-    data = resp.json()
+    # Общий HTTP/2-клиент и роутер провайдеров (services/llm.py): основной —
+    # llm_provider, при задержке сверх p95 или сбое — резервный из llm_providers
+    # client_id — очередь в справедливом планировщике вызовов
+    data = await chat_completion(messages, temperature, max_tokens, client_id=client_id)
 
     logger.info(f"DeepSeek RAW: {data}")
 
     # 🔒 безопасный парсинг ответа
-    if isinstance(data, dict):
-        choices = data.get("choices")
+    content = extract_content(data)
+    if content is not None:
+        return content
 
-        if choices and isinstance(choices, list):
-            first = choices[0]
-
-            # OpenAI-style формат
-            if "message" in first:
-                content = first["message"].get("content")
-                if content:
-                    return content
+    raise ValueError(f"Unexpected DeepSeek response: {data}")
 
-            # альтернативный формат
-            if "text" in first:
-                return first["text"]
 
-    raise ValueError(f"Unexpected DeepSeek response: {data}")
+def stream_deepseek(
+    messages: list,
+    temperature: float = 0.1,
+    max_tokens: int = 2000,
+    client_id: Optional[str] = None
+) -> AsyncIterator[str]:
+    """Потоковый вариант ask_deepseek: дельты текста по мере генерации."""
+    return stream_chat_completion(messages, temperature, max_tokens, client_id=client_id)
 
 
 # ===============================
 # Universal SaaS RAG Logic
 # ===============================
 
-async def ask_with_rag(
+async def build_rag_messages(
     user_message: str,
     user_id: Optional[str] = None,
     use_rag: bool = True,
     system_extra: Optional[str] = None,
-    context_info: Optional[str] = None
-) -> Tuple[str, List[str]]:
+    context_info: Optional[str] = None,
+    system_dynamic: Optional[str] = None
+) -> Tuple[list, List[str]]:
 
     sources = []
 
@@ -123,15 +116,6 @@ async def ask_with_rag(
             "Ты начинаешь разговор, можешь поприветствовать клиента."
         )
 
-    extra = system_extra.strip() if system_extra else ""
-
-    full_extra = f"{greeting_instruction}\n{extra}".strip()
-
-    if context_summary:
-        full_extra += f"\n\n{context_summary}"
-
-    full_system_block = f"{base_system}\n{full_extra}".strip()
-
     # ===============================
     # RAG
     # ===============================
@@ -151,34 +135,88 @@ async def ask_with_rag(
                 for doc in docs
             ]
 
-            system_prompt = f"""{full_system_block}
-
-Отвечай, используя информацию из документов ниже.
+            rag_block = f"""Отвечай, используя информацию из документов ниже.
 Если ответа в документах нет — честно скажи об этом.
 
 Документы:
-{context_docs}
-"""
+{context_docs}"""
         else:
-            system_prompt = f"""{full_system_block}
-
-Если информации нет — честно скажи об этом.
-"""
+            rag_block = "Если информации нет — честно скажи об этом."
     else:
-        system_prompt = f"""{full_system_block}
-
-Ты — полезный ИИ-ассистент. Отвечай дружелюбно.
-"""
+        rag_block = "Ты — полезный ИИ-ассистент. Отвечай дружелюбно."
 
     # ===============================
     # Формирование запроса к LLM
     # ===============================
 
-    messages = [
-        {"role": "system", "content": system_prompt},
-        {"role": "user", "content": user_message},
+    # От статичного к изменчивому: базовая роль и инструкции клиента образуют
+    # неизменный префикс, который провайдер берёт из кэша контекста
+    segments = [
+        PromptSegment("base", base_system, STATIC),
+        PromptSegment("tenant", system_extra or "", STATIC),
+        PromptSegment("greeting", greeting_instruction, SESSION),
+        PromptSegment("summary", context_summary, SESSION),
+        PromptSegment("rag", rag_block, VOLATILE),
+        PromptSegment("dialog", system_dynamic or "", VOLATILE),
     ]
 
-    reply = await ask_deepseek(messages)
+    messages = build_messages(segments, user_message)
+
+    return messages, sources
+
+
+async def ask_with_rag(
+    user_message: str,
+    user_id: Optional[str] = None,
+    use_rag: bool = True,
+    system_extra: Optional[str] = None,
+    context_info: Optional[str] = None,
+    system_dynamic: Optional[str] = None
+) -> Tuple[str, List[str]]:
+
+    messages, sources = await build_rag_messages(
+        user_message, user_id, use_rag, system_extra, context_info, system_dynamic
+    )
+
+    reply = await ask_deepseek(messages, client_id=user_id)
+
+    return reply, sources
+
+async def ask_with_rag_cached(
+    user_message: str,
+    user_id: str,
+    system_extra: Optional[str] = None
+) -> Tuple[str, List[str], bool]:
+    """
+    ask_with_rag для запросов без контекста диалога через кэш ответов клиента:
+    перефраз уже заданного вопроса получает сохранённый ответ.
+    Возвращает (ответ, источники, из кэша ли ответ).
+    """
+    scope = hashlib.sha256((system_extra or "").encode("utf-8")).hexdigest()
+    # Версию берём до поиска: если документы изменятся во время генерации,
+    # ответ сохранится под старой версией и сразу будет отброшен
+    version = vector_index.version(user_id)
+    started = time.perf_counter()
+    try:
+        query_embedding = await get_embedding(user_message)
+    except Exception as e:
+        logger.error(f"Кэш ответов: не удалось получить эмбеддинг вопроса: {e}")
+        query_embedding = None
+
+    if query_embedding:
+        hit = answer_cache.lookup(user_id, scope, query_embedding, version)
+        if hit is not None:
+            reply, sources, score = hit
+            logger.info(
+                f"⚡ Ответ из кэша клиента {user_id} (близость {score:.3f}, "
+                f"{(time.perf_counter() - started) * 1000:.1f} мс)"
+            )
+            return reply, sources, True
+
+    reply, sources = await ask_with_rag(user_message, user_id, True, system_extra)
 
-    return reply, sources
\ No newline at end of file
+    # Без найденных документов не кэшируем: retrieve_relevant_docs глушит ошибки поиска,
+    # и ответ «без контекста» иначе отдавался бы до следующего изменения документов
+    if query_embedding and sources:
+        answer_cache.store(user_id, scope, query_embedding, reply, sources, version)
+    return reply, sources, False
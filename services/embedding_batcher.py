@@ -0,0 +1,102 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from services.singleflight import SingleFlight
+from core.logger import logger
+
+FetchOne = Callable[[str], Awaitable[List[float]]]
+FetchBatch = Callable[[List[str]], Awaitable[List[List[float]]]]
+
+
+class EmbeddingBatcher:
+    """
+    Коалесцирование запросов эмбеддингов под нагрузкой (чаты, Avito, ingest):
+    - одинаковые тексты, запрошенные одновременно, считаются один раз (single-flight);
+    - новые тексты копятся `window` секунд (или до `max_batch`) и уходят пачкой;
+    - пачка отправляется либо одним вызовом `fetch_batch` (если провайдер умеет батчи),
+      либо параллельными `fetch_one`, но не больше `max_fanout` одновременно.
+    """
+
+    def __init__(
+        self,
+        fetch_one: FetchOne,
+        fetch_batch: Optional[FetchBatch] = None,
+        window: float = 0.005,
+        max_batch: int = 32,
+        max_fanout: int = 8,
+    ):
+        self.fetch_one = fetch_one
+        self.fetch_batch = fetch_batch
+        self.window = window
+        self.max_batch = max_batch
+        self._semaphore = asyncio.Semaphore(max_fanout)
+        self._flight = SingleFlight()
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: Set[asyncio.Task] = set()
+        self.requests = 0
+        self.batches = 0
+        self.dispatched = 0
+
+    async def embed(self, text: str) -> List[float]:
+        self.requests += 1
+        return await self._flight.do(text, lambda: self._enqueue(text))
+
+    async def _enqueue(self, text: str) -> List[float]:
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._pending.append((text, fut))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await fut
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        task = asyncio.ensure_future(self._dispatch(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _dispatch(self, batch: List[Tuple[str, asyncio.Future]]):
+        self.batches += 1
+        self.dispatched += len(batch)
+        if self.fetch_batch is not None:
+            try:
+                async with self._semaphore:
+                    results = await self.fetch_batch([text for text, _ in batch])
+                for (_, fut), result in zip(batch, results):
+                    if not fut.done():
+                        fut.set_result(result)
+            except Exception as e:
+                logger.error(f"Ошибка пакетного запроса эмбеддингов ({len(batch)} текстов): {e}")
+                for _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+            return
+
+        async def one(text: str, fut: asyncio.Future):
+            try:
+                async with self._semaphore:
+                    result = await self.fetch_one(text)
+            except Exception as e:
+                if not fut.done():
+                    fut.set_exception(e)
+            else:
+                if not fut.done():
+                    fut.set_result(result)
+
+        await asyncio.gather(*(one(text, fut) for text, fut in batch))
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "requests": self.requests,
+            "deduplicated": self._flight.shared,
+            "batches": self.batches,
+            "dispatched": self.dispatched,
+        }
@@ -0,0 +1,149 @@
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from services.db import get_db_pool
+from core.logger import logger
+from config import settings
+
+# Каждые N записей в persistent-слой чистим устаревшие строки
+_PRUNE_EVERY = 1000
+# Не больше строк за один проход prune: DELETE остаётся коротким, остаток — в следующий раз
+_PRUNE_BATCH = 5000
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Двухуровневый кэш эмбеддингов по ключу (model URI, sha256(text)):
+    LRU в памяти процесса + таблица embedding_cache в PostgreSQL (float32 в bytea).
+    Оба уровня с TTL; память ограничена числом записей, таблица — числом строк.
+    """
+
+    def __init__(self, max_entries: int, ttl: float, persistent: bool, max_rows: int):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.persistent = persistent
+        self.max_rows = max_rows
+        self._memory: "OrderedDict[Tuple[str, str], Tuple[np.ndarray, float]]" = OrderedDict()
+        self._writes = 0
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+
+    def _get_memory(self, key) -> Optional[np.ndarray]:
+        item = self._memory.get(key)
+        if item is None:
+            return None
+        vector, expires = item
+        if expires < time.monotonic():
+            del self._memory[key]
+            return None
+        self._memory.move_to_end(key)
+        return vector
+
+    def _put_memory(self, key, vector: np.ndarray):
+        self._memory[key] = (vector, time.monotonic() + self.ttl)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    @staticmethod
+    def _pool():
+        try:
+            return get_db_pool()
+        except RuntimeError:
+            return None
+
+    async def get(self, model: str, text: str) -> Optional[List[float]]:
+        key = (model, text_hash(text))
+        vector = self._get_memory(key)
+        if vector is not None:
+            self.memory_hits += 1
+            return vector.tolist()
+
+        pool = self._pool() if self.persistent else None
+        if pool is not None:
+            try:
+                async with pool.acquire() as conn:
+                    data = await conn.fetchval("""
+                        SELECT embedding FROM embedding_cache
+                        WHERE model = $1 AND text_hash = $2
+                          AND created_at > now() - make_interval(secs => $3)
+                    """, key[0], key[1], float(self.ttl))
+                if data is not None:
+                    vector = np.frombuffer(data, dtype=np.float32)
+                    self._put_memory(key, vector)
+                    self.db_hits += 1
+                    return vector.tolist()
+            except Exception as e:
+                logger.warning(f"embedding_cache: ошибка чтения: {e}")
+
+        self.misses += 1
+        return None
+
+    async def put(self, model: str, text: str, embedding: List[float]):
+        key = (model, text_hash(text))
+        vector = np.asarray(embedding, dtype=np.float32)
+        self._put_memory(key, vector)
+
+        pool = self._pool() if self.persistent else None
+        if pool is None:
+            return
+        try:
+            async with pool.acquire() as conn:
+                await conn.execute("""
+                    INSERT INTO embedding_cache (model, text_hash, embedding)
+                    VALUES ($1, $2, $3)
+                    ON CONFLICT (model, text_hash) DO UPDATE SET
+                        embedding = EXCLUDED.embedding,
+                        created_at = now()
+                """, key[0], key[1], vector.tobytes())
+                self._writes += 1
+                if self._writes % _PRUNE_EVERY == 0:
+                    await self.prune(conn)
+        except Exception as e:
+            logger.warning(f"embedding_cache: ошибка записи: {e}")
+
+    async def prune(self, conn):
+        """Удаляет строки старше TTL и самые старые сверх max_rows, не больше _PRUNE_BATCH за раз."""
+        # Граница переполнения — created_at самой старой из max_rows свежих строк,
+        # один проход по индексу вместо подзапроса со списком ключей
+        overflow_cutoff = await conn.fetchval(
+            "SELECT created_at FROM embedding_cache ORDER BY created_at DESC OFFSET $1 LIMIT 1",
+            max(self.max_rows - 1, 0),
+        )
+        deleted = await conn.execute("""
+            DELETE FROM embedding_cache
+            WHERE ctid IN (
+                SELECT ctid FROM embedding_cache
+                WHERE created_at < GREATEST(now() - make_interval(secs => $1), $2::timestamptz)
+                ORDER BY created_at
+                LIMIT $3
+            )
+        """, float(self.ttl), overflow_cutoff, _PRUNE_BATCH)
+        logger.info(f"🧹 embedding_cache: {deleted}")
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.memory_hits + self.db_hits + self.misses
+        return {
+            "memory_entries": len(self._memory),
+            "memory_hits": self.memory_hits,
+            "db_hits": self.db_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.memory_hits + self.db_hits) / lookups, 4) if lookups else 0.0,
+        }
+
+
+embedding_cache = EmbeddingCache(
+    max_entries=settings.embedding_cache_size,
+    ttl=settings.embedding_cache_ttl,
+    persistent=settings.embedding_cache_persistent,
+    max_rows=settings.embedding_cache_max_rows,
+)
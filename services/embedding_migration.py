@@ -0,0 +1,66 @@
+import time
+from typing import Set
+
+import asyncpg
+
+from services.db import get_db_pool
+from core.logger import logger
+
+# Клиенты, чьи строки перенесены из jsonb в embedding_vec и проверены
+# (scripts/migrate_embeddings.py). Для них индекс грузится из бинарного
+# vector, а бэкенд pgvector допустим. Таблица — migrations/009_embedding_migrations.sql.
+STATUS_TABLE = "embedding_migrations"
+_REFRESH_SECONDS = 60
+
+_converted: Set[str] = set()
+_all_converted = False
+_loaded_at = 0.0
+
+
+async def converted_tenants() -> Set[str]:
+    """Множество проверенных клиентов; перечитывается из БД не чаще раза в минуту."""
+    await _refresh()
+    return _converted
+
+
+async def all_tenants_converted() -> bool:
+    """Все строки с эмбеддингом уже имеют embedding_vec (миграция 002 и перенос завершены)."""
+    await _refresh()
+    return _all_converted
+
+
+async def _refresh():
+    global _converted, _all_converted, _loaded_at
+    if time.monotonic() - _loaded_at < _REFRESH_SECONDS:
+        return
+    try:
+        async with get_db_pool().acquire() as conn:
+            rows = await conn.fetch(f"SELECT client_id FROM {STATUS_TABLE} WHERE status = 'verified'")
+        _converted = {r["client_id"] for r in rows}
+    except asyncpg.UndefinedTableError:
+        _converted = set()
+    except Exception as e:
+        logger.error(f"Не удалось прочитать {STATUS_TABLE}: {e}")
+    try:
+        async with get_db_pool().acquire() as conn:
+            _all_converted = await conn.fetchval("""
+                SELECT NOT EXISTS (
+                    SELECT 1 FROM documents WHERE embedding IS NOT NULL AND embedding_vec IS NULL
+                )
+            """)
+    except asyncpg.UndefinedColumnError:
+        _all_converted = False  # migrations/002 ещё не применена
+    except Exception as e:
+        logger.error(f"Не удалось проверить перенос эмбеддингов: {e}")
+        _all_converted = False
+    _loaded_at = time.monotonic()
+
+
+async def is_tenant_converted(client_id: str) -> bool:
+    return str(client_id) in await converted_tenants()
+
+
+def reset_cache():
+    """Сбрасывает кэш статусов (после уведомления documents_changed)."""
+    global _loaded_at
+    _loaded_at = 0.0
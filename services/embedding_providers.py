@@ -0,0 +1,215 @@
+import asyncio
+import hashlib
+import random
+import re
+from typing import Dict, List, Optional, Type
+
+import aiohttp
+import numpy as np
+
+from core.logger import logger
+from config import settings
+
+# Общая сессия с keep-alive пулом: TCP+TLS до API эмбеддингов устанавливается один раз,
+# а не на каждый чанк. Сессия привязана к циклу событий, поэтому при вызове
+# из другого цикла создаётся своя.
+_session: Optional[aiohttp.ClientSession] = None
+_session_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def get_embedding_session() -> aiohttp.ClientSession:
+    global _session, _session_loop
+    loop = asyncio.get_running_loop()
+    if _session is None or _session.closed or _session_loop is not loop:
+        connector = aiohttp.TCPConnector(
+            limit=settings.embedding_pool_limit,
+            ttl_dns_cache=settings.embedding_dns_ttl,
+            keepalive_timeout=settings.embedding_keepalive_timeout,
+        )
+        _session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=30),
+        )
+        _session_loop = loop
+        logger.info(f"🔗 Сессия эмбеддингов создана (limit={settings.embedding_pool_limit})")
+    return _session
+
+
+async def close_embedding_session():
+    global _session, _session_loop
+    if _session is not None and not _session.closed:
+        await _session.close()
+        logger.info("🔌 Сессия эмбеддингов закрыта")
+    _session = None
+    _session_loop = None
+
+
+class EmbeddingRateLimitError(Exception):
+    """429 от API эмбеддингов."""
+
+    def __init__(self, retry_after: Optional[float] = None):
+        super().__init__(f"Embedding API rate limited (retry after {retry_after})")
+        self.retry_after = retry_after
+
+
+def _retry_after(resp: aiohttp.ClientResponse) -> float:
+    value = resp.headers.get("Retry-After")
+    try:
+        return float(value) if value else 1.0
+    except ValueError:
+        return 1.0
+
+
+class EmbeddingProvider:
+    """
+    Источник эмбеддингов. model_id сохраняется в documents.embedding_model,
+    cache_key — ключ модели в embedding_cache. Лимиты, повторы, кэш и
+    коалесцирование запросов — общие, в services/embeddings.py.
+    """
+
+    name = ""
+    supports_batch = False
+
+    def __init__(self, model: str):
+        self.model = model
+
+    @property
+    def model_id(self) -> str:
+        return f"{self.name}:{self.model}"
+
+    @property
+    def cache_key(self) -> str:
+        return self.model_id
+
+    async def embed(self, text: str) -> List[float]:
+        raise NotImplementedError
+
+    async def embed_batch(self, texts: List[str]) -> List[List[float]]:
+        return [await self.embed(text) for text in texts]
+
+
+class YandexEmbeddingProvider(EmbeddingProvider):
+    name = "yandex"
+    url = "https://llm.api.cloud.yandex.net/foundationModels/v1/textEmbedding"
+
+    def __init__(self, model: Optional[str] = None):
+        super().__init__(model or settings.embedding_model)
+
+    @property
+    def cache_key(self) -> str:
+        # Прежний формат ключа: записи embedding_cache остаются действительными
+        return f"emb://{settings.yc_folder_id}/{self.model}"
+
+    async def embed(self, text: str) -> List[float]:
+        headers = {
+            "Authorization": f"Api-Key {settings.yc_api_key}",
+            "Content-Type": "application/json"
+        }
+        payload = {"modelUri": self.cache_key, "text": text}
+        async with get_embedding_session().post(self.url, headers=headers, json=payload) as resp:
+            if resp.status == 429:
+                raise EmbeddingRateLimitError(_retry_after(resp))
+            if resp.status != 200:
+                text_err = await resp.text()
+                logger.error(f"Ошибка YandexGPT API {resp.status}: {text_err}")
+                raise Exception(f"YandexGPT API error: {resp.status}")
+            data = await resp.json()
+        return data["embedding"]
+
+
+class OpenAIEmbeddingProvider(EmbeddingProvider):
+    """Любой OpenAI-совместимый /embeddings (OpenAI, vLLM, Ollama, LM Studio...). Умеет пачки."""
+
+    name = "openai"
+    supports_batch = True
+
+    def __init__(self, model: Optional[str] = None, url: Optional[str] = None, api_key: Optional[str] = None):
+        super().__init__(model or settings.embedding_api_model)
+        self.url = (url or settings.embedding_api_url).rstrip("/") + "/embeddings"
+        self.api_key = api_key if api_key is not None else settings.embedding_api_key
+
+    async def embed(self, text: str) -> List[float]:
+        return (await self.embed_batch([text]))[0]
+
+    async def embed_batch(self, texts: List[str]) -> List[List[float]]:
+        headers = {"Content-Type": "application/json"}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+        payload = {"model": self.model, "input": texts}
+        if settings.embedding_api_dimensions:
+            payload["dimensions"] = settings.embedding_api_dimensions
+        async with get_embedding_session().post(self.url, headers=headers, json=payload) as resp:
+            if resp.status == 429:
+                raise EmbeddingRateLimitError(_retry_after(resp))
+            if resp.status != 200:
+                text_err = await resp.text()
+                logger.error(f"Ошибка API эмбеддингов {resp.status}: {text_err}")
+                raise Exception(f"Embedding API error: {resp.status}")
+            data = await resp.json()
+        items = sorted(data["data"], key=lambda item: item["index"])
+        return [item["embedding"] for item in items]
+
+
+class LocalHashEmbeddingProvider(EmbeddingProvider):
+    """
+    Детерминированные эмбеддинги без сети — для нагрузочных тестов и бенчмарков.
+    Слова и их биграммы хэшируются в знаковые координаты (hashing trick) и
+    проецируются в `dimension` измерений; вектор нормируется. Тексты с общими словами
+    близки по косинусу, так что поиск ведёт себя правдоподобно. Задержка
+    latency_ms ± jitter_ms имитирует сетевой вызов.
+    """
+
+    name = "local"
+    supports_batch = True
+    _TOKEN = re.compile(r"\w+")
+
+    def __init__(self, dimension: Optional[int] = None, latency_ms: Optional[float] = None,
+                 jitter_ms: Optional[float] = None, seed: int = 0):
+        self.dimension = dimension or settings.vector_dimension
+        super().__init__(f"hash-{self.dimension}")
+        self.latency = (settings.local_embedding_latency_ms if latency_ms is None else latency_ms) / 1000
+        self.jitter = (settings.local_embedding_jitter_ms if jitter_ms is None else jitter_ms) / 1000
+        self.seed = seed
+
+    def _features(self, text: str) -> List[str]:
+        words = self._TOKEN.findall(text.lower())
+        return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+    def vector(self, text: str) -> List[float]:
+        vec = np.zeros(self.dimension, dtype=np.float32)
+        for feature in self._features(text):
+            digest = hashlib.blake2b(f"{self.seed}:{feature}".encode("utf-8"), digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4], "little") % self.dimension
+            vec[bucket] += 1.0 if digest[4] & 1 else -1.0
+        norm = float(np.linalg.norm(vec))
+        if norm == 0.0:
+            vec[0] = 1.0
+        else:
+            vec /= norm
+        return vec.tolist()
+
+    async def _delay(self):
+        if self.latency or self.jitter:
+            await asyncio.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+
+    async def embed(self, text: str) -> List[float]:
+        await self._delay()
+        return self.vector(text)
+
+    async def embed_batch(self, texts: List[str]) -> List[List[float]]:
+        await self._delay()
+        return [self.vector(text) for text in texts]
+
+
+PROVIDERS: Dict[str, Type[EmbeddingProvider]] = {
+    YandexEmbeddingProvider.name: YandexEmbeddingProvider,
+    OpenAIEmbeddingProvider.name: OpenAIEmbeddingProvider,
+    LocalHashEmbeddingProvider.name: LocalHashEmbeddingProvider,
+}
+
+
+def create_embedding_provider(name: Optional[str] = None) -> EmbeddingProvider:
+    name = name or settings.embedding_provider
+    if name not in PROVIDERS:
+        raise ValueError(f"Неизвестный провайдер эмбеддингов: {name} (доступны: {', '.join(PROVIDERS)})")
+    return PROVIDERS[name]()
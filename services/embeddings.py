@@ -1,182 +1,364 @@
 import asyncio
-import aiohttp
-import asyncpg
 import json
-from typing import List
-import PyPDF2
-from io import BytesIO
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+import numpy as np
 from tenacity import retry, stop_after_attempt, wait_exponential
-from services.db import get_db_pool, init_db_pool, close_db_pool
+from services.db import get_db_pool
+from services.vector_index import vector_index, notify_documents_changed
+from services.rate_limit import TokenBucket
+from services.embedding_providers import (
+    EmbeddingProvider,
+    EmbeddingRateLimitError,
+    close_embedding_session,
+    create_embedding_provider,
+)
+from services.embedding_cache import embedding_cache
+from services.embedding_batcher import EmbeddingBatcher
+from services.chunk_writer import ChunkWriter, chunk_hash, load_existing_chunks
+from services.extraction import iter_document_text
+from services.chunking import Chunk, iter_chunks
 from core.logger import logger
 from config import settings
 
-# ========== КОНФИГУРАЦИЯ ==========
-YC_FOLDER_ID = settings.yc_folder_id
-YC_API_KEY = settings.yc_api_key
-EMBEDDING_URL = "https://llm.api.cloud.yandex.net/foundationModels/v1/textEmbedding"
-EMBEDDING_MODEL = "text-search-doc"  # для документов
-# ==================================
+# Провайдер эмбеддингов выбирается настройкой embedding_provider (yandex | openai | local)
+_provider: Optional[EmbeddingProvider] = None
+
+
+def get_embedding_provider() -> EmbeddingProvider:
+    global _provider
+    if _provider is None:
+        _provider = create_embedding_provider()
+        logger.info(f"🧬 Провайдер эмбеддингов: {_provider.model_id}")
+    return _provider
+
+
+def set_embedding_provider(provider: Optional[EmbeddingProvider]):
+    """Подмена провайдера (бенчмарки, тесты); None — снова из настроек. Батчер пересоздаётся."""
+    global _provider, _batcher
+    _provider = provider
+    _batcher = None
+
+
+# Ограничения на обращения к API эмбеддингов (общие для всех документов и запросов):
+# не больше embedding_concurrency запросов одновременно и embedding_rps в секунду (квота провайдера).
+_limits: Optional[Tuple[asyncio.Semaphore, TokenBucket]] = None
+_limits_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def get_embedding_limits() -> Tuple[asyncio.Semaphore, TokenBucket]:
+    global _limits, _limits_loop
+    loop = asyncio.get_running_loop()
+    if _limits is None or _limits_loop is not loop:
+        _limits = (
+            asyncio.Semaphore(settings.embedding_concurrency),
+            TokenBucket(settings.embedding_rps, settings.embedding_burst),
+        )
+        _limits_loop = loop
+    return _limits
+
+
+def _retry_wait(retry_state) -> float:
+    exc = retry_state.outcome.exception()
+    if isinstance(exc, EmbeddingRateLimitError) and exc.retry_after:
+        return exc.retry_after
+    return wait_exponential(multiplier=1, min=2, max=10)(retry_state)
+
+
+def embedding_model_uri() -> str:
+    """Ключ модели в кэше эмбеддингов."""
+    return get_embedding_provider().cache_key
+
+
+def embedding_model_id() -> str:
+    """Идентификатор модели, которой посчитаны сохраняемые эмбеддинги."""
+    return get_embedding_provider().model_id
+
+
+_batcher: Optional[EmbeddingBatcher] = None
+_batcher_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def get_embedding_batcher() -> EmbeddingBatcher:
+    global _batcher, _batcher_loop
+    loop = asyncio.get_running_loop()
+    if _batcher is None or _batcher_loop is not loop:
+        provider = get_embedding_provider()
+        _batcher = EmbeddingBatcher(
+            fetch_one=_fetch_and_cache,
+            fetch_batch=_fetch_batch_and_cache if provider.supports_batch else None,
+            window=settings.embedding_batch_window_ms / 1000,
+            max_batch=settings.embedding_batch_size,
+            max_fanout=settings.embedding_concurrency,
+        )
+        _batcher_loop = loop
+    return _batcher
+
+
+async def _fetch_and_cache(text: str) -> List[float]:
+    embedding = await fetch_embedding(text)
+    await embedding_cache.put(embedding_model_uri(), text, embedding)
+    return embedding
+
+
+async def _fetch_batch_and_cache(texts: List[str]) -> List[List[float]]:
+    embeddings = await fetch_embeddings(texts)
+    for text, embedding in zip(texts, embeddings):
+        await embedding_cache.put(embedding_model_uri(), text, embedding)
+    return embeddings
+
 
-@retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=2, max=10))
 async def get_embedding(text: str) -> List[float]:
-    """Получение эмбеддинга через YandexGPT API"""
-    headers = {
-        "Authorization": f"Api-Key {YC_API_KEY}",
-        "Content-Type": "application/json"
-    }
-    payload = {
-        "modelUri": f"emb://{YC_FOLDER_ID}/{EMBEDDING_MODEL}",
-        "text": text
-    }
+    """
+    Эмбеддинг текста: сначала кэш (память процесса, затем БД), потом провайдер.
+    Одновременные промахи коалесцируются: одинаковые тексты запрашиваются один раз.
+    """
+    cached = await embedding_cache.get(embedding_model_uri(), text)
+    if cached is not None:
+        return cached
+    return await get_embedding_batcher().embed(text)
+
+
+async def _call_provider(call, size: int):
+    semaphore, bucket = get_embedding_limits()
+    async with semaphore:
+        await bucket.acquire()
+        try:
+            return await call()
+        except EmbeddingRateLimitError as e:
+            bucket.penalize(e.retry_after or 1.0)
+            logger.warning(f"API эмбеддингов 429, повтор через {e.retry_after} с ({size} текстов)")
+            raise
+
+
+@retry(stop=stop_after_attempt(5), wait=_retry_wait)
+async def fetch_embedding(text: str) -> List[float]:
+    """Эмбеддинг одного текста у провайдера — под общими лимитами и с повторами."""
+    provider = get_embedding_provider()
+    try:
+        logger.debug(f"Запрос эмбеддинга для текста длиной {len(text)}")
+        return await _call_provider(lambda: provider.embed(text), 1)
+    except EmbeddingRateLimitError:
+        raise
+    except Exception as e:
+        logger.error(f"Ошибка API эмбеддингов ({provider.model_id}): {e}")
+        raise
+
+
+@retry(stop=stop_after_attempt(5), wait=_retry_wait)
+async def fetch_embeddings(texts: List[str]) -> List[List[float]]:
+    """Пачка эмбеддингов одним запросом (провайдеры с supports_batch)."""
+    provider = get_embedding_provider()
     try:
-        logger.info(f"Запрос эмбеддинга для текста длиной {len(text)}")
-        async with aiohttp.ClientSession() as session:
-            async with session.post(EMBEDDING_URL, headers=headers, json=payload, timeout=30) as resp:
-                if resp.status != 200:
-                    text_err = await resp.text()
-                    logger.error(f"Ошибка YandexGPT API {resp.status}: {text_err}")
-                    raise Exception(f"YandexGPT API error: {resp.status}")
-                data = await resp.json()
-                embedding = data["embedding"]
-                logger.info(f"Получен эмбеддинг размерностью {len(embedding)}")
-                return embedding
+        return await _call_provider(lambda: provider.embed_batch(texts), len(texts))
+    except EmbeddingRateLimitError:
+        raise
     except Exception as e:
-        logger.error(f"Ошибка YandexGPT API: {e}", exc_info=True)
+        logger.error(f"Ошибка API эмбеддингов ({provider.model_id}, {len(texts)} текстов): {e}")
         raise
 
-def split_text(text: str, chunk_size: int = 1000, overlap: int = 200) -> List[str]:
-    """Разделение текста на чанки с перекрытием"""
-    chunks = []
-    start = 0
-    text_length = len(text)
-    
-    while start < text_length:
-        end = min(start + chunk_size, text_length)
-        if end < text_length:
-            last_period = text.rfind('.', start, end)
-            last_space = text.rfind(' ', start, end)
-            cut_point = max(last_period, last_space)
-            if cut_point > start:
-                end = cut_point + 1
-        chunks.append(text[start:end].strip())
-        start = end - overlap if end < text_length else text_length
-    
-    return chunks
+
+async def embed_chunks(chunks: List[str]) -> List[List[float]]:
+    """Эмбеддинги для списка чанков в исходном порядке, запросы идут параллельно."""
+    return list(await asyncio.gather(*(get_embedding(chunk) for chunk in chunks)))
 
 async def extract_text_from_file(file) -> str:
-    """Извлечение текста из загруженного файла"""
-    content = await file.read()
-    
-    if file.filename.endswith('.txt'):
-        return content.decode('utf-8')
-    elif file.filename.endswith('.pdf'):
-        pdf_reader = PyPDF2.PdfReader(BytesIO(content))
-        text = ""
-        for page in pdf_reader.pages:
-            text += page.extract_text()
-        return text
-    else:
-        raise ValueError(f"Неподдерживаемый тип файла: {file.filename}")
-
-async def process_document(client_id: str, file, metadata: dict) -> int:
+    """Извлечение текста из загруженного файла (PDF — постранично в пуле процессов)"""
+    return "".join([piece async for piece in iter_document_text(file)])
+
+
+@dataclass
+class IngestProgress:
+    """Счётчики обработки документа; воркер очереди периодически сохраняет их в ingest_jobs."""
+    chunks_total: Optional[int] = None  # известно, когда весь текст разобран
+    chunks_done: int = 0
+    chunks_failed: int = 0
+
+    def _on_embedded(self, task: asyncio.Task):
+        if task.cancelled():
+            return
+        if task.exception() is None:
+            self.chunks_done += 1
+        else:
+            self.chunks_failed += 1
+
+
+async def process_document(client_id: str, file, metadata: dict, progress: Optional[IngestProgress] = None) -> int:
     """
     Обработка документа: разбивка на чанки, генерация эмбеддингов, сохранение в PostgreSQL.
+    Текст PDF разбирается в пуле процессов постранично; эмбеддинги готовых чанков
+    запрашиваются, пока следующие страницы ещё разбираются.
     """
+    progress = progress or IngestProgress()
     logger.info(f"🔍 process_document: client_id={client_id}, file={file.filename if file else 'None'}")
+    pool = get_db_pool()
+    model = embedding_model_id()
+    async with pool.acquire() as conn:
+        # Повторная загрузка того же файла: неизменившиеся чанки (по sha256) не эмбеддятся заново
+        existing = await load_existing_chunks(conn, client_id, file.filename, model)
+
+    doc_metadata = {
+        "filename": file.filename,
+        "content_type": file.content_type,
+        **metadata
+    }
+    chunks: List[Chunk] = []
+    reuse: Dict[int, int] = {}
+    pending: Dict[int, asyncio.Task] = {}
     try:
-        pool = get_db_pool()
-        logger.info(f"process_document: получен пул: {pool}")
-        
-        logger.info("process_document: начало извлечения текста из файла")
-        text = await extract_text_from_file(file)
-        if not text.strip():
+        async for chunk in iter_chunks(iter_document_text(file)):
+            doc_id = existing.match(chunk.text)
+            if doc_id is not None:
+                reuse[len(chunks)] = doc_id
+                progress.chunks_done += 1
+            else:
+                # Общий лимит конкурентности и rate limit — внутри get_embedding
+                task = asyncio.create_task(get_embedding(chunk.text))
+                task.add_done_callback(progress._on_embedded)
+                pending[len(chunks)] = task
+            chunks.append(chunk)
+        progress.chunks_total = len(chunks)
+
+        if not chunks:
             logger.warning(f"Файл {file.filename} не содержит текста")
             return 0
-        logger.info(f"Извлечён текст длиной {len(text)} символов")
-        
-        chunks = split_text(text)
-        logger.info(f"Файл {file.filename} разбит на {len(chunks)} чанков")
-        
-        doc_metadata = {
-            "filename": file.filename,
-            "content_type": file.content_type,
-            **metadata
-        }
-        
-        success_count = 0
-        logger.info("process_document: попытка получить соединение из пула")
-        async with pool.acquire() as conn:
-            logger.info("process_document: соединение получено, начинаем обработку чанков")
-            for i, chunk in enumerate(chunks):
-                chunk_metadata = {
-                    **doc_metadata,
-                    "chunk_index": i,
-                    "chunk_size": len(chunk)
-                }
-                try:
-                    logger.info(f"Обработка чанка {i+1}/{len(chunks)}")
-                    embedding = await get_embedding(chunk)
-                    logger.info(f"Тип embedding: {type(embedding)}, длина: {len(embedding)}")
-                    logger.info(f"Первые 5 значений: {embedding[:5]}")
-                    logger.info(f"chunk_metadata: {chunk_metadata}")
-                    
-                    # Преобразуем метаданные в JSON-строку (обязательно для jsonb)
-                    metadata_json = json.dumps(chunk_metadata, ensure_ascii=False)
-                    logger.info(f"metadata_json (первые 200): {metadata_json[:200]}")
-                    
-                    logger.info(f"👉 Попытка вставки чанка {i+1}")
-                    # embedding передаётся как список чисел – pgvector преобразует в vector
-                    await conn.execute("""
-                        INSERT INTO documents (content, metadata, embedding, client_id)
-                        VALUES ($1, $2::jsonb, $3::vector, $4)
-                    """, chunk, metadata_json, embedding, client_id)
-                    logger.info(f"✅ После выполнения INSERT для чанка {i+1}")
-                    
-                    success_count += 1
-                    logger.info(f"Чанк {i+1} успешно сохранён")
-                except Exception as e:
-                    logger.exception(f"❌ Ошибка при обработке чанка {i}")
-                    raise
-        
-        logger.info(f"Успешно сохранено {success_count} из {len(chunks)} чанков для {file.filename}")
-        return success_count
+        stale = existing.stale()
+        logger.info(
+            f"Файл {file.filename} разбит на {len(chunks)} чанков; без изменений: {len(reuse)}, "
+            f"новых/изменённых: {len(pending)}, к удалению: {len(stale)}"
+        )
+        embeddings = dict(zip(pending, await asyncio.gather(*pending.values())))
     except Exception as e:
+        for task in pending.values():
+            task.cancel()
         logger.error(f"process_document: критическая ошибка: {e}", exc_info=True)
         raise
 
-async def update_missing_embeddings(client_id: str):
-    """Обновляет эмбеддинги для документов, у которых они ещё не заполнены."""
+    writer = ChunkWriter(client_id, model)
+    for i, chunk in enumerate(chunks):
+        chunk_metadata = {
+            **doc_metadata,
+            "chunk_index": i,
+            "chunk_size": len(chunk.text),
+            # Смещения в тексте документа — для подтягивания соседних чанков
+            "char_start": chunk.start,
+            "char_end": chunk.end,
+        }
+        if i in reuse:
+            writer.keep(reuse[i], chunk.text, chunk_metadata)
+        else:
+            writer.add(chunk.text, embeddings[i], chunk_metadata)
+    writer.delete(stale)
+    # Соединение берётся только на время записи одной транзакцией
+    async with pool.acquire() as conn:
+        success_count = await writer.flush(conn)
+
+    logger.info(f"Успешно сохранено {success_count} из {len(chunks)} чанков для {file.filename}")
+    return success_count
+
+# Контрольные точки backfill (scripts/backfill_embeddings.py): на клиента и модель,
+# таблица — migrations/010_embedding_backfill.sql
+BACKFILL_TABLE = "embedding_backfill"
+
+
+def _values_update_sql(rows: int) -> str:
+    placeholders = ", ".join(
+        f"(${i * 4 + 2}::bigint, ${i * 4 + 3}::jsonb, ${i * 4 + 4}::vector, ${i * 4 + 5}::text)"
+        for i in range(rows)
+    )
+    return f"""
+        UPDATE documents AS d
+        SET embedding = v.embedding, embedding_vec = v.embedding_vec,
+            content_hash = v.content_hash, embedding_model = $1
+        FROM (VALUES {placeholders}) AS v(id, embedding, embedding_vec, content_hash)
+        WHERE d.id = v.id
+    """
+
+
+async def update_missing_embeddings(client_id: str, batch_size: int = 256, reembed: bool = False) -> int:
+    """
+    Заполняет эмбеддинги клиента: строки без эмбеддинга, а с reembed — и посчитанные
+    другой моделью. Строки идут keyset-пачками (id > last_id), эмбеддинги пачки
+    запрашиваются параллельно под общими лимитами, запись — одним UPDATE ... FROM (VALUES ...)
+    вместе с контрольной точкой. Прерванный запуск продолжается с последнего id.
+    Возвращает число обновлённых строк.
+    """
     pool = get_db_pool()
+    client_id = str(client_id)
+    model = embedding_model_id()
+    condition = "embedding IS NULL OR embedding_model IS DISTINCT FROM $3" if reembed else "embedding IS NULL"
+
     async with pool.acquire() as conn:
-        rows = await conn.fetch("""
-            SELECT id, content FROM documents
-            WHERE client_id = $1 AND embedding IS NULL
-        """, client_id)
-    
-    if not rows:
-        logger.info(f"Нет документов для обновления у клиента {client_id}")
-        return
-    
-    logger.info(f"Найдено документов для обновления: {len(rows)}")
-    for row in rows:
-        doc_id = row["id"]
-        content = row["content"]
-        try:
-            embedding = await get_embedding(content)
+        state = await conn.fetchrow(f"""
+            INSERT INTO {BACKFILL_TABLE} (client_id, model) VALUES ($1, $2)
+            ON CONFLICT (client_id, model) DO UPDATE SET
+                -- Завершённый проход начинаем заново: могли появиться новые строки или упавшие
+                last_id = CASE WHEN {BACKFILL_TABLE}.status = 'done' THEN 0 ELSE {BACKFILL_TABLE}.last_id END,
+                status = 'in_progress', updated_at = now()
+            RETURNING last_id, updated, failed
+        """, client_id, model)
+    last_id, updated, failed = state["last_id"], state["updated"], state["failed"]
+    logger.info(f"🔁 Клиент {client_id}: backfill эмбеддингов ({model}) с id > {last_id}")
+
+    started = time.monotonic()
+    done = 0
+    try:
+        while True:
+            async with pool.acquire() as conn:
+                rows = await conn.fetch(f"""
+                    SELECT id, content, metadata FROM documents
+                    WHERE client_id = $1 AND id > $2 AND ({condition})
+                    ORDER BY id
+                    LIMIT {int(batch_size)}
+                """, client_id, last_id, *([model] if reembed else []))
+            if not rows:
+                break
+
+            # Соединение не держим, пока идут запросы к API эмбеддингов
+            results = await asyncio.gather(*(get_embedding(r["content"]) for r in rows), return_exceptions=True)
+            ready = []
+            for row, result in zip(rows, results):
+                if isinstance(result, BaseException):
+                    failed += 1
+                    logger.error(f"Ошибка эмбеддинга документа {row['id']}: {result}")
+                else:
+                    ready.append({**dict(row), "embedding": result})
+
+            params = []
+            for item in ready:
+                params += [
+                    item["id"],
+                    json.dumps(item["embedding"]),
+                    np.asarray(item["embedding"], dtype=np.float32),
+                    chunk_hash(item["content"]),
+                ]
+            last_id = rows[-1]["id"]
+            updated += len(ready)
+            async with pool.acquire() as conn:
+                async with conn.transaction():
+                    if ready:
+                        await conn.execute(_values_update_sql(len(ready)), model, *params)
+                    await conn.execute(f"""
+                        UPDATE {BACKFILL_TABLE}
+                        SET last_id = $3, updated = $4, failed = $5, updated_at = now()
+                        WHERE client_id = $1 AND model = $2
+                    """, client_id, model, last_id, updated, failed)
+            vector_index.upsert(client_id, ready)
+
+            done += len(ready)
+            rate = done / max(time.monotonic() - started, 1e-6)
+            logger.info(f"  {client_id}: +{len(ready)} (id ≤ {last_id}), всего {updated}, ошибок {failed}, {rate:.1f} строк/с")
+
+        async with pool.acquire() as conn:
+            await conn.execute(f"""
+                UPDATE {BACKFILL_TABLE} SET status = 'done', updated_at = now()
+                WHERE client_id = $1 AND model = $2
+            """, client_id, model)
+        logger.info(f"✅ Клиент {client_id}: backfill завершён, обновлено {updated}, ошибок {failed}")
+    finally:
+        if done:
+            # Индексы в памяти API-процессов перечитают клиента
             async with pool.acquire() as conn:
-                await conn.execute("""
-                    UPDATE documents SET embedding = $1 WHERE id = $2
-                """, embedding, doc_id)
-            logger.info(f"Документ {doc_id} обновлён")
-        except Exception as e:
-            logger.error(f"Ошибка при обновлении документа {doc_id}: {e}")
-
-# Для самостоятельного запуска обновления
-async def main():
-    await init_db_pool()
-    client_id = "112e1504-1724-4c46-9d1d-bb8fb4c5cffe"
-    await update_missing_embeddings(client_id)
-    await close_db_pool()
-
-if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+                await notify_documents_changed(conn, client_id)
+    return done
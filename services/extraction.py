@@ -0,0 +1,131 @@
+import asyncio
+import codecs
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import AsyncIterator, List, Optional
+
+import PyPDF2
+
+from core.logger import logger
+from config import settings
+
+# ---------- Выполняется в дочерних процессах ----------
+def _pdf_page_count(path: str) -> int:
+    return len(PyPDF2.PdfReader(path).pages)
+
+
+def _pdf_extract_pages(path: str, start: int, end: int) -> List[str]:
+    reader = PyPDF2.PdfReader(path)
+    return [reader.pages[i].extract_text() or "" for i in range(start, end)]
+
+
+# ---------- Пул процессов ----------
+# PyPDF2 — чистый Python и держит GIL: в основном процессе 300-страничный
+# каталог заморозил бы все вебхуки, поэтому разбор идёт в отдельных процессах.
+_executor: Optional[ProcessPoolExecutor] = None
+
+
+def get_extraction_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=settings.extraction_workers)
+        logger.info(f"🧵 Пул извлечения текста создан ({settings.extraction_workers} процессов)")
+    return _executor
+
+
+def shutdown_extraction_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+        logger.info("🔌 Пул извлечения текста остановлен")
+
+
+async def iter_pdf_pages(path: str) -> AsyncIterator[str]:
+    """
+    Текст страниц PDF по порядку, по мере готовности. Страницы разбираются
+    пачками по pdf_pages_per_task в пуле процессов; количество страниц
+    ограничено pdf_max_pages, общее время — pdf_timeout.
+    """
+    loop = asyncio.get_running_loop()
+    executor = get_extraction_executor()
+    deadline = time.monotonic() + settings.pdf_timeout
+
+    def remaining() -> float:
+        left = deadline - time.monotonic()
+        if left <= 0:
+            raise TimeoutError(f"Извлечение текста из PDF дольше {settings.pdf_timeout} с")
+        return left
+
+    total = await asyncio.wait_for(loop.run_in_executor(executor, _pdf_page_count, path), remaining())
+    if total > settings.pdf_max_pages:
+        logger.warning(f"PDF содержит {total} страниц, обрабатываем первые {settings.pdf_max_pages}")
+        total = settings.pdf_max_pages
+
+    step = max(1, settings.pdf_pages_per_task)
+    # Впереди держим не больше двух пачек на процесс, чтобы не разбирать весь файл заранее
+    ahead = settings.extraction_workers * 2
+    pending = []
+    next_start = 0
+    try:
+        while next_start < total or pending:
+            while next_start < total and len(pending) < ahead:
+                end = min(next_start + step, total)
+                pending.append(loop.run_in_executor(executor, _pdf_extract_pages, path, next_start, end))
+                next_start = end
+            pages = await asyncio.wait_for(asyncio.shield(pending[0]), remaining())
+            pending.pop(0)
+            for page in pages:
+                yield page
+    finally:
+        for fut in pending:
+            fut.cancel()
+
+
+async def _joined_pages(path: str) -> AsyncIterator[str]:
+    """Страницы PDF; перед каждой, кроме первой, — перевод строки."""
+    first = True
+    async for page in iter_pdf_pages(path):
+        yield page if first else "\n" + page
+        first = False
+
+
+async def iter_document_text(file) -> AsyncIterator[str]:
+    """
+    Текст загруженного файла кусками: .txt — блоками по upload_buffer_size байт,
+    .pdf — постранично. Память ограничена буфером, а не размером файла.
+    Куски склеиваются как есть ("".join): разделитель между страницами PDF
+    уже включён в кусок, блоки .txt режутся без разделителя.
+    `file` — UploadFile или объект с тем же интерфейсом (filename, async read(size)).
+    """
+    name = file.filename.lower()
+    if name.endswith('.txt'):
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        while True:
+            block = await file.read(settings.upload_buffer_size)
+            text = decoder.decode(block, final=not block)
+            if text:
+                yield text
+            if not block:
+                break
+    elif name.endswith('.pdf'):
+        # Файл уже на диске (локальная папка) — дочерним процессам отдаём его путь
+        path = getattr(file, "path", None)
+        if path is not None:
+            async for page in _joined_pages(str(path)):
+                yield page
+            return
+        # Дочерним процессам передаём путь, а не байты: иначе файл пиклился бы на каждую пачку
+        with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp:
+            path = tmp.name
+            while block := await file.read(settings.upload_buffer_size):
+                tmp.write(block)
+        try:
+            async for page in _joined_pages(path):
+                yield page
+        finally:
+            os.unlink(path)
+    else:
+        raise ValueError(f"Неподдерживаемый тип файла: {file.filename}")
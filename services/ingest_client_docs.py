@@ -1,84 +1,160 @@
 import asyncio
-from typing import List
-
-from services.supabase import supabase
-from services.embeddings import get_embedding, split_text
+import mimetypes
+import uuid
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from services.db import get_db_pool
+from services.embeddings import embed_chunks, embedding_model_id
+from services.extraction import iter_document_text
+from services.chunking import iter_chunks
+from services.bulk_upload import is_supported
+from services.chunk_writer import COLUMNS, chunk_hash, document_record, reserve_document_ids
+from services.vector_index import decode_embedding, notify_documents_changed, vector_index
 from core.logger import logger
+from config import settings
 
+STAGING_TABLE = "documents_staging"
 
-BUCKET_NAME = "client_docs"
 
+class LocalFile:
+    """Файл на диске с интерфейсом UploadFile (filename, content_type, async read(size))."""
 
-async def ingest_client_folder(client_id: str, folder_name: str) -> int:
-    """
-    Ingest всех файлов из папки клиента в Storage.
-    - скачивает файлы
-    - режет на чанки
-    - создаёт embedding
-    - сохраняет в documents с client_id
-    """
-    # 🔥 Production-safe: очищаем старые документы клиента
+    def __init__(self, path: Path):
+        self.path = path
+        self.filename = path.name
+        self.content_type = mimetypes.guess_type(path.name)[0]
+        self._handle = None
 
-    logger.info(f"🚀 Начинаем ingest для client_id={client_id}, folder={folder_name}")
+    async def read(self, size: int = -1) -> bytes:
+        if self._handle is None:
+            self._handle = await asyncio.to_thread(open, self.path, "rb")
+        data = await asyncio.to_thread(self._handle.read, size)
+        if not data or size < 0:
+            self._handle.close()
+            self._handle = None
+        return data
 
-    logger.info(f"🧹 Удаляем старые документы client_id={client_id}")
-    supabase.table("documents").delete().eq("client_id", client_id).execute()
 
-    # 1️⃣ Получаем список файлов
-    files = supabase.storage.from_(BUCKET_NAME).list(folder_name)
+class LocalFolderSource:
+    """Папки клиентов в локальном каталоге: <root>/<folder>/<file>."""
 
-    if not files:
-        logger.warning("❌ В папке нет файлов")
-        return 0
+    def __init__(self, root: Optional[str] = None):
+        self.root = Path(root or settings.client_docs_dir)
 
-    total_chunks = 0
+    async def list_files(self, folder_name: str) -> List[LocalFile]:
+        folder = self.root / folder_name
+        if not folder.is_dir():
+            raise FileNotFoundError(f"Папка не найдена: {folder}")
+        paths = await asyncio.to_thread(lambda: sorted(p for p in folder.iterdir() if p.is_file()))
+        return [LocalFile(p) for p in paths if is_supported(p.name)]
 
-    for file in files:
-        filename = file.get("name")
-        if not filename:
-            continue
 
-        path = f"{folder_name}/{filename}"
-        logger.info(f"📄 Обрабатываем файл: {path}")
+async def _known_embeddings(client_id: str, model: str, hashes: List[str]) -> Dict[str, List[float]]:
+    """Эмбеддинги уже сохранённых чанков клиента с тем же текстом — повторно не запрашиваем."""
+    async with get_db_pool().acquire() as conn:
+        rows = await conn.fetch("""
+            SELECT DISTINCT ON (content_hash) content_hash, embedding
+            FROM documents
+            WHERE client_id = $1 AND embedding_model = $2 AND embedding IS NOT NULL
+              AND content_hash = ANY($3::text[])
+        """, client_id, model, hashes)
+    return {r["content_hash"]: decode_embedding(r["embedding"]).tolist() for r in rows}
 
-        try:
-            # 2️⃣ Скачиваем файл из Storage
-            file_bytes = supabase.storage.from_(BUCKET_NAME).download(path)
-            text = file_bytes.decode("utf-8")
-
-            if not text.strip():
-                logger.warning(f"⚠ Файл {filename} пустой")
-                continue
-
-            # 3️⃣ Чанкинг
-            chunks = split_text(text)
-            logger.info(f"{filename} → {len(chunks)} чанков")
-
-            # 4️⃣ Для каждого чанка создаём embedding и сохраняем
-            for i, chunk in enumerate(chunks):
-                embedding = await get_embedding(chunk)
-
-                data = {
-                    "content": chunk,
-                    "metadata": {
-                        "filename": filename,
-                        "folder": folder_name,
-                        "chunk_index": i,
-                        "chunk_size": len(chunk),
-                    },
-                    "embedding": embedding,
-                    "client_id": client_id,
+
+async def _stage_file(client_id: str, folder_name: str, file: LocalFile, run_id: str, model: str) -> int:
+    chunks = [chunk async for chunk in iter_chunks(iter_document_text(file))]
+    if not chunks:
+        logger.warning(f"⚠ Файл {file.filename} пустой")
+        return 0
+
+    known = await _known_embeddings(client_id, model, list({chunk_hash(c.text) for c in chunks}))
+    fresh = [i for i, c in enumerate(chunks) if chunk_hash(c.text) not in known]
+    embeddings = dict(zip(fresh, await embed_chunks([chunks[i].text for i in fresh])))
+    logger.info(f"{file.filename} → {len(chunks)} чанков, из них новых эмбеддингов {len(fresh)}")
+
+    async with get_db_pool().acquire() as conn:
+        async with conn.transaction():
+            ids = await reserve_document_ids(conn, len(chunks))
+            records = []
+            for i, (chunk, doc_id) in enumerate(zip(chunks, ids)):
+                metadata = {
+                    "filename": file.filename,
+                    "folder": folder_name,
+                    "content_type": file.content_type,
+                    "chunk_index": i,
+                    "chunk_size": len(chunk.text),
+                    "char_start": chunk.start,
+                    "char_end": chunk.end,
                 }
+                embedding = embeddings[i] if i in embeddings else known[chunk_hash(chunk.text)]
+                records.append((*document_record(doc_id, client_id, model, chunk.text, metadata, embedding), run_id))
+            await conn.copy_records_to_table(STAGING_TABLE, records=records, columns=[*COLUMNS, "run_id"])
+    return len(chunks)
+
+
+async def _swap(client_id: str, run_id: str) -> int:
+    """Заменяет строки клиента собранными в staging одной транзакцией."""
+    columns = ", ".join(COLUMNS)
+    async with get_db_pool().acquire() as conn:
+        async with conn.transaction():
+            await conn.execute("DELETE FROM documents WHERE client_id = $1", client_id)
+            inserted = await conn.execute(f"""
+                INSERT INTO documents ({columns})
+                SELECT {columns} FROM {STAGING_TABLE}
+                WHERE client_id = $1 AND run_id = $2
+            """, client_id, run_id)
+            await conn.execute(f"DELETE FROM {STAGING_TABLE} WHERE client_id = $1 AND run_id = $2", client_id, run_id)
+            await notify_documents_changed(conn, client_id)
+    vector_index.invalidate(client_id)
+    return int(inserted.split()[-1])
+
+
+async def ingest_client_folder(client_id: str, folder_name: str, source: Optional[LocalFolderSource] = None) -> int:
+    """
+    Полная переиндексация базы знаний клиента из папки.
+    - файлы читаются и разбираются параллельно (до folder_ingest_concurrency одновременно);
+    - эмбеддинги — под общими лимитами; уже известные тексты берутся из documents;
+    - чанки копятся в documents_staging и одной транзакцией заменяют строки клиента.
+    Если хотя бы один файл не обработан, база клиента остаётся прежней.
+    """
+    client_id = str(client_id)
+    source = source or LocalFolderSource()
+    model = embedding_model_id()
+    run_id = uuid.uuid4().hex
+    pool = get_db_pool()
+    logger.info(f"🚀 Начинаем ingest для client_id={client_id}, folder={folder_name}")
+
+    files = await source.list_files(folder_name)
+    if not files:
+        logger.warning("❌ В папке нет файлов")
+        return 0
+
+    # Одна переиндексация клиента за раз: вторая дождётся первой
+    async with pool.acquire() as lock_conn:
+        await lock_conn.execute("SELECT pg_advisory_lock(hashtext('ingest_client_folder:' || $1))", client_id)
+        try:
+            # Остатки прерванных запусков
+            await lock_conn.execute(f"DELETE FROM {STAGING_TABLE} WHERE client_id = $1", client_id)
+
+            semaphore = asyncio.Semaphore(settings.folder_ingest_concurrency)
 
-                supabase.table("documents").insert(data).execute()
+            async def stage(file: LocalFile) -> int:
+                async with semaphore:
+                    logger.info(f"📄 Обрабатываем файл: {folder_name}/{file.filename}")
+                    return await _stage_file(client_id, folder_name, file, run_id, model)
 
-                total_chunks += 1
+            results = await asyncio.gather(*(stage(f) for f in files), return_exceptions=True)
+            failed = [(f, r) for f, r in zip(files, results) if isinstance(r, BaseException)]
+            if failed:
+                for file, error in failed:
+                    logger.error(f"❌ Ошибка при обработке файла {file.filename}: {error}")
+                await lock_conn.execute(f"DELETE FROM {STAGING_TABLE} WHERE client_id = $1 AND run_id = $2", client_id, run_id)
+                raise RuntimeError(f"Не обработано файлов: {len(failed)} из {len(files)}; база клиента не изменена")
 
-        except Exception as e:
-            logger.error(
-                f"❌ Ошибка при обработке файла {filename}: {e}",
-                exc_info=True,
-            )
+            total_chunks = await _swap(client_id, run_id)
+        finally:
+            await lock_conn.execute("SELECT pg_advisory_unlock(hashtext('ingest_client_folder:' || $1))", client_id)
 
     logger.info(f"✅ Ingest завершён. Всего сохранено чанков: {total_chunks}")
-    return total_chunks
\ No newline at end of file
+    return total_chunks
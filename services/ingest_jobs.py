@@ -0,0 +1,292 @@
+import asyncio
+import hashlib
+import json
+import re
+import tempfile
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from services.db import get_db_pool
+from services.embeddings import IngestProgress, process_document
+from services.vector_index import PROCESS_ID
+from core.logger import logger
+from config import settings
+
+# Задачи забираются так, что два воркера (в том числе из разных процессов)
+# никогда не получают одну и ту же: строка блокируется, занятые пропускаются.
+_CLAIM_SQL = """
+    UPDATE ingest_jobs
+    SET status = 'running', attempts = attempts + 1, worker = $1,
+        started_at = now(), heartbeat_at = now(),
+        chunks_total = NULL, chunks_done = 0, chunks_failed = 0, error = NULL
+    WHERE id = (
+        SELECT id FROM ingest_jobs
+        WHERE status = 'queued'
+        ORDER BY id
+        FOR UPDATE SKIP LOCKED
+        LIMIT 1
+    )
+    RETURNING id, client_id, filename, content_type, metadata, attempts
+"""
+
+
+# Постановка файла в очередь. SQL общий для API (asyncpg) и админки (psycopg2,
+# через pyformat), поэтому каждый параметр встречается один раз и по порядку номеров.
+INSERT_JOB_SQL = """
+    INSERT INTO ingest_jobs (client_id, filename, content_type, metadata)
+    VALUES ($1, $2, $3, $4::jsonb)
+    RETURNING id
+"""
+INSERT_PART_SQL = "INSERT INTO ingest_job_parts (job_id, seq, data) VALUES ($1, $2, $3)"
+# Дубль — только ещё не обработанная задача. Выполненные не в счёт: документ могли
+# удалить или заменить, а ingest_jobs об этом не знает, и повторная загрузка того же
+# файла должна пройти (неизменившиеся чанки всё равно не эмбеддятся заново).
+DUPLICATE_JOB_SQL = """
+    SELECT id FROM ingest_jobs
+    WHERE client_id = $1 AND content_sha256 = $2 AND id <> $3
+      AND status IN ('queued', 'running')
+    ORDER BY id DESC
+    LIMIT 1
+"""
+FINALIZE_JOB_SQL = "UPDATE ingest_jobs SET size_bytes = $1, content_sha256 = $2 WHERE id = $3"
+
+
+def pyformat(sql: str) -> str:
+    """$1, $2, ... → %s для psycopg2."""
+    return re.sub(r"\$\d+", "%s", sql)
+
+
+class UploadTooLarge(ValueError):
+    pass
+
+
+class SpooledUpload:
+    """
+    Файл задачи с интерфейсом UploadFile (filename, content_type, async read(size)).
+    Содержимое лежит во временном файле: в памяти до upload_spool_memory, дальше на диске.
+    """
+
+    def __init__(self, filename: str, content_type: Optional[str]):
+        self.filename = filename
+        self.content_type = content_type
+        self._file = tempfile.SpooledTemporaryFile(max_size=settings.upload_spool_memory)
+
+    def write(self, data: bytes):
+        self._file.write(data)
+
+    def rewind(self):
+        self._file.seek(0)
+
+    async def read(self, size: int = -1) -> bytes:
+        return self._file.read(size)
+
+    def close(self):
+        self._file.close()
+
+
+class DuplicateUpload(Exception):
+    """Такой же файл клиента уже в очереди или в работе."""
+
+    def __init__(self, job_id: int):
+        super().__init__(f"Файл совпадает с задачей #{job_id}")
+        self.job_id = job_id
+
+
+async def enqueue_ingest_job(
+    conn, client_id: str, filename: str, content_type: Optional[str], stream, metadata: Dict[str, Any],
+    dedupe: bool = False,
+) -> int:
+    """
+    Ставит файл в очередь. `stream` — объект с async read(size) (UploadFile);
+    читается блоками по upload_buffer_size и пишется в ingest_job_parts в той же
+    транзакции, так что воркер видит задачу только целиком загруженной.
+    С dedupe=True файл с тем же sha256, что у задачи в очереди/в работе,
+    не ставится: DuplicateUpload.
+    """
+    limit = settings.max_upload_mb * 1024 * 1024
+    digest = hashlib.sha256()
+    async with conn.transaction():
+        job_id = await conn.fetchval(
+            INSERT_JOB_SQL, str(client_id), filename, content_type, json.dumps(metadata, ensure_ascii=False)
+        )
+        size = 0
+        seq = 0
+        while block := await stream.read(settings.upload_buffer_size):
+            size += len(block)
+            if size > limit:
+                raise UploadTooLarge(f"Файл больше {settings.max_upload_mb} МБ")
+            digest.update(block)
+            await conn.execute(INSERT_PART_SQL, job_id, seq, block)
+            seq += 1
+        sha = digest.hexdigest()
+        if dedupe:
+            duplicate = await conn.fetchval(DUPLICATE_JOB_SQL, str(client_id), sha, job_id)
+            if duplicate is not None:
+                # Откат транзакции убирает и задачу, и уже записанные блоки
+                raise DuplicateUpload(duplicate)
+        await conn.execute(FINALIZE_JOB_SQL, size, sha, job_id)
+    _wakeup.set()
+    logger.info(f"📥 Задача загрузки #{job_id}: {filename} (клиент {client_id}, {size} байт)")
+    return job_id
+
+
+async def _load_upload(job) -> SpooledUpload:
+    """Собирает файл задачи во временный файл, читая блоки по одному."""
+    upload = SpooledUpload(job["filename"], job["content_type"])
+    try:
+        async with get_db_pool().acquire() as conn:
+            payload = await conn.fetchval("SELECT payload FROM ingest_jobs WHERE id = $1", job["id"])
+            if payload is not None:
+                # Задача поставлена до появления ingest_job_parts
+                upload.write(payload)
+            else:
+                async with conn.transaction():
+                    async for part in conn.cursor(
+                        "SELECT data FROM ingest_job_parts WHERE job_id = $1 ORDER BY seq", job["id"], prefetch=1
+                    ):
+                        upload.write(part["data"])
+    except BaseException:
+        upload.close()
+        raise
+    upload.rewind()
+    return upload
+
+
+async def get_ingest_job(job_id: int) -> Optional[Dict[str, Any]]:
+    """Состояние задачи для API: счётчики чанков, ошибка и скорость обработки."""
+    async with get_db_pool().acquire() as conn:
+        row = await conn.fetchrow("""
+            SELECT id, client_id, filename, status, attempts, chunks_total, chunks_done, chunks_failed,
+                   error, created_at, started_at, heartbeat_at, finished_at
+            FROM ingest_jobs WHERE id = $1
+        """, job_id)
+    if row is None:
+        return None
+    job = dict(row)
+    throughput = None
+    if job["started_at"] is not None:
+        until = job["finished_at"] or datetime.now(timezone.utc)
+        elapsed = (until - job["started_at"]).total_seconds()
+        if elapsed > 0:
+            throughput = round(job["chunks_done"] / elapsed, 2)
+    job["chunks_per_second"] = throughput
+    return job
+
+
+# ---------- Воркеры ----------
+_workers: List[asyncio.Task] = []
+_wakeup = asyncio.Event()
+
+
+async def _save_progress(job_id: int, progress: IngestProgress):
+    async with get_db_pool().acquire() as conn:
+        await conn.execute("""
+            UPDATE ingest_jobs
+            SET chunks_total = $2, chunks_done = $3, chunks_failed = $4, heartbeat_at = now()
+            WHERE id = $1
+        """, job_id, progress.chunks_total, progress.chunks_done, progress.chunks_failed)
+
+
+async def _heartbeat(job_id: int, progress: IngestProgress):
+    while True:
+        await asyncio.sleep(settings.ingest_heartbeat_interval)
+        try:
+            await _save_progress(job_id, progress)
+        except Exception as e:
+            logger.warning(f"Задача #{job_id}: не удалось сохранить прогресс: {e}")
+
+
+async def _finish(job_id: int, progress: IngestProgress, status: str, error: Optional[str] = None):
+    async with get_db_pool().acquire() as conn:
+        await conn.execute("""
+            UPDATE ingest_jobs
+            SET status = $2, error = $3, chunks_total = $4, chunks_done = $5, chunks_failed = $6,
+                finished_at = now(), heartbeat_at = now(), payload = NULL
+            WHERE id = $1
+        """, job_id, status, error, progress.chunks_total, progress.chunks_done, progress.chunks_failed)
+        await conn.execute("DELETE FROM ingest_job_parts WHERE job_id = $1", job_id)
+
+
+async def _requeue_stale(conn):
+    """Задачи упавших воркеров (без heartbeat) — обратно в очередь или в failed после ingest_max_attempts."""
+    released = await conn.fetch("""
+        UPDATE ingest_jobs
+        SET status = CASE WHEN attempts >= $2 THEN 'failed' ELSE 'queued' END,
+            error = CASE WHEN attempts >= $2 THEN 'Воркер не отвечал, попытки исчерпаны' ELSE error END,
+            finished_at = CASE WHEN attempts >= $2 THEN now() END,
+            payload = CASE WHEN attempts >= $2 THEN NULL ELSE payload END
+        WHERE status = 'running' AND heartbeat_at < now() - make_interval(secs => $1)
+        RETURNING id, status
+    """, float(settings.ingest_stale_after), settings.ingest_max_attempts)
+    dropped = [row["id"] for row in released if row["status"] == "failed"]
+    if dropped:
+        await conn.execute("DELETE FROM ingest_job_parts WHERE job_id = ANY($1::bigint[])", dropped)
+    for row in released:
+        logger.warning(f"♻️ Задача #{row['id']} без heartbeat → {row['status']}")
+
+
+async def _run_job(job) -> None:
+    job_id = job["id"]
+    metadata = job["metadata"]
+    if isinstance(metadata, str):
+        metadata = json.loads(metadata)
+    progress = IngestProgress()
+    heartbeat = asyncio.create_task(_heartbeat(job_id, progress))
+    logger.info(f"⚙️ Задача #{job_id}: {job['filename']} (попытка {job['attempts']})")
+    upload = None
+    try:
+        upload = await _load_upload(job)
+        await process_document(job["client_id"], upload, metadata, progress=progress)
+    except asyncio.CancelledError:
+        # Остановка сервиса: возвращаем задачу в очередь, иначе она ждала бы истечения heartbeat
+        try:
+            async with get_db_pool().acquire() as conn:
+                await conn.execute("UPDATE ingest_jobs SET status = 'queued' WHERE id = $1", job_id)
+        except Exception as e:
+            logger.warning(f"Задача #{job_id} не возвращена в очередь: {e}")
+        raise
+    except Exception as e:
+        logger.error(f"❌ Задача #{job_id} завершилась ошибкой: {e}")
+        await _finish(job_id, progress, "failed", str(e))
+    else:
+        await _finish(job_id, progress, "done")
+        logger.info(f"✅ Задача #{job_id}: {progress.chunks_done} чанков")
+    finally:
+        heartbeat.cancel()
+        if upload is not None:
+            upload.close()
+
+
+async def ingest_worker_loop(worker_id: str):
+    while True:
+        try:
+            _wakeup.clear()
+            async with get_db_pool().acquire() as conn:
+                await _requeue_stale(conn)
+                job = await conn.fetchrow(_CLAIM_SQL, worker_id)
+            if job is None:
+                # Новые задачи этого процесса будят сразу, чужие (админка) — по опросу
+                try:
+                    await asyncio.wait_for(_wakeup.wait(), settings.ingest_poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await _run_job(job)
+        except asyncio.CancelledError:
+            break
+        except Exception as e:
+            logger.error(f"Воркер загрузки {worker_id}: {e}")
+            await asyncio.sleep(settings.ingest_poll_interval)
+
+
+def start_ingest_workers():
+    for i in range(settings.ingest_workers):
+        _workers.append(asyncio.create_task(ingest_worker_loop(f"{PROCESS_ID}:{i}")))
+    logger.info(f"👷 Запущено воркеров загрузки документов: {settings.ingest_workers}")
+
+
+async def stop_ingest_workers():
+    for task in _workers:
+        task.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
@@ -0,0 +1,81 @@
+import json
+import re
+from typing import List, Tuple
+
+OPEN_TAG = "<LEAD_JSON>"
+CLOSE_TAG = "</LEAD_JSON>"
+JSON_RE = re.compile(r"<LEAD_JSON>\s*(\{.*?\})\s*</LEAD_JSON>", re.S)
+
+
+def extract_patch(text: str) -> dict:
+    m = JSON_RE.search(text or "")
+    if not m:
+        return {}
+    return _parse_patch(m.group(1))
+
+
+def _parse_patch(raw: str) -> dict:
+    try:
+        obj = json.loads(raw)
+        return obj if isinstance(obj, dict) else {}
+    except Exception:
+        return {}
+
+
+def _partial_tag_start(text: str, tag: str) -> int:
+    """Позиция, с которой хвост text может оказаться началом tag (иначе len(text))."""
+    for i in range(max(0, len(text) - len(tag) + 1), len(text)):
+        if tag.startswith(text[i:]):
+            return i
+    return len(text)
+
+
+class LeadJsonStripper:
+    """
+    Вырезает блок <LEAD_JSON>...</LEAD_JSON> из потока дельт LLM на лету.
+    feed() возвращает видимый пользователю текст; хвост, который может оказаться
+    началом тега, придерживается до следующей дельты. Содержимое блока
+    разбирается в patch по завершении потока.
+    """
+
+    def __init__(self):
+        self._pending = ""
+        self._inside = False
+        self._block = ""
+        self._blocks: List[str] = []
+
+    def feed(self, delta: str) -> str:
+        self._pending += delta
+        visible = []
+        while True:
+            tag = CLOSE_TAG if self._inside else OPEN_TAG
+            idx = self._pending.find(tag)
+            if idx >= 0:
+                head, self._pending = self._pending[:idx], self._pending[idx + len(tag):]
+                if self._inside:
+                    self._blocks.append(self._block + head)
+                    self._block = ""
+                else:
+                    visible.append(head)
+                self._inside = not self._inside
+                continue
+            cut = _partial_tag_start(self._pending, tag)
+            head, self._pending = self._pending[:cut], self._pending[cut:]
+            if self._inside:
+                self._block += head
+            else:
+                visible.append(head)
+            return "".join(visible)
+
+    def finish(self) -> Tuple[str, dict]:
+        """Остаток видимого текста и patch из первого корректного блока."""
+        tail = "" if self._inside else self._pending
+        if self._inside:
+            # Незакрытый блок: модель оборвалась на середине JSON
+            self._blocks.append(self._block + self._pending)
+        self._pending = ""
+        for block in self._blocks:
+            patch = _parse_patch(block.strip())
+            if patch:
+                return tail, patch
+        return tail, {}
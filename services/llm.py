@@ -1,40 +1,292 @@
+import asyncio
+import hashlib
+import json
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
 import httpx
+
+from core.logger import logger
 from config import settings
+from services.llm_router import LLMRouter
+from services.llm_scheduler import get_llm_scheduler
+from services.singleflight import SingleFlight, StreamFlight
 
+# Один клиент на провайдера: keep-alive пул и HTTP/2 (несколько запросов в одном
+# соединении), поэтому ход диалога не платит за TCP+TLS до API.
+# Клиент привязан к циклу событий и пересоздаётся при вызове из другого цикла.
+_clients: Dict[str, Tuple[httpx.AsyncClient, asyncio.AbstractEventLoop]] = {}
+
+
+class PromptCacheStats:
+    """
+    Счётчики входных токенов из блока usage: сколько взято из кэша контекста провайдера.
+    DeepSeek отдаёт prompt_cache_hit_tokens/prompt_cache_miss_tokens,
+    OpenAI — prompt_tokens_details.cached_tokens.
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.completion_tokens = 0
+
+    def record(self, provider: str, usage: Optional[Dict[str, Any]]):
+        if not usage:
+            return
+        prompt = usage.get("prompt_tokens") or 0
+        if "prompt_cache_hit_tokens" in usage:
+            cached = usage.get("prompt_cache_hit_tokens") or 0
+        else:
+            cached = (usage.get("prompt_tokens_details") or {}).get("cached_tokens") or 0
+        self.requests += 1
+        self.prompt_tokens += prompt
+        self.cached_tokens += cached
+        self.completion_tokens += usage.get("completion_tokens") or 0
+        logger.info(f"💾 LLM {provider}: промпт {prompt} токенов, из кэша {cached}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "prompt_tokens": self.prompt_tokens,
+            "cached_tokens": self.cached_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cache_hit_ratio": round(self.cached_tokens / self.prompt_tokens, 3) if self.prompt_tokens else 0.0,
+        }
+
+
+prompt_cache_stats = PromptCacheStats()
+
+
+def _provider_endpoint(provider: str) -> Tuple[str, str]:
+    if provider == "deepseek":
+        return settings.deepseek_api_url, settings.deepseek_api_key
+    if provider == "openai":
+        return settings.openai_api_url, settings.openai_api_key
+    raise ValueError(f"Unknown LLM provider: {provider}")
+
+
+def _http2_enabled() -> bool:
+    if not settings.llm_http2:
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        logger.warning("Пакет h2 не установлен (httpx[http2]) — LLM-клиент работает по HTTP/1.1")
+        return False
+    return True
+
+
+def get_llm_client(provider: Optional[str] = None) -> httpx.AsyncClient:
+    provider = provider or settings.llm_provider
+    loop = asyncio.get_running_loop()
+    entry = _clients.get(provider)
+    if entry is None or entry[0].is_closed or entry[1] is not loop:
+        base_url, api_key = _provider_endpoint(provider)
+        http2 = _http2_enabled()
+        client = httpx.AsyncClient(
+            base_url=base_url,
+            headers={"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"},
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=settings.llm_pool_limit,
+                max_keepalive_connections=settings.llm_pool_limit,
+                keepalive_expiry=settings.llm_keepalive_expiry,
+            ),
+            timeout=httpx.Timeout(
+                connect=settings.llm_connect_timeout,
+                read=settings.llm_read_timeout,
+                write=settings.llm_connect_timeout,
+                pool=settings.llm_connect_timeout,
+            ),
+        )
+        _clients[provider] = (client, loop)
+        logger.info(f"🔗 LLM-клиент {provider} создан ({base_url}, http2={http2}, пул {settings.llm_pool_limit})")
+    return _clients[provider][0]
+
+
+async def close_llm_clients():
+    for provider, (client, _) in list(_clients.items()):
+        if not client.is_closed:
+            await client.aclose()
+            logger.info(f"🔌 LLM-клиент {provider} закрыт")
+    _clients.clear()
+
+
+def _provider_model(provider: str) -> str:
+    return settings.openai_chat_model if provider == "openai" else settings.chat_model
+
+
+def configured_providers() -> List[str]:
+    """Порядок провайдеров для роутера; резервные без API-ключа пропускаются."""
+    names = [p.strip() for p in settings.llm_providers.split(",") if p.strip()] or [settings.llm_provider]
+    return [p for i, p in enumerate(names) if i == 0 or _provider_endpoint(p)[1]]
+
+
+_router: Optional[LLMRouter] = None
 
-async def ask_llm(messages: list, temperature: float = 0.1, max_tokens: int = 2000):
-
-    if settings.llm_provider == "deepseek":
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            resp = await client.post(
-                f"{settings.deepseek_api_url}/chat/completions",
-                headers={"Authorization": f"Bearer {settings.deepseek_api_key}"},
-                json={
-                    "model": settings.chat_model,
-                    "messages": messages,
-                    "temperature": temperature,
-                    "max_tokens": max_tokens,
-                },
-            )
-        resp.raise_for_status()
-        return resp.json()["choices"][0]["message"]["content"]
-
-    # ---------- OPENAI ----------
-    elif settings.llm_provider == "openai":
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            resp = await client.post(
-                f"{settings.openai_api_url}/chat/completions",
-                headers={"Authorization": f"Bearer {settings.openai_api_key}"},
-                json={
-                    "model": settings.chat_model,
-                    "messages": messages,
-                    "temperature": temperature,
-                    "max_tokens": max_tokens,
-                },
-            )
 
+def get_llm_router() -> LLMRouter:
+    global _router
+    if _router is None:
+        _router = LLMRouter(
+            configured_providers(),
+            hedge=settings.llm_hedge,
+            hedge_delay=settings.llm_hedge_delay,
+            min_delay=settings.llm_hedge_min_delay,
+            max_delay=settings.llm_hedge_max_delay,
+            alpha=settings.llm_ewma_alpha,
+        )
+        logger.info(f"🧭 LLM-роутер: {', '.join(_router.providers)} (хедж {'вкл' if settings.llm_hedge else 'выкл'})")
+    return _router
+
+
+def set_llm_router(router: Optional[LLMRouter]):
+    global _router
+    _router = router
+
+
+# Одинаковые одновременные запросы (рассылка или объявление → десятки одинаковых
+# первых вопросов) идут к провайдеру одним вызовом; ещё llm_singleflight_ttl секунд
+# после ответа он же отдаётся хвосту всплеска
+_completion_flight = SingleFlight(ttl=settings.llm_singleflight_ttl)
+_stream_flight = StreamFlight(ttl=settings.llm_singleflight_ttl)
+
+
+def _request_key(provider: str, payload: Dict[str, Any]) -> str:
+    raw = json.dumps([provider, payload], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def llm_singleflight_stats() -> Dict[str, Any]:
+    return {"completions": _completion_flight.stats(), "streams": _stream_flight.stats()}
+
+
+async def _post_completion(provider: str, body: Dict[str, Any]) -> Dict[str, Any]:
+    client = get_llm_client(provider)
+    resp = await client.post("/chat/completions", json={"model": _provider_model(provider), **body})
+    if resp.is_error:
+        logger.error(f"LLM {provider} {resp.status_code}: {resp.text[:500]}")
+    resp.raise_for_status()
+    data = resp.json()
+    if isinstance(data, dict):
+        prompt_cache_stats.record(provider, data.get("usage"))
+    return data
+
+
+async def chat_completion(
+    messages: list,
+    temperature: float = 0.1,
+    max_tokens: int = 2000,
+    provider: Optional[str] = None,
+    client_id: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Сырой ответ /chat/completions. Без provider запрос идёт через роутер
+    (хедж и переключение между провайдерами), иначе — строго к указанному.
+    Вызов занимает слот планировщика (services/llm_scheduler.py) в очереди client_id.
+    """
+    body = {
+        "messages": messages,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+    }
+
+    async def call():
+        async with get_llm_scheduler().slot(client_id):
+            if provider:
+                return await _post_completion(provider, body)
+            return await get_llm_router().complete(lambda p: _post_completion(p, body))
+
+    if not settings.llm_singleflight:
+        return await call()
+    return await _completion_flight.do(_request_key(provider or "auto", body), call)
+
+
+async def _stream_completion(provider: str, body: Dict[str, Any]) -> AsyncIterator[str]:
+    client = get_llm_client(provider)
+    payload = {"model": _provider_model(provider), **body}
+    async with client.stream("POST", "/chat/completions", json=payload) as resp:
+        if resp.is_error:
+            error = await resp.aread()
+            logger.error(f"LLM {provider} {resp.status_code}: {error[:500].decode('utf-8', 'replace')}")
         resp.raise_for_status()
-        return resp.json()["choices"][0]["message"]["content"]
+        async for line in resp.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            data = line[5:].strip()
+            if data == "[DONE]":
+                break
+            try:
+                event = json.loads(data)
+            except ValueError:
+                continue
+            if event.get("usage"):
+                prompt_cache_stats.record(provider, event["usage"])
+            choices = event.get("choices") or []
+            if choices:
+                delta = (choices[0].get("delta") or {}).get("content")
+                if delta:
+                    yield delta
+
+
+async def stream_chat_completion(
+    messages: list,
+    temperature: float = 0.1,
+    max_tokens: int = 2000,
+    provider: Optional[str] = None,
+    client_id: Optional[str] = None,
+) -> AsyncIterator[str]:
+    """
+    Дельты текста из /chat/completions со stream=true (SSE) по мере генерации.
+    Слот планировщика занят до конца потока.
+    """
+    body = {
+        "messages": messages,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+        "stream": True,
+        # usage (в т.ч. попадания в кэш) приходит последним событием потока
+        "stream_options": {"include_usage": True},
+    }
 
+    async def open_stream() -> AsyncIterator[str]:
+        async with get_llm_scheduler().slot(client_id):
+            if provider:
+                deltas = _stream_completion(provider, body)
+            else:
+                deltas = get_llm_router().stream(lambda p: _stream_completion(p, body))
+            async for delta in deltas:
+                yield delta
+
+    if not settings.llm_singleflight:
+        deltas = open_stream()
     else:
-        raise Exception("Unknown LLM provider")
+        deltas = _stream_flight.stream(_request_key(provider or "auto", body), open_stream)
+    async for delta in deltas:
+        yield delta
+
+
+def extract_content(data: Any) -> Optional[str]:
+    """Текст ответа из OpenAI-совместимого JSON (message.content или text)."""
+    if isinstance(data, dict):
+        choices = data.get("choices")
+        if choices and isinstance(choices, list):
+            first = choices[0]
+            # OpenAI-style формат
+            if "message" in first:
+                content = first["message"].get("content")
+                if content:
+                    return content
+            # альтернативный формат
+            if "text" in first:
+                return first["text"]
+    return None
+
+
+async def ask_llm(messages: list, temperature: float = 0.1, max_tokens: int = 2000,
+                  client_id: Optional[str] = None):
+    data = await chat_completion(messages, temperature, max_tokens, client_id=client_id)
+    content = extract_content(data)
+    if content is None:
+        raise ValueError(f"Unexpected LLM response: {data}")
+    return content
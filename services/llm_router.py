@@ -0,0 +1,193 @@
+import asyncio
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from core.logger import logger
+
+_EMPTY = object()  # поток завершился, не выдав ни одного фрагмента
+
+
+class ProviderHealth:
+    """Скользящие оценки провайдера: EWMA задержки и доли ошибок, окно задержек для p95."""
+
+    def __init__(self, alpha: float, window: int = 200):
+        self.alpha = alpha
+        self.latency: Optional[float] = None   # сек, EWMA
+        self.error_rate = 0.0                  # 0..1, EWMA
+        self._samples: deque = deque(maxlen=window)
+        self.successes = 0
+        self.errors = 0
+
+    def success(self, seconds: float):
+        self.successes += 1
+        self._samples.append(seconds)
+        self.latency = seconds if self.latency is None else self.alpha * seconds + (1 - self.alpha) * self.latency
+        self.error_rate *= 1 - self.alpha
+
+    def failure(self):
+        self.errors += 1
+        self.error_rate = self.alpha + (1 - self.alpha) * self.error_rate
+
+    def p95(self, min_samples: int = 20) -> Optional[float]:
+        if len(self._samples) < min_samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[int(0.95 * (len(ordered) - 1))]
+
+    def score(self, default_latency: float) -> float:
+        """Ожидаемая «цена» запроса: задержка, раздутая долей ошибок. Меньше — лучше."""
+        latency = self.latency if self.latency is not None else default_latency
+        return latency / max(0.05, 1.0 - self.error_rate)
+
+    def stats(self) -> Dict[str, Any]:
+        p95 = self.p95(min_samples=1)
+        return {
+            "latency_ewma": round(self.latency, 3) if self.latency is not None else None,
+            "latency_p95": round(p95, 3) if p95 is not None else None,
+            "error_rate": round(self.error_rate, 3),
+            "successes": self.successes,
+            "errors": self.errors,
+        }
+
+
+class LLMRouter:
+    """
+    Выбор провайдера LLM с хеджированием и переключением при сбоях.
+    Основной провайдер — с лучшей оценкой (EWMA задержки / доля успехов); при
+    равенстве — первый в списке, а чтобы трафик не метался, остальным добавляется
+    запас stickiness. Если основной не ответил за p95 своей задержки, параллельно
+    уходит запрос к следующему; берётся первый успешный ответ, второй отменяется.
+    Ошибка до ответа — сразу переход к следующему провайдеру.
+    Для потоков «ответом» считается первый фрагмент (время до первого токена).
+    """
+
+    def __init__(self, providers: List[str], hedge: bool = True, hedge_delay: float = 3.0,
+                 min_delay: float = 0.5, max_delay: float = 15.0, alpha: float = 0.2,
+                 stickiness: float = 1.2):
+        self.providers = list(providers)
+        self.hedge = hedge
+        self.hedge_delay = hedge_delay
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.stickiness = stickiness
+        # Полный ответ и первый токен потока — разные величины, оцениваются отдельно
+        self._health: Dict[str, Dict[str, ProviderHealth]] = {
+            kind: {p: ProviderHealth(alpha) for p in self.providers} for kind in ("completion", "stream")
+        }
+        self.requests = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.failovers = 0
+
+    def order(self, kind: str = "completion") -> List[str]:
+        health = self._health[kind]
+
+        def key(item: Tuple[int, str]):
+            position, provider = item
+            score = health[provider].score(self.hedge_delay)
+            return (score if position == 0 else score * self.stickiness), position
+
+        return [p for _, p in sorted(enumerate(self.providers), key=key)]
+
+    def delay_for(self, provider: str, kind: str = "completion") -> float:
+        p95 = self._health[kind][provider].p95()
+        if p95 is None:
+            return self.hedge_delay
+        return min(self.max_delay, max(self.min_delay, p95))
+
+    async def _timed(self, kind: str, provider: str, call: Callable[[str], Awaitable[Any]]) -> Any:
+        started = time.monotonic()
+        try:
+            result = await call(provider)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self._health[kind][provider].failure()
+            raise
+        self._health[kind][provider].success(time.monotonic() - started)
+        return result
+
+    async def _race(self, kind: str, call: Callable[[str], Awaitable[Any]]) -> Tuple[str, Any]:
+        """(провайдер, результат) первого успешного вызова с хеджем и переключением."""
+        self.requests += 1
+        order = self.order(kind)
+        pending: Dict[asyncio.Task, str] = {}
+        last_error: Optional[BaseException] = None
+        next_index = 0
+
+        def launch():
+            nonlocal next_index
+            provider = order[next_index]
+            next_index += 1
+            pending[asyncio.ensure_future(self._timed(kind, provider, call))] = provider
+
+        launch()
+        try:
+            while pending:
+                can_hedge = self.hedge and next_index < len(order) and len(pending) == 1
+                timeout = self.delay_for(order[0], kind) if can_hedge else None
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    self.hedged += 1
+                    logger.info(f"⏱️ LLM {order[0]} не ответил за {timeout:.2f} с — хедж на {order[next_index]}")
+                    launch()
+                    continue
+                for task in done:
+                    provider = pending.pop(task)
+                    if task.exception() is None:
+                        if provider != order[0] and last_error is None:
+                            self.hedge_wins += 1
+                        return provider, task.result()
+                    last_error = task.exception()
+                    logger.warning(f"LLM {provider} ошибка: {last_error!r}")
+                if not pending and next_index < len(order):
+                    self.failovers += 1
+                    logger.warning(f"🔀 Переключение LLM на {order[next_index]}")
+                    launch()
+            raise last_error
+        finally:
+            for task in pending:
+                task.cancel()
+            # Дожидаемся отмены, чтобы проигравший успел закрыть соединение
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    async def complete(self, call: Callable[[str], Awaitable[Any]]) -> Any:
+        return (await self._race("completion", call))[1]
+
+    async def stream(self, open_stream: Callable[[str], AsyncIterator[Any]]) -> AsyncIterator[Any]:
+        streams: Dict[str, AsyncIterator[Any]] = {}
+
+        async def first_item(provider: str):
+            stream = streams[provider] = open_stream(provider)
+            try:
+                return await stream.__anext__()
+            except StopAsyncIteration:
+                return _EMPTY
+
+        winner = None
+        try:
+            winner, first = await self._race("stream", first_item)
+        finally:
+            # Проигравшие потоки закрываем, чтобы освободить соединения
+            for provider, stream in streams.items():
+                if provider != winner:
+                    await stream.aclose()
+        if first is _EMPTY:
+            return
+        yield first
+        async for item in streams[winner]:
+            yield item
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "order": self.order(),
+            "requests": self.requests,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "failovers": self.failovers,
+            "providers": {
+                p: {kind: health[p].stats() for kind, health in self._health.items()}
+                for p in self.providers
+            },
+        }
@@ -0,0 +1,178 @@
+import asyncio
+import heapq
+import itertools
+import time
+from collections import defaultdict, deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+from config import settings
+
+ANONYMOUS = "-"  # запросы без client_id — одна общая очередь
+
+
+class LLMQueueTimeout(Exception):
+    """Запрос простоял в очереди к LLM дольше дедлайна и снят."""
+
+    def __init__(self, client_id: str, waited: float):
+        super().__init__(f"LLM queue deadline exceeded for {client_id} after {waited:.1f}s")
+        self.client_id = client_id
+        self.waited = waited
+
+
+@dataclass(order=True)
+class _Waiter:
+    tag: float
+    seq: int
+    client_id: str = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+    enqueued: float = field(compare=False)
+
+
+def parse_weights(raw: str) -> Dict[str, float]:
+    """'client_a:2,client_b:0.5' → {'client_a': 2.0, 'client_b': 0.5}."""
+    weights = {}
+    for part in raw.split(","):
+        name, _, value = part.strip().rpartition(":")
+        if name:
+            weights[name] = float(value)
+    return weights
+
+
+class FairScheduler:
+    """
+    Не больше capacity одновременных вызовов LLM на процесс; ожидающие
+    обслуживаются взвешенной справедливой очередью по client_id (виртуальное
+    время, как в WFQ): каждый запрос клиента получает метку
+    max(V, последняя метка клиента) + 1/вес, слот отдаётся наименьшей метке.
+    Клиент, заливший очередь сотней запросов, получает свою долю слотов, но не
+    отодвигает единичные запросы остальных. Запрос, не получивший слот за
+    deadline секунд, снимается с LLMQueueTimeout.
+    """
+
+    def __init__(self, capacity: int, weights: Optional[Dict[str, float]] = None,
+                 default_weight: float = 1.0, deadline: float = 0.0, window: int = 1000):
+        self.capacity = capacity
+        self.weights = weights or {}
+        self.default_weight = default_weight
+        self.deadline = deadline
+        self._heap: list = []
+        self._seq = itertools.count()
+        self._virtual = 0.0
+        self._last_tag: Dict[str, float] = {}
+        self._queued: Dict[str, int] = defaultdict(int)
+        self._waiting = 0
+        self._waits: deque = deque(maxlen=window)
+        self.in_flight = 0
+        self.granted = 0
+        self.queued_total = 0
+        self.rejected = 0
+
+    def weight(self, client_id: str) -> float:
+        return max(1e-6, self.weights.get(client_id, self.default_weight))
+
+    def _grant(self, waited: float):
+        self.granted += 1
+        self._waits.append(waited)
+
+    async def acquire(self, client_id: Optional[str] = None, deadline: Optional[float] = None):
+        client_id = client_id or ANONYMOUS
+        if self.in_flight < self.capacity and not self._waiting:
+            self.in_flight += 1
+            self._grant(0.0)
+            return
+
+        tag = max(self._virtual, self._last_tag.get(client_id, 0.0)) + 1.0 / self.weight(client_id)
+        self._last_tag[client_id] = tag
+        enqueued = time.monotonic()
+        waiter = _Waiter(tag, next(self._seq), client_id, asyncio.get_running_loop().create_future(), enqueued)
+        heapq.heappush(self._heap, waiter)
+        self._queued[client_id] += 1
+        self._waiting += 1
+        self.queued_total += 1
+
+        timeout = self.deadline if deadline is None else deadline
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), timeout=timeout or None)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # Слот уже выдан в момент отмены — передаём его дальше
+                self.release()
+            else:
+                waiter.future.cancel()
+                self._dequeued(client_id)
+            if isinstance(e, asyncio.TimeoutError):
+                self.rejected += 1
+                raise LLMQueueTimeout(client_id, time.monotonic() - enqueued) from None
+            raise
+
+    def _dequeued(self, client_id: str):
+        self._waiting -= 1
+        self._queued[client_id] -= 1
+        if not self._queued[client_id]:
+            del self._queued[client_id]
+
+    def release(self):
+        while self._heap:
+            waiter = heapq.heappop(self._heap)
+            if waiter.future.done():
+                continue  # снят по дедлайну или отменён
+            self._virtual = waiter.tag
+            self._dequeued(waiter.client_id)
+            self._grant(time.monotonic() - waiter.enqueued)
+            # Слот переходит ожидающему напрямую, in_flight не меняется
+            waiter.future.set_result(None)
+            return
+        self.in_flight -= 1
+        if not self._waiting:
+            # Очередь пуста — старые метки больше не нужны
+            self._last_tag.clear()
+            self._virtual = 0.0
+
+    @asynccontextmanager
+    async def slot(self, client_id: Optional[str] = None, deadline: Optional[float] = None):
+        await self.acquire(client_id, deadline)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> Dict[str, Any]:
+        waits = np.asarray(self._waits) * 1000 if self._waits else np.zeros(1)
+        p50, p95 = np.percentile(waits, [50, 95])
+        return {
+            "capacity": self.capacity,
+            "in_flight": self.in_flight,
+            "queue_depth": self._waiting,
+            "queue_by_client": dict(self._queued),
+            "granted": self.granted,
+            "queued_total": self.queued_total,
+            "rejected": self.rejected,
+            "wait_ms_p50": round(float(p50), 1),
+            "wait_ms_p95": round(float(p95), 1),
+            "wait_ms_max": round(float(waits.max()), 1),
+        }
+
+
+_scheduler: Optional[FairScheduler] = None
+_scheduler_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def get_llm_scheduler() -> FairScheduler:
+    global _scheduler, _scheduler_loop
+    loop = asyncio.get_running_loop()
+    if _scheduler is None or _scheduler_loop is not loop:
+        _scheduler = FairScheduler(
+            capacity=settings.llm_max_concurrency,
+            weights=parse_weights(settings.llm_tenant_weights),
+            deadline=settings.llm_queue_deadline,
+        )
+        _scheduler_loop = loop
+    return _scheduler
+
+
+def llm_scheduler_stats() -> Dict[str, Any]:
+    return _scheduler.stats() if _scheduler is not None else {}
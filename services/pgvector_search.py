@@ -0,0 +1,61 @@
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from services.db import get_db_pool
+from services.vector_index import decode_metadata
+from core.logger import logger
+from config import settings
+
+
+async def search_pgvector(
+    query_embedding,
+    client_id: Optional[str],
+    top_k: int = 5,
+    threshold: float = 0.1,
+) -> List[Dict[str, Any]]:
+    """
+    ANN-поиск по HNSW-индексу embedding_vec (migrations/002_pgvector_hnsw.sql).
+    По сети передаются только top_k строк; порог применяется к ним же,
+    иначе условие на расстояние в WHERE отключило бы индекс.
+    """
+    query = np.asarray(query_embedding, dtype=np.float32)
+    if query.shape[0] != settings.vector_dimension:
+        logger.warning(
+            f"pgvector: размерность запроса {query.shape[0]} != vector_dimension {settings.vector_dimension}"
+        )
+
+    pool = get_db_pool()
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            await conn.execute(f"SET LOCAL hnsw.ef_search = {int(settings.hnsw_ef_search)}")
+            if settings.hnsw_iterative_scan in ("strict_order", "relaxed_order"):
+                # pgvector >= 0.8: добор кандидатов, если фильтр по клиенту отсёк часть соседей
+                await conn.execute(f"SET LOCAL hnsw.iterative_scan = {settings.hnsw_iterative_scan}")
+            if client_id:
+                rows = await conn.fetch("""
+                    SELECT id, content, metadata, 1 - (embedding_vec <=> $1) AS score
+                    FROM documents
+                    WHERE client_id = $2 AND embedding_vec IS NOT NULL
+                    ORDER BY embedding_vec <=> $1
+                    LIMIT $3
+                """, query, client_id, top_k)
+            else:
+                rows = await conn.fetch("""
+                    SELECT id, content, metadata, 1 - (embedding_vec <=> $1) AS score
+                    FROM documents
+                    WHERE embedding_vec IS NOT NULL
+                    ORDER BY embedding_vec <=> $1
+                    LIMIT $2
+                """, query, top_k)
+
+    return [
+        {
+            "id": row["id"],
+            "content": row["content"],
+            "metadata": decode_metadata(row["metadata"]),
+            "score": float(row["score"]),
+        }
+        for row in rows
+        if row["score"] >= threshold
+    ]
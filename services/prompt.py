@@ -0,0 +1,29 @@
+from dataclasses import dataclass
+from typing import Iterable, List
+
+# Стабильность сегмента промпта. Провайдеры (DeepSeek, OpenAI) кэшируют общий
+# префикс запроса: чем дальше от начала первый изменившийся токен, тем больше
+# входных токенов оплачивается по цене кэша и тем быстрее первый токен ответа.
+STATIC = 0     # не меняется между ходами: базовая роль, инструкции клиента, правила лида
+SESSION = 1    # меняется редко: приветствие, сводка диалога
+VOLATILE = 2   # каждый ход: найденные документы, история, состояние анкеты
+
+
+@dataclass
+class PromptSegment:
+    name: str
+    text: str
+    stability: int = STATIC
+
+
+def assemble_system_prompt(segments: Iterable[PromptSegment]) -> str:
+    """Склеивает непустые сегменты от самых статичных к самым изменчивым (порядок внутри уровня сохраняется)."""
+    ordered = sorted((s for s in segments if s.text and s.text.strip()), key=lambda s: s.stability)
+    return "\n\n".join(s.text.strip() for s in ordered)
+
+
+def build_messages(segments: Iterable[PromptSegment], user_message: str) -> List[dict]:
+    return [
+        {"role": "system", "content": assemble_system_prompt(segments)},
+        {"role": "user", "content": user_message},
+    ]
@@ -1,11 +1,34 @@
-import json
+import asyncio
 import numpy as np
 from typing import List, Dict, Any, Optional
-from services.db import get_db_pool
 from services.embeddings import get_embedding
+from services.db import get_db_pool
+from services.vector_index import vector_index
+from services.pgvector_search import search_pgvector
+from services.embedding_migration import all_tenants_converted, is_tenant_converted
 from core.logger import logger
 from config import settings
 
+async def _search_all_tenants(query_embedding, top_k: int, threshold: float) -> List[Dict[str, Any]]:
+    """
+    Поиск без клиента по индексам клиентов в памяти (как и поиск по клиенту):
+    top_k каждого клиента, затем общий top_k. Документы из БД заново не читаются.
+    """
+    pool = get_db_pool()
+    async with pool.acquire() as conn:
+        rows = await conn.fetch("SELECT DISTINCT client_id FROM documents")
+    query = np.asarray(query_embedding, dtype=np.float32)
+    results = []
+    for row in rows:
+        index = await vector_index.get(row["client_id"])
+        # Клиенты на другой модели эмбеддингов с этим запросом несравнимы
+        if len(index) and index.matrix.shape[1] == query.shape[0]:
+            results.extend(index.search(query, top_k, threshold))
+    logger.info(f"📚 Поиск без клиента: клиентов {len(rows)}, кандидатов {len(results)}")
+    results.sort(key=lambda doc: doc["score"], reverse=True)
+    return results[:top_k]
+
+
 async def retrieve_relevant_docs(
     query: str,
     user_id: Optional[str] = None,
@@ -20,70 +43,23 @@ async def retrieve_relevant_docs(
             logger.warning("RAG: не удалось получить эмбеддинг запроса")
             return []
 
-        pool = get_db_pool()
-        async with pool.acquire() as conn:
-            if user_id:
-                rows = await conn.fetch("""
-                    SELECT id, content, metadata, embedding
-                    FROM documents
-                    WHERE client_id = $1 AND embedding IS NOT NULL
-                """, user_id)
-                logger.info(f"📚 Найдено документов в БД для клиента {user_id}: {len(rows)}")
-            else:
-                rows = await conn.fetch("""
-                    SELECT id, content, metadata, embedding
-                    FROM documents
-                    WHERE embedding IS NOT NULL
-                """)
-                logger.info(f"📚 Найдено документов (всех) в БД: {len(rows)}")
-
-        if not rows:
-            logger.info("RAG: нет документов с эмбеддингами")
-            return []
-
-        docs = []
-        for row in rows:
-            try:
-                embedding = row['embedding']
-                if embedding is None:
-                    continue
-                # Если это уже numpy array, преобразуем в массив для вычислений
-                # pgvector может вернуть как list, так и numpy.ndarray
-                emb_array = np.array(embedding, dtype=np.float32)
-                
-                # Обработка метаданных (могут быть строкой или словарём)
-                metadata = row['metadata']
-                if isinstance(metadata, str):
-                    try:
-                        metadata = json.loads(metadata)
-                    except:
-                        metadata = {}
-                elif not isinstance(metadata, dict):
-                    metadata = {}
-
-                docs.append({
-                    'id': row['id'],
-                    'content': row['content'],
-                    'metadata': metadata,
-                    'embedding': emb_array
-                })
-            except Exception as e:
-                logger.warning(f"Ошибка обработки документа {row['id']}: {e}", exc_info=True)
-                continue
-
-        if not docs:
-            logger.info("RAG: нет документов после обработки")
-            return []
-
-        query_array = np.array(query_embedding, dtype=np.float32)
-        query_norm = query_array / np.linalg.norm(query_array)
-        for doc in docs:
-            doc_norm = doc['embedding'] / np.linalg.norm(doc['embedding'])
-            similarity = np.dot(query_norm, doc_norm)
-            doc['score'] = float(similarity)
-
-        sorted_docs = sorted(docs, key=lambda x: x['score'], reverse=True)
-        results = [doc for doc in sorted_docs if doc['score'] >= threshold][:top_k]
+        # pgvector — только при rag_backend="pgvector" и только по уже перенесённым
+        # в embedding_vec строкам: для клиента — после проверки его переноса, без
+        # клиента — когда перенесены все. Иначе строки только с jsonb-эмбеддингом
+        # молча не находились бы.
+        if settings.rag_backend == "pgvector" and (
+            await is_tenant_converted(user_id) if user_id else await all_tenants_converted()
+        ):
+            results = await search_pgvector(query_embedding, user_id, top_k, threshold)
+        elif not user_id:
+            results = await _search_all_tenants(query_embedding, top_k, threshold)
+        else:
+            index = await vector_index.get(user_id)
+            logger.info(f"📚 Документов в индексе клиента {user_id}: {len(index)}")
+            if not len(index):
+                logger.info("RAG: нет документов с эмбеддингами")
+                return []
+            results = index.search(np.asarray(query_embedding, dtype=np.float32), top_k, threshold)
 
         logger.info(f"📚 RAG итоговых документов: {len(results)}")
         for i, doc in enumerate(results):
@@ -92,4 +68,21 @@ async def retrieve_relevant_docs(
 
     except Exception as e:
         logger.exception(f"RAG retrieve error: {e}")
-        return []
\ No newline at end of file
+        return []
+
+
+async def retrieve_relevant_docs_batch(
+    queries: List[str],
+    user_id: str,
+    top_k: int = 5,
+    threshold: float = 0.1,
+) -> List[List[Dict[str, Any]]]:
+    """
+    Поиск для нескольких запросов одного клиента (опрос Avito, офлайн-оценка):
+    все близости считаются одним матричным умножением.
+    """
+    if not queries:
+        return []
+    embeddings = await asyncio.gather(*(get_embedding(q) for q in queries))
+    index = await vector_index.get(user_id)
+    return index.search_batch(np.asarray(embeddings, dtype=np.float32), top_k, threshold)
@@ -0,0 +1,38 @@
+import asyncio
+import time
+
+
+class TokenBucket:
+    """
+    Асинхронный token bucket: не более `rate` запросов в секунду
+    с допустимым всплеском до `capacity`.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, tokens: float = 1.0):
+        if self.rate <= 0:
+            return
+        # Под замком ждёт только голова очереди, остальные — в порядке прихода
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
+
+    def penalize(self, seconds: float):
+        """После 429 от провайдера: обнуляем запас, чтобы следующий запрос подождал."""
+        self._refill()
+        self._tokens = min(self._tokens, -seconds * self.rate)
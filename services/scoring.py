@@ -0,0 +1,47 @@
+from typing import List, Tuple
+
+import numpy as np
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """L2-нормализация строк матрицы (нулевые строки остаются нулевыми)."""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix[None, :]
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return np.ascontiguousarray(matrix / norms, dtype=np.float32)
+
+
+def _select(scores: np.ndarray, top_k: int, threshold: float) -> Tuple[np.ndarray, np.ndarray]:
+    """Индексы top_k строк со score >= threshold, по убыванию score."""
+    candidates = np.flatnonzero(scores >= threshold)
+    if candidates.size > top_k:
+        part = np.argpartition(scores[candidates], -top_k)[-top_k:]
+        candidates = candidates[part]
+    order = np.argsort(scores[candidates])[::-1]
+    winners = candidates[order]
+    return winners, scores[winners]
+
+
+def top_k(matrix: np.ndarray, query: np.ndarray, k: int, threshold: float) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Косинусная близость запроса ко всем строкам одним matvec.
+    `matrix` должна быть нормализована заранее (normalize_rows).
+    """
+    if not len(matrix) or k <= 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+    q = normalize_rows(query)[0]
+    return _select(matrix @ q, k, threshold)
+
+
+def top_k_batch(
+    matrix: np.ndarray, queries: np.ndarray, k: int, threshold: float
+) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """То же для матрицы запросов (m, dim): все близости считаются одним GEMM."""
+    queries = normalize_rows(queries)
+    if not len(matrix) or k <= 0:
+        empty = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32))
+        return [empty for _ in range(len(queries))]
+    scores = queries @ matrix.T  # (m, n)
+    return [_select(row, k, threshold) for row in scores]
@@ -0,0 +1,178 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, List, Optional
+
+
+class _RecentResults:
+    """Успешные результаты последних вызовов, живут ttl секунд после завершения."""
+
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._items: "OrderedDict[Hashable, tuple]" = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[tuple]:
+        if self.ttl <= 0:
+            return None
+        now = time.monotonic()
+        # ttl общий, поэтому порядок вставки совпадает с порядком истечения
+        while self._items:
+            oldest = next(iter(self._items.values()))
+            if oldest[0] > now:
+                break
+            self._items.popitem(last=False)
+        entry = self._items.get(key)
+        return (entry[1],) if entry else None
+
+    def put(self, key: Hashable, value: Any):
+        if self.ttl <= 0:
+            return
+        self._items.pop(key, None)
+        self._items[key] = (time.monotonic() + self.ttl, value)
+        while len(self._items) > self.max_entries:
+            self._items.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+class SingleFlight:
+    """
+    Объединение одинаковых одновременных вызовов: пока вызов по ключу
+    выполняется, остальные ждут тот же результат (или то же исключение).
+    Сам вызов идёт отдельной задачей, поэтому отмена одного из ожидающих
+    не отменяет его для остальных.
+    С ttl > 0 успешный результат ещё ttl секунд отдаётся без нового вызова —
+    это гасит хвост всплеска одинаковых запросов.
+    """
+
+    def __init__(self, ttl: float = 0.0, max_recent: int = 1024):
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self._recent = _RecentResults(ttl, max_recent)
+        self.calls = 0
+        self.shared = 0
+        self.reused = 0
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._inflight
+
+    def _done(self, key: Hashable, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if task.cancelled():
+            return
+        # Исключение уже получили ожидающие; если их не осталось — не шумим в лог
+        if task.exception() is None:
+            self._recent.put(key, task.result())
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        recent = self._recent.get(key)
+        if recent is not None:
+            self.reused += 1
+            return recent[0]
+        task = self._inflight.get(key)
+        if task is None:
+            self.calls += 1
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+        else:
+            self.shared += 1
+        return await asyncio.shield(task)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "calls": self.calls,
+            "shared": self.shared,
+            "reused": self.reused,
+            "inflight": len(self._inflight),
+            "recent": len(self._recent),
+        }
+
+
+class _SharedStream:
+    def __init__(self):
+        self.items: List[Any] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self._changed = asyncio.Event()
+
+    def notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def iterate(self) -> AsyncIterator[Any]:
+        i = 0
+        while True:
+            while i < len(self.items):
+                yield self.items[i]
+                i += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await self._changed.wait()
+
+
+class StreamFlight:
+    """
+    SingleFlight для потоков: одинаковые одновременные запросы читают один
+    поток источника. Подключившийся позже сначала получает уже пришедшие
+    элементы, затем новые по мере поступления. Источник читается отдельной
+    задачей до конца, даже если все читатели ушли; с ttl > 0 завершённый поток
+    ещё ttl секунд проигрывается новым читателям целиком.
+    """
+
+    def __init__(self, ttl: float = 0.0, max_recent: int = 256):
+        self._inflight: Dict[Hashable, _SharedStream] = {}
+        self._recent = _RecentResults(ttl, max_recent)
+        self._tasks: set = set()
+        self.calls = 0
+        self.shared = 0
+        self.reused = 0
+
+    async def _pump(self, key: Hashable, shared: _SharedStream, fn: Callable[[], AsyncIterator[Any]]):
+        try:
+            async for item in fn():
+                shared.items.append(item)
+                shared.notify()
+        except asyncio.CancelledError:
+            shared.error = RuntimeError("Поток источника отменён")
+            raise
+        except Exception as e:
+            shared.error = e
+        finally:
+            shared.done = True
+            shared.notify()
+            if self._inflight.get(key) is shared:
+                del self._inflight[key]
+            if shared.error is None:
+                self._recent.put(key, shared)
+
+    async def stream(self, key: Hashable, fn: Callable[[], AsyncIterator[Any]]) -> AsyncIterator[Any]:
+        recent = self._recent.get(key)
+        if recent is not None:
+            self.reused += 1
+            shared = recent[0]
+        elif key in self._inflight:
+            self.shared += 1
+            shared = self._inflight[key]
+        else:
+            self.calls += 1
+            shared = _SharedStream()
+            self._inflight[key] = shared
+            task = asyncio.ensure_future(self._pump(key, shared, fn))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        async for item in shared.iterate():
+            yield item
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "calls": self.calls,
+            "shared": self.shared,
+            "reused": self.reused,
+            "inflight": len(self._inflight),
+            "recent": len(self._recent),
+        }
@@ -0,0 +1,362 @@
+import asyncio
+import json
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import asyncpg
+import numpy as np
+
+from services.db import DB_DSN, get_db_pool
+from services.scoring import normalize_rows, top_k, top_k_batch
+from services.embedding_migration import is_tenant_converted, reset_cache
+from core.logger import logger
+from config import settings
+
+# Канал PostgreSQL, в который пишутся изменения таблицы documents.
+# Payload: {"client_id": ..., "origin": ...}
+DOCUMENTS_CHANNEL = "documents_changed"
+
+# Идентификатор процесса: свои же уведомления не сбрасывают локальный индекс,
+# он к этому моменту уже обновлён инкрементально.
+PROCESS_ID = uuid.uuid4().hex
+
+
+def decode_embedding(value) -> Optional[np.ndarray]:
+    """Приводит эмбеддинг из БД (vector / jsonb-строка / list) к float32."""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = json.loads(value)
+    return np.asarray(value, dtype=np.float32)
+
+
+def decode_metadata(value) -> Dict[str, Any]:
+    """Метаданные могут прийти строкой (jsonb без кодека) или словарём."""
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            return {}
+    return value if isinstance(value, dict) else {}
+
+
+@dataclass
+class TenantIndex:
+    """
+    Документы одного клиента: непрерывная матрица эмбеддингов + id и метаданные.
+    Строки матрицы нормализованы при добавлении, поиск — один matvec.
+    """
+    client_id: str
+    ids: np.ndarray        # int64, (n,)
+    matrix: np.ndarray     # float32, (n, dim), C-contiguous, строки единичной длины
+    contents: List[str]
+    metadata: List[Dict[str, Any]]
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def nbytes(self) -> int:
+        # Строки считаем приблизительно: по 2 байта на символ
+        return int(self.matrix.nbytes + self.ids.nbytes + 2 * sum(len(c) for c in self.contents))
+
+    @classmethod
+    def empty(cls, client_id: str) -> "TenantIndex":
+        return cls(
+            client_id=client_id,
+            ids=np.empty(0, dtype=np.int64),
+            matrix=np.empty((0, 0), dtype=np.float32),
+            contents=[],
+            metadata=[],
+        )
+
+    @classmethod
+    def from_rows(cls, client_id: str, rows: Iterable) -> "TenantIndex":
+        """Строит индекс из строк `id, content, metadata, embedding`."""
+        ids, vectors, contents, metadata = [], [], [], []
+        for row in rows:
+            try:
+                emb = decode_embedding(row["embedding"])
+                if emb is None or emb.size == 0:
+                    continue
+                ids.append(row["id"])
+                vectors.append(emb)
+                contents.append(row["content"])
+                metadata.append(decode_metadata(row["metadata"]))
+            except Exception as e:
+                logger.warning(f"Ошибка обработки документа {row['id']}: {e}")
+        if not ids:
+            return cls.empty(client_id)
+        return cls(
+            client_id=client_id,
+            ids=np.asarray(ids, dtype=np.int64),
+            matrix=normalize_rows(np.vstack(vectors)),
+            contents=contents,
+            metadata=metadata,
+        )
+
+    def _results(self, winners: np.ndarray, scores: np.ndarray) -> List[Dict[str, Any]]:
+        return [
+            {
+                "id": int(self.ids[i]),
+                "content": self.contents[i],
+                "metadata": self.metadata[i],
+                "score": float(score),
+            }
+            for i, score in zip(winners, scores)
+        ]
+
+    def search(self, query, k: int = 5, threshold: float = 0.1) -> List[Dict[str, Any]]:
+        """top_k документов по косинусной близости; метаданные собираются только для победителей."""
+        if not len(self):
+            return []
+        return self._results(*top_k(self.matrix, query, k, threshold))
+
+    def search_batch(self, queries, k: int = 5, threshold: float = 0.1) -> List[List[Dict[str, Any]]]:
+        """Поиск сразу для матрицы запросов одним BLAS-вызовом."""
+        if not len(self):
+            return [[] for _ in range(len(queries))]
+        return [self._results(w, s) for w, s in top_k_batch(self.matrix, queries, k, threshold)]
+
+    def upsert(self, other: "TenantIndex") -> "TenantIndex":
+        """Новый индекс, где строки `other` заменяют/дополняют текущие."""
+        if not len(other):
+            return self
+        if len(self) and self.matrix.shape[1] != other.matrix.shape[1]:
+            raise ValueError(
+                f"Размерность эмбеддингов не совпадает: {self.matrix.shape[1]} != {other.matrix.shape[1]}"
+            )
+        kept = self.without(other.ids.tolist())
+        if not len(kept):
+            return other
+        return TenantIndex(
+            client_id=self.client_id,
+            ids=np.concatenate([kept.ids, other.ids]),
+            matrix=np.ascontiguousarray(np.vstack([kept.matrix, other.matrix])),
+            contents=kept.contents + other.contents,
+            metadata=kept.metadata + other.metadata,
+        )
+
+    def with_metadata(self, updates: Dict[int, Dict[str, Any]]) -> "TenantIndex":
+        metadata = [updates.get(int(doc_id), m) for doc_id, m in zip(self.ids, self.metadata)]
+        return TenantIndex(self.client_id, self.ids, self.matrix, self.contents, metadata)
+
+    def without(self, ids: Iterable[int]) -> "TenantIndex":
+        mask = ~np.isin(self.ids, np.fromiter(ids, dtype=np.int64))
+        return self._select(mask)
+
+    def without_filename(self, filename: str) -> "TenantIndex":
+        mask = np.fromiter(
+            (m.get("filename") != filename for m in self.metadata), dtype=bool, count=len(self)
+        )
+        return self._select(mask)
+
+    def _select(self, mask: np.ndarray) -> "TenantIndex":
+        if mask.all():
+            return self
+        keep = np.flatnonzero(mask)
+        return TenantIndex(
+            client_id=self.client_id,
+            ids=self.ids[keep],
+            matrix=np.ascontiguousarray(self.matrix[keep]) if len(keep) else np.empty((0, 0), dtype=np.float32),
+            contents=[self.contents[i] for i in keep],
+            metadata=[self.metadata[i] for i in keep],
+        )
+
+
+class VectorIndexManager:
+    """
+    Процессный кэш индексов по client_id с LRU-вытеснением по бюджету памяти.
+    Индексы неизменяемы: любое изменение подменяет объект целиком, поэтому
+    читатели, получившие индекс, никогда не видят его в полусобранном виде.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._indexes: "OrderedDict[str, TenantIndex]" = OrderedDict()
+        self._locks: Dict[str, asyncio.Lock] = {}
+        # Счётчик версий: если во время загрузки пришла инвалидация,
+        # загруженный снимок устарел и в кэш не кладётся.
+        self._versions: Dict[str, int] = {}
+        # Растёт при clear(): сбрасывает версии и незагруженных клиентов
+        self._generation = 0
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    async def get(self, client_id: str) -> TenantIndex:
+        index = self._indexes.get(client_id)
+        if index is not None:
+            self._indexes.move_to_end(client_id)
+            self.hits += 1
+            return index
+
+        lock = self._locks.setdefault(client_id, asyncio.Lock())
+        async with lock:
+            index = self._indexes.get(client_id)
+            if index is not None:
+                self.hits += 1
+                return index
+            self.misses += 1
+            # Сравниваем и поколение: clear() не трогает версии незагруженных клиентов
+            version = self.version(client_id)
+            index = await self._load(client_id)
+            if self.version(client_id) == version:
+                self._put(index)
+            return index
+
+    async def _load(self, client_id: str) -> TenantIndex:
+        converted = await is_tenant_converted(client_id)
+        pool = get_db_pool()
+        async with pool.acquire() as conn:
+            if converted:
+                # Бинарный vector: без разбора jsonb-массивов по одному числу
+                rows = await conn.fetch("""
+                    SELECT id, content, metadata, embedding_vec AS embedding
+                    FROM documents
+                    WHERE client_id = $1 AND embedding_vec IS NOT NULL
+                """, client_id)
+            else:
+                rows = await conn.fetch("""
+                    SELECT id, content, metadata, embedding
+                    FROM documents
+                    WHERE client_id = $1 AND embedding IS NOT NULL
+                """, client_id)
+        index = TenantIndex.from_rows(client_id, rows)
+        logger.info(f"📥 Индекс клиента {client_id} загружен: {len(index)} чанков, {index.nbytes / 1e6:.1f} MB")
+        return index
+
+    def _put(self, index: TenantIndex):
+        old = self._indexes.pop(index.client_id, None)
+        if old is not None:
+            self._bytes -= old.nbytes
+        self._indexes[index.client_id] = index
+        self._bytes += index.nbytes
+        self._evict()
+
+    def _evict(self):
+        # Последний (самый свежий) индекс не вытесняем, даже если он один больше бюджета
+        while self._bytes > self.max_bytes and len(self._indexes) > 1:
+            client_id, index = self._indexes.popitem(last=False)
+            self._bytes -= index.nbytes
+            self.evictions += 1
+            logger.info(f"♻️ Индекс клиента {client_id} вытеснен из памяти ({index.nbytes / 1e6:.1f} MB)")
+
+    def _replace(self, client_id: str, fn):
+        self._versions[client_id] = self._versions.get(client_id, 0) + 1
+        index = self._indexes.get(client_id)
+        if index is None:
+            # Индекс не загружен — следующая загрузка прочитает свежие данные из БД
+            return
+        self._put(fn(index))
+
+    def upsert(self, client_id: str, rows: Iterable):
+        """Инкрементально добавляет/заменяет строки `id, content, metadata, embedding`."""
+        fresh = TenantIndex.from_rows(client_id, rows)
+        self._replace(client_id, lambda index: index.upsert(fresh))
+
+    def remove(self, client_id: str, ids: Iterable[int]):
+        ids = list(ids)
+        self._replace(client_id, lambda index: index.without(ids))
+
+    def update_metadata(self, client_id: str, updates: Dict[int, Dict[str, Any]]):
+        self._replace(client_id, lambda index: index.with_metadata(updates))
+
+    def remove_filename(self, client_id: str, filename: str):
+        self._replace(client_id, lambda index: index.without_filename(filename))
+
+    def invalidate(self, client_id: str):
+        self._versions[client_id] = self._versions.get(client_id, 0) + 1
+        index = self._indexes.pop(client_id, None)
+        if index is not None:
+            self._bytes -= index.nbytes
+            logger.info(f"🧹 Индекс клиента {client_id} сброшен")
+
+    def clear(self):
+        self._generation += 1
+        for client_id in list(self._indexes):
+            self.invalidate(client_id)
+
+    def version(self, client_id: str) -> Tuple[int, int]:
+        """Меняется при любом изменении документов клиента (своём или по уведомлению)."""
+        return self._generation, self._versions.get(client_id, 0)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "tenants": len(self._indexes),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+vector_index = VectorIndexManager(max_bytes=settings.vector_index_max_mb * 1024 * 1024)
+
+
+# ---------- Межпроцессная инвалидация (LISTEN/NOTIFY) ----------
+async def notify_documents_changed(conn, client_id: str):
+    """Сообщает другим процессам (API, админка), что документы клиента изменились."""
+    payload = json.dumps({"client_id": str(client_id), "origin": PROCESS_ID})
+    await conn.execute("SELECT pg_notify($1, $2)", DOCUMENTS_CHANNEL, payload)
+
+
+def _on_documents_changed(conn, pid, channel, payload):
+    try:
+        data = json.loads(payload)
+    except ValueError:
+        logger.warning(f"Некорректное уведомление {channel}: {payload}")
+        return
+    if data.get("origin") == PROCESS_ID:
+        return
+    reset_cache()
+    client_id = data.get("client_id")
+    if client_id:
+        vector_index.invalidate(client_id)
+    else:
+        vector_index.clear()
+
+
+_listener_task: Optional[asyncio.Task] = None
+
+
+async def _listen_loop():
+    while True:
+        conn = None
+        try:
+            conn = await asyncpg.connect(DB_DSN)
+            await conn.add_listener(DOCUMENTS_CHANNEL, _on_documents_changed)
+            logger.info(f"👂 Подписка на {DOCUMENTS_CHANNEL} активна")
+            while not conn.is_closed():
+                await asyncio.sleep(5)
+            logger.warning(f"Соединение LISTEN {DOCUMENTS_CHANNEL} потеряно")
+        except asyncio.CancelledError:
+            if conn is not None and not conn.is_closed():
+                await conn.close()
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка подписки на {DOCUMENTS_CHANNEL}: {e}")
+        # Пока подписки не было, уведомления могли потеряться
+        vector_index.clear()
+        await asyncio.sleep(5)
+
+
+def start_index_listener():
+    global _listener_task
+    if _listener_task is None:
+        _listener_task = asyncio.create_task(_listen_loop())
+
+
+async def stop_index_listener():
+    global _listener_task
+    if _listener_task is not None:
+        _listener_task.cancel()
+        try:
+            await _listener_task
+        except asyncio.CancelledError:
+            pass
+        _listener_task = None
@@ -1,6 +1,7 @@
 import os
 import re
 import json
+import time
 import httpx
 from dotenv import load_dotenv
 from datetime import datetime, timedelta, timezone
@@ -40,6 +41,10 @@ from services.lead_utils import build_lead_summary   # если где-то ещ
 load_dotenv()
 
 API_URL = os.getenv("API_URL", "http://127.0.0.1:8000/chat/")
+STREAM_URL = os.getenv("API_STREAM_URL", API_URL.rstrip("/") + "/stream")
+# Telegram ограничивает частоту редактирования сообщений — не чаще раза в секунду
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.0"))
+STREAM_PLACEHOLDER = "…"
 
 
 PHONE_REGEX = re.compile(r"(\+?\d[\d\s\-\(\)]{9,}\d)")
@@ -82,20 +87,6 @@ REQUIRED_FIELDS = [
     "decision_timeline",
 ]
 
-JSON_RE = re.compile(r"<LEAD_JSON>\s*(\{.*?\})\s*</LEAD_JSON>", re.S)
-
-
-def extract_patch(text: str) -> dict:
-    m = JSON_RE.search(text or "")
-    if not m:
-        return {}
-    try:
-        obj = json.loads(m.group(1))
-        return obj if isinstance(obj, dict) else {}
-    except Exception:
-        return {}
-
-
 def apply_patch(collected: dict, patch: dict):
     """Только непустые значения."""
     if not isinstance(patch, dict):
@@ -245,16 +236,17 @@ async def load_session(user_id: int, client_id: str):
 # CONVERSATION ENGINE (LLM)
 # ======================================================
 
-def build_system_prompt(history: str, collected: dict) -> str:
-    today_str = datetime.now(MSK).strftime("%d.%m.%Y")
-    miss = missing_required(collected)
-    miss_str = ", ".join(miss) if miss else "нет"
-
+def build_system_prompt() -> str:
+    """
+    Неизменные инструкции квалификации лида. Всё, что меняется от хода к ходу
+    (дата, недостающие поля, история), — в build_dialog_state: так этот текст
+    остаётся общим префиксом запросов и попадает в кэш контекста DeepSeek.
+    """
     return f"""
-Сегодняшняя дата: {today_str}
+Сегодняшняя дата указана в блоке «Текущее состояние диалога».
 
 Если пользователь говорит:
-- "сегодня" — это {today_str}
+- "сегодня" — это сегодняшняя дата
 - "завтра" — это дата +1 день
 - "послезавтра" — это дата +2 дня
 
@@ -274,7 +266,7 @@ def build_system_prompt(history: str, collected: dict) -> str:
 ВАЖНО: лид отправляется менеджеру ТОЛЬКО когда собраны поля:
 {REQUIRED_FIELDS}
 
-СЕЙЧАС НЕ ХВАТАЕТ: {miss_str}
+Каких полей сейчас не хватает — см. «Текущее состояние диалога».
 
     Правила:
     - Пиши как живой менеджер.
@@ -380,6 +372,29 @@ def build_system_prompt(history: str, collected: dict) -> str:
 
 - phone
 - preferred_date (обязательно в формате ДД.ММ.ГГГГ ЧЧ:ММ)
+"""
+
+
+def build_dialog_state(history: str, collected: dict, after_handoff: bool = False) -> str:
+    """Изменчивая часть промпта: идёт после документов, в конце запроса."""
+    today_str = datetime.now(MSK).strftime("%d.%m.%Y")
+    if after_handoff:
+        # Даты и время для переноса заявки — здесь, а не в build_after_handoff_prompt,
+        # чтобы его текст не менялся от дня к дню и от заявки к заявке
+        example_date = (datetime.now(MSK) + timedelta(days=2)).strftime("%d.%m.%Y")
+        current_time = collected.get('preferred_date', '')
+        if current_time and ' ' in current_time:
+            current_time = current_time.split(' ')[1]  # берём только время
+        else:
+            current_time = '14:00'  # запасной вариант
+        status = f"Послезавтра: {example_date}\nВремя в заявке: {current_time}"
+    else:
+        miss = missing_required(collected)
+        status = f"СЕЙЧАС НЕ ХВАТАЕТ: {', '.join(miss) if miss else 'нет'}"
+    return f"""
+Текущее состояние диалога:
+Сегодняшняя дата: {today_str}
+{status}
 
 История:
 {history}
@@ -388,43 +403,91 @@ def build_system_prompt(history: str, collected: dict) -> str:
 {json.dumps(collected, ensure_ascii=False)}
 """
 
-def build_after_handoff_prompt(history: str, collected: dict) -> str:
-    today_str = datetime.now(MSK).strftime("%d.%m.%Y")
-    example_date = (datetime.now(MSK) + timedelta(days=2)).strftime("%d.%m.%Y")
-    # Извлекаем текущее время из заявки (если есть)
-    current_time = collected.get('preferred_date', '')
-    if current_time and ' ' in current_time:
-        current_time = current_time.split(' ')[1]  # берём только время
-    else:
-        current_time = '14:00'  # запасной вариант
+def build_after_handoff_prompt() -> str:
+    """
+    Неизменные инструкции после передачи лида; сегодняшняя дата, «послезавтра»
+    и время из заявки — в build_dialog_state(after_handoff=True).
+    """
     return f"""
 Ты — AI-ассистент компании.
 
-Клиент уже оставил заявку. Лид передан менеджеру. Сегодняшняя дата: {today_str}
+Клиент уже оставил заявку. Лид передан менеджеру. Сегодняшняя дата, дата «послезавтра» и время из заявки указаны в блоке «Текущее состояние диалога».
 
 Твоя задача: отвечать на вопросы клиента. Если клиент просто сообщает информацию (даёт номер телефона, время, дату) без слов-маркеров, НЕ изменяй поля в JSON и НЕ подтверждай изменение.
 
 Изменять телефон (phone) и дату/время (preferred_date) можно ТОЛЬКО если клиент явно просит об этом, используя слова-маркеры: «перенеси», «измени», «поменяй», «новое время», «другая дата», «хочу на», «сделай на», «давай на», «перенос», «замени», «смени», «послезавтра», «завтра» и т.п. Если таких слов нет, НЕ изменяй эти поля.
 
 **ВАЖНО: В КАЖДОМ ответе ты ОБЯЗАН вернуть блок <LEAD_JSON>...</LEAD_JSON>, даже если он пустой.**
-- Если клиент просит перенести дату (например, «на послезавтра»), но не указывает новое время, ты должен использовать текущее время из заявки (поле preferred_date). Возьми из него время (например, {current_time}) и поставь его в новую дату.
-- Сегодня {today_str}, значит послезавтра будет {example_date}. Ты обязан использовать именно эту дату {example_date} для «послезавтра». Никакой другой даты.
+- Если клиент просит перенести дату (например, «на послезавтра»), но не указывает новое время, ты должен использовать текущее время из заявки (поле preferred_date). Возьми из него время («Время в заявке» в блоке «Текущее состояние диалога») и поставь его в новую дату.
+- Для «послезавтра» ты обязан использовать именно дату «Послезавтра» из блока «Текущее состояние диалога». Никакой другой даты.
 - Если клиент просит изменить телефон, верни JSON с новым номером.
 - Если изменений нет, верни пустой JSON: <LEAD_JSON>{{}}</LEAD_JSON>.
 
 Примеры правильного поведения (обрати внимание – в JSON нет двоеточий, используется дефис):
 - Клиент: «мой номер 89995191777» → твой ответ: «Понял, записал» <LEAD_JSON>{{}}</LEAD_JSON>
-- Клиент: «перенеси на послезавтра» → JSON: {{"preferred_date": "{example_date} {current_time}"}}, текст: «Хорошо, перенёс на послезавтра в {current_time}.»
+- Клиент: «перенеси на послезавтра» → JSON: {{"preferred_date": "<дата «Послезавтра»> <время в заявке>"}}, текст: «Хорошо, перенёс на послезавтра в <время в заявке>.»
 - Клиент: «12-00» → не менять время, ответ: «Хорошо» <LEAD_JSON>{{}}</LEAD_JSON>
 
 Запрещено задавать любые вопросы. Отвечай кратко, по делу.
+"""
 
-Текущие данные:
-{json.dumps(collected, ensure_ascii=False)}
+# ======================================================
+# STREAMING REPLY
+# ======================================================
+
+async def show_text(message, text: str) -> bool:
+    """Редактирует сообщение-заглушку; ошибки Telegram (в т.ч. «not modified») не фатальны."""
+    try:
+        await message.edit_text(text[:4096])
+        return True
+    except Exception as e:
+        logger.warning(f"Не удалось обновить сообщение: {e}")
+        return False
+
+
+async def finish_placeholder(update: Update, placeholder, text: str | None):
+    """Финальный вид заглушки на любом выходе из обработчика."""
+    if text is None:
+        try:
+            await placeholder.delete()
+        except Exception as e:
+            logger.warning(f"Не удалось удалить заглушку: {e}")
+        return
+    if not await show_text(placeholder, text):
+        try:
+            await update.message.reply_text(text)
+        except Exception as e:
+            logger.error(f"Ошибка отправки сообщения пользователю: {e}")
+
+
+async def stream_reply(payload: dict, placeholder) -> tuple[str, dict]:
+    """
+    Читает NDJSON из /chat/stream и по мере генерации редактирует заглушку,
+    не чаще STREAM_EDIT_INTERVAL. Возвращает итоговый ответ (без <LEAD_JSON>) и patch.
+    """
+    parts = []
+    shown = STREAM_PLACEHOLDER
+    last_edit = 0.0
+    async with httpx.AsyncClient(timeout=httpx.Timeout(60.0, connect=5.0)) as client:
+        async with client.stream("POST", STREAM_URL, json=payload) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line.strip():
+                    continue
+                event = json.loads(line)
+                if event.get("type") == "delta":
+                    parts.append(event.get("text", ""))
+                    text_now = "".join(parts).strip()
+                    if text_now and text_now != shown and time.monotonic() - last_edit >= STREAM_EDIT_INTERVAL:
+                        if await show_text(placeholder, text_now):
+                            shown = text_now
+                        last_edit = time.monotonic()
+                elif event.get("type") == "done":
+                    return (event.get("reply") or "").strip(), event.get("patch") or {}
+                elif event.get("type") == "error":
+                    raise RuntimeError(event.get("detail"))
+    raise RuntimeError("Поток ответа оборвался без события done")
 
-История:
-{history}
-"""
 
 # ======================================================
 # MAIN HANDLER
@@ -530,141 +593,142 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
 
         if session.get("lead_saved"):
-            system_prompt = build_after_handoff_prompt(history_str, session["collected"])
+            system_prompt = build_after_handoff_prompt()
         else:
-            system_prompt = build_system_prompt(history_str, session["collected"])
+            system_prompt = build_system_prompt()
+        dialog_state = build_dialog_state(history_str, session["collected"], bool(session.get("lead_saved")))
         logger.info(f"Используется промпт: {'after_handoff' if session.get('lead_saved') else 'system'}")
 
+        # Заглушка сразу: пользователь видит ответ с первого токена, а не после всей генерации
+        placeholder = await update.message.reply_text(STREAM_PLACEHOLDER)
+
+        # Текст, которым заменяется заглушка; None — удалить её (передача лида, сбой)
+        final_text = None
         try:
-            async with httpx.AsyncClient(timeout=20.0) as client:
-                response = await client.post(
-                    API_URL,
-                    json={
+            try:
+                reply, patch = await stream_reply(
+                    {
                         "user_id": str(CLIENT_ID),
                         "message": text,
                         "system_extra": system_prompt,
+                        "system_dynamic": dialog_state,
                         "use_rag": True,
                         "context_info": json.dumps(
                             {"client_id": str(CLIENT_ID), "source": "telegram"},
                             ensure_ascii=False,
                         ),
                     },
+                    placeholder,
                 )
-
-            data = response.json()
-            reply = (data.get("reply") or "").strip()
-
-            patch = extract_patch(reply)
-            reply = JSON_RE.sub("", reply).strip()
-            if patch:
-                if session.get("lead_saved"):
-                    # Список слов, указывающих на намерение изменить дату/телефон
-                    change_keywords = [
-                        "перенес", "измен", "помен", "новое время", "другая дата",
-                        "хочу на", "сделай на", "давай на", "перенос", "замени", "смени",
-                        "послезавтра", "завтра", "на послезавтра", "на завтра"
-                    ]
-                    has_change_intent = any(kw in text.lower() for kw in change_keywords)
-                    if has_change_intent:
-                        # Если есть явная просьба – разрешаем обновлять только phone/preferred_date
-                        allowed_fields = ["phone", "preferred_date"]
-                        filtered_patch = {k: v for k, v in patch.items() if k in allowed_fields}
-                        logger.info(f"📦 Явное изменение: применяем {filtered_patch}")
+                if patch:
+                    if session.get("lead_saved"):
+                        # Список слов, указывающих на намерение изменить дату/телефон
+                        change_keywords = [
+                            "перенес", "измен", "помен", "новое время", "другая дата",
+                            "хочу на", "сделай на", "давай на", "перенос", "замени", "смени",
+                            "послезавтра", "завтра", "на послезавтра", "на завтра"
+                        ]
+                        has_change_intent = any(kw in text.lower() for kw in change_keywords)
+                        if has_change_intent:
+                            # Если есть явная просьба – разрешаем обновлять только phone/preferred_date
+                            allowed_fields = ["phone", "preferred_date"]
+                            filtered_patch = {k: v for k, v in patch.items() if k in allowed_fields}
+                            logger.info(f"📦 Явное изменение: применяем {filtered_patch}")
+                        else:
+                            # Нет намерения – игнорируем любые обновления даты/телефона
+                            filtered_patch = {k: v for k, v in patch.items() if k not in ["phone", "preferred_date"]}
+                            logger.info(f"📦 Нет явного изменения: применяем {filtered_patch} (дата/телефон проигнорированы)")
+                        apply_patch(session["collected"], filtered_patch)
                     else:
-                        # Нет намерения – игнорируем любые обновления даты/телефона
-                        filtered_patch = {k: v for k, v in patch.items() if k not in ["phone", "preferred_date"]}
-                        logger.info(f"📦 Нет явного изменения: применяем {filtered_patch} (дата/телефон проигнорированы)")
-                    apply_patch(session["collected"], filtered_patch)
-                else:
-                    apply_patch(session["collected"], patch)
-                    logger.info(f"После патча: phone={session['collected'].get('phone')}, date={session['collected'].get('preferred_date')}")
+                        apply_patch(session["collected"], patch)
+                        logger.info(f"После патча: phone={session['collected'].get('phone')}, date={session['collected'].get('preferred_date')}")
 
-        except Exception as e:
-            logger.error(f"LLM ERROR: {e}")
-            reply = "Произошёл сбой. Повторите запрос."
-
-        new_phone = session["collected"].get("phone")
-        new_date = session["collected"].get("preferred_date")
+            except Exception as e:
+                logger.error(f"LLM ERROR: {e}")
+                reply = "Произошёл сбой. Повторите запрос."
 
-        phone_changed = new_phone and new_phone != old_phone
-        date_changed = new_date and new_date != old_date
-        logger.info(f"Проверка изменений: new_phone={new_phone}, old_phone={old_phone}, new_date={new_date}, old_date={old_date}")
+            new_phone = session["collected"].get("phone")
+            new_date = session["collected"].get("preferred_date")
 
-        if session.get("lead_saved") and crm:
-            try:
-                if phone_changed and session.get("contact_id"):
-                    crm.update_contact_phone(session["contact_id"], new_phone)
-                    logger.info("✅ Phone updated in AmoCRM")
-                    await update.message.reply_text(f"✅ Телефон изменён на **{new_phone}**.")
-
-                if date_changed and session.get("lead_id"):
-                    crm.update_lead_field(session["lead_id"], "meeting_time", new_date)
-                    logger.info("✅ Meeting time updated in AmoCRM")
-                    await update.message.reply_text(f"✅ Дата созвона изменена на **{new_date}**.")
-            except Exception as e:
-                logger.error("AmoCRM update error")
-                logger.exception(e)
+            phone_changed = new_phone and new_phone != old_phone
+            date_changed = new_date and new_date != old_date
+            logger.info(f"Проверка изменений: new_phone={new_phone}, old_phone={old_phone}, new_date={new_date}, old_date={old_date}")
 
-            if phone_changed or date_changed:
-                # ✅ Сохраняем сессию после успешного обновления
+            if session.get("lead_saved") and crm:
                 try:
-                    await save_session(user_id, CLIENT_ID, session)
-                    logger.info("Сессия сохранена после обновления даты/телефона")
+                    if phone_changed and session.get("contact_id"):
+                        crm.update_contact_phone(session["contact_id"], new_phone)
+                        logger.info("✅ Phone updated in AmoCRM")
+                        await update.message.reply_text(f"✅ Телефон изменён на **{new_phone}**.")
+
+                    if date_changed and session.get("lead_id"):
+                        crm.update_lead_field(session["lead_id"], "meeting_time", new_date)
+                        logger.info("✅ Meeting time updated in AmoCRM")
+                        await update.message.reply_text(f"✅ Дата созвона изменена на **{new_date}**.")
                 except Exception as e:
-                    logger.error(f"Ошибка сохранения сессии после обновления: {e}")
-                    await send_notifications(context.bot, CLIENT_DATA, session["collected"], event_type="update")
+                    logger.error("AmoCRM update error")
+                    logger.exception(e)
+
+                if phone_changed or date_changed:
+                    # ✅ Сохраняем сессию после успешного обновления
+                    try:
+                        await save_session(user_id, CLIENT_ID, session)
+                        logger.info("Сессия сохранена после обновления даты/телефона")
+                    except Exception as e:
+                        logger.error(f"Ошибка сохранения сессии после обновления: {e}")
+                        await send_notifications(context.bot, CLIENT_DATA, session["collected"], event_type="update")
 
                 
 
-        print("COLLECTED:", session["collected"])
-        print("MISSING:", missing_required(session["collected"]))
+            print("COLLECTED:", session["collected"])
+            print("MISSING:", missing_required(session["collected"]))
 
-        if (not session["lead_saved"]) and is_ready_for_handoff(session["collected"]):
-            logger.info(">>> HANDOFF: начало передачи лида")
+            if (not session["lead_saved"]) and is_ready_for_handoff(session["collected"]):
+                logger.info(">>> HANDOFF: начало передачи лида")
 
-            try:
-                await save_lead(
-                    telegram_user_id=user_id,
-                    phone=session["collected"].get("phone"),
-                    name=session["collected"].get("name"),
-                    company=session["collected"].get("company"),
-                    industry=session["collected"].get("industry"),
-                    pain=session["collected"].get("problem"),
-                    goal=session["collected"].get("goal"),
-                    preferred_date=session["collected"].get("preferred_date"),
-                    extra_data={**session["collected"], "source": "telegram"},
-                    client_id=CLIENT_ID,  # Добавлен обязательный параметр
-                )
-                logger.info(">>> HANDOFF: лид сохранён в БД")
-            except Exception as e:
-                logger.error(f"HANDOFF: save_lead error: {e}")
-
-                        # ==== ОТПРАВКА ВО ВСЕ CRM ====
-            crm_results = await send_lead_to_all(CLIENT_DATA, session["collected"])
-            if crm_results:
-                logger.info(f"Результаты отправки в CRM: {crm_results}")
-                # Сохраняем идентификаторы amoCRM для возможных обновлений (если нужно)
-                amo_result = crm_results.get("amo")
-                if amo_result and amo_result.get("success"):
-                    ids = amo_result["ids"]
-                    session["contact_id"] = ids.get("contact_id")
-                    session["lead_id"] = ids.get("lead_id")
-            # =============================
-
-                        # ==== ОТПРАВКА УВЕДОМЛЕНИЙ ====
-            await send_notifications(context.bot, CLIENT_DATA, session["collected"], event_type="new")
-            # =============================
-            logger.info(">>> HANDOFF: менеджер уведомлён")
-
-            session["lead_saved"] = True
+                try:
+                    await save_lead(
+                        telegram_user_id=user_id,
+                        phone=session["collected"].get("phone"),
+                        name=session["collected"].get("name"),
+                        company=session["collected"].get("company"),
+                        industry=session["collected"].get("industry"),
+                        pain=session["collected"].get("problem"),
+                        goal=session["collected"].get("goal"),
+                        preferred_date=session["collected"].get("preferred_date"),
+                        extra_data={**session["collected"], "source": "telegram"},
+                        client_id=CLIENT_ID,  # Добавлен обязательный параметр
+                    )
+                    logger.info(">>> HANDOFF: лид сохранён в БД")
+                except Exception as e:
+                    logger.error(f"HANDOFF: save_lead error: {e}")
+
+                            # ==== ОТПРАВКА ВО ВСЕ CRM ====
+                crm_results = await send_lead_to_all(CLIENT_DATA, session["collected"])
+                if crm_results:
+                    logger.info(f"Результаты отправки в CRM: {crm_results}")
+                    # Сохраняем идентификаторы amoCRM для возможных обновлений (если нужно)
+                    amo_result = crm_results.get("amo")
+                    if amo_result and amo_result.get("success"):
+                        ids = amo_result["ids"]
+                        session["contact_id"] = ids.get("contact_id")
+                        session["lead_id"] = ids.get("lead_id")
+                # =============================
+
+                            # ==== ОТПРАВКА УВЕДОМЛЕНИЙ ====
+                await send_notifications(context.bot, CLIENT_DATA, session["collected"], event_type="new")
+                # =============================
+                logger.info(">>> HANDOFF: менеджер уведомлён")
+
+                session["lead_saved"] = True
 
-            try:
-                await save_session(user_id, CLIENT_ID, session)
-                logger.info(">>> HANDOFF: сессия сохранена")
-            except Exception as e:
-                logger.error(f"HANDOFF: не удалось сохранить сессию: {e}")
+                try:
+                    await save_session(user_id, CLIENT_ID, session)
+                    logger.info(">>> HANDOFF: сессия сохранена")
+                except Exception as e:
+                    logger.error(f"HANDOFF: не удалось сохранить сессию: {e}")
 
-            confirmation_text = f"""
+                confirmation_text = f"""
 Отлично, договорились.
 
 Консультация назначена на {session["collected"].get("preferred_date")}.
@@ -676,23 +740,22 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 До связи.
 """
-            try:
-                await update.message.reply_text(confirmation_text.strip())
-                logger.info(">>> HANDOFF: подтверждение отправлено пользователю")
-            except Exception as e:
-                logger.error(f"HANDOFF: ошибка отправки подтверждения: {e}", exc_info=True)
+                try:
+                    await update.message.reply_text(confirmation_text.strip())
+                    logger.info(">>> HANDOFF: подтверждение отправлено пользователю")
+                except Exception as e:
+                    logger.error(f"HANDOFF: ошибка отправки подтверждения: {e}", exc_info=True)
 
-            return
+                return
 
-        session["conversation"].append({"role": "assistant", "content": reply})
-        try:
-            await save_session(user_id, CLIENT_ID, session)
-        except Exception as e:
-            logger.error(f"Не удалось сохранить сессию после ответа: {e}")
-        try:
-            await update.message.reply_text(reply or "Можете уточнить?")
-        except Exception as e:
-            logger.error(f"Ошибка отправки сообщения пользователю: {e}")
+            session["conversation"].append({"role": "assistant", "content": reply})
+            try:
+                await save_session(user_id, CLIENT_ID, session)
+            except Exception as e:
+                logger.error(f"Не удалось сохранить сессию после ответа: {e}")
+            final_text = reply or "Можете уточнить?"
+        finally:
+            await finish_placeholder(update, placeholder, final_text)
 
     except Exception as e:
         logger.error(f"💥 CRITICAL ERROR in handle_message: {e}", exc_info=True)
@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+
+import services.deepseek as deepseek
+from services.answer_cache import AnswerCache
+from services.vector_index import VectorIndexManager
+
+
+def _vec(*values):
+    return np.asarray(values, dtype=np.float32)
+
+
+def test_semantic_hit_threshold_and_scope():
+    cache = AnswerCache(threshold=0.9, ttl=60, max_per_tenant=10)
+    cache.store("c1", "s", _vec(1, 0, 0), "Доставка 300 ₽", ["faq.txt"], version=1)
+
+    assert cache.lookup("c1", "s", _vec(0.95, 0.1, 0), version=1)[:2] == ("Доставка 300 ₽", ["faq.txt"])
+    assert cache.lookup("c1", "s", _vec(0, 1, 0), version=1) is None
+    assert cache.lookup("c1", "other", _vec(1, 0, 0), version=1) is None
+    assert cache.lookup("c2", "s", _vec(1, 0, 0), version=1) is None
+    assert cache.stats()["hits"] == 1
+
+
+def test_version_change_drops_tenant_and_cap_evicts_oldest():
+    cache = AnswerCache(threshold=0.99, ttl=60, max_per_tenant=2)
+    for i, vec in enumerate([_vec(1, 0, 0), _vec(0, 1, 0), _vec(0, 0, 1)]):
+        cache.store("c1", "s", vec, f"ответ {i}", [], version=1)
+    assert cache.lookup("c1", "s", _vec(1, 0, 0), version=1) is None
+    assert cache.lookup("c1", "s", _vec(0, 0, 1), version=1)[0] == "ответ 2"
+
+    assert cache.lookup("c1", "s", _vec(0, 0, 1), version=2) is None
+    assert cache.stats()["tenants"] == 0
+
+
+def test_index_version_changes_on_document_updates():
+    index = VectorIndexManager(max_bytes=1 << 20)
+    v0 = index.version("c1")
+    index.remove("c1", [1])
+    v1 = index.version("c1")
+    index.clear()
+    assert len({v0, v1, index.version("c1")}) == 3
+    assert index.version("c2") != v0
+
+
+@pytest.mark.asyncio
+async def test_paraphrase_served_from_cache(monkeypatch):
+    vectors = {"Сколько стоит доставка?": [1.0, 0.0], "Какая цена доставки?": [0.97, 0.05]}
+    calls = []
+
+    async def fake_embedding(text):
+        return vectors[text]
+
+    async def fake_ask(message, user_id, use_rag, system_extra):
+        calls.append(message)
+        return "300 ₽", ["prices.txt"]
+
+    monkeypatch.setattr(deepseek, "get_embedding", fake_embedding)
+    monkeypatch.setattr(deepseek, "ask_with_rag", fake_ask)
+    monkeypatch.setattr(deepseek, "answer_cache", AnswerCache(threshold=0.9, ttl=60, max_per_tenant=10))
+
+    first = await deepseek.ask_with_rag_cached("Сколько стоит доставка?", "c1")
+    second = await deepseek.ask_with_rag_cached("Какая цена доставки?", "c1")
+    assert first == ("300 ₽", ["prices.txt"], False)
+    assert second == ("300 ₽", ["prices.txt"], True)
+    assert calls == ["Сколько стоит доставка?"]
+
+    deepseek.vector_index.remove("c1", [42])
+    assert (await deepseek.ask_with_rag_cached("Какая цена доставки?", "c1"))[2] is False
+
+
+@pytest.mark.asyncio
+async def test_answer_without_sources_is_not_cached(monkeypatch):
+    async def fake_embedding(text):
+        return [1.0, 0.0]
+
+    async def fake_ask(message, user_id, use_rag, system_extra):
+        return "Не знаю", []
+
+    cache = AnswerCache(threshold=0.9, ttl=60, max_per_tenant=10)
+    monkeypatch.setattr(deepseek, "get_embedding", fake_embedding)
+    monkeypatch.setattr(deepseek, "ask_with_rag", fake_ask)
+    monkeypatch.setattr(deepseek, "answer_cache", cache)
+
+    await deepseek.ask_with_rag_cached("Сколько стоит доставка?", "c1")
+    assert (await deepseek.ask_with_rag_cached("Сколько стоит доставка?", "c1"))[2] is False
+    assert cache.stats()["stores"] == 0
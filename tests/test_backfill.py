@@ -0,0 +1,11 @@
+import re
+
+from services.embeddings import _values_update_sql
+
+
+def test_values_update_numbers_parameters_after_model():
+    sql = _values_update_sql(3)
+    numbers = sorted(int(n) for n in re.findall(r"\$(\d+)", sql))
+    # $1 — модель, затем по четыре параметра на строку без пропусков
+    assert numbers == [1] + list(range(2, 14))
+    assert sql.count("::vector") == 3
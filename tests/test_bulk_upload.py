@@ -0,0 +1,57 @@
+import io
+import zipfile
+
+from config import settings
+from services.bulk_upload import expand_uploads, is_supported, zip_member_name
+
+
+def make_zip(members):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+    buffer.seek(0)
+    return buffer
+
+
+def test_expands_zip_and_skips_unsupported():
+    archive = make_zip({
+        "docs/прайс.txt": "цены",
+        "docs/каталог.pdf": b"%PDF",
+        "docs/logo.png": b"",
+        "__MACOSX/docs/._прайс.txt": b"",
+    })
+    items = list(expand_uploads([
+        ("kb.zip", "application/zip", archive),
+        ("faq.txt", "text/plain", io.BytesIO("вопросы".encode())),
+        ("notes.docx", None, io.BytesIO()),
+    ]))
+
+    ready = {i.filename: i for i in items if i.skipped is None}
+    skipped = {i.filename for i in items if i.skipped}
+    assert set(ready) == {"прайс.txt", "каталог.pdf", "faq.txt"}
+    assert skipped == {"logo.png", "notes.docx"}
+    assert ready["прайс.txt"].open().read() == "цены".encode()
+    assert ready["faq.txt"].open().read() == "вопросы".encode()
+
+
+def test_limits_number_of_files(monkeypatch):
+    monkeypatch.setattr(settings, "bulk_max_files", 2)
+    archive = make_zip({f"{i}.txt": "x" for i in range(4)})
+    items = list(expand_uploads([("kb.zip", None, archive)]))
+    assert [i.skipped is None for i in items] == [True, True, False, False]
+
+
+def test_cp866_member_names_are_decoded():
+    info = zipfile.ZipInfo("прайс.txt".encode("cp866").decode("cp437"))
+    assert zip_member_name(info) == "прайс.txt"
+
+
+def test_corrupted_zip_is_reported():
+    items = list(expand_uploads([("kb.zip", None, io.BytesIO(b"not a zip"))]))
+    assert len(items) == 1 and items[0].skipped
+
+
+def test_extension_check_is_case_insensitive():
+    assert is_supported("Прайс.PDF") and is_supported("notes.Txt")
+    assert not is_supported("price.docx") and not is_supported("")
@@ -0,0 +1,53 @@
+import pytest
+
+from services.chunk_writer import chunk_hash, load_existing_chunks
+
+MODEL = "yandex:text-search-doc"
+
+
+class FakeConn:
+    def __init__(self, rows):
+        self.rows = rows
+
+    async def fetch(self, query, *args):
+        return self.rows
+
+
+def row(doc_id, content, model=MODEL, has_embedding=True, hashed=True):
+    return {
+        "id": doc_id,
+        "content": content,
+        "content_hash": chunk_hash(content) if hashed else None,
+        "embedding_model": model,
+        "has_embedding": has_embedding,
+    }
+
+
+async def diff(conn, chunks):
+    existing = await load_existing_chunks(conn, "c1", "a.txt", MODEL)
+    reuse = {i: existing.match(chunk) for i, chunk in enumerate(chunks)}
+    return {i: doc_id for i, doc_id in reuse.items() if doc_id is not None}, existing.stale()
+
+
+@pytest.mark.asyncio
+async def test_diff_reuses_unchanged_and_deletes_vanished():
+    conn = FakeConn([row(1, "цены"), row(2, "старый абзац"), row(3, "контакты", hashed=False)])
+    reuse, stale = await diff(conn, ["цены", "новый абзац", "контакты"])
+    assert reuse == {0: 1, 2: 3}
+    assert stale == [2]
+
+
+@pytest.mark.asyncio
+async def test_diff_ignores_other_model_and_missing_embeddings():
+    conn = FakeConn([row(1, "цены", model="openai:small"), row(2, "контакты", has_embedding=False)])
+    reuse, stale = await diff(conn, ["цены", "контакты"])
+    assert reuse == {}
+    assert sorted(stale) == [1, 2]
+
+
+@pytest.mark.asyncio
+async def test_diff_handles_duplicate_chunks():
+    conn = FakeConn([row(1, "шапка"), row(2, "шапка"), row(3, "шапка")])
+    reuse, stale = await diff(conn, ["шапка", "шапка"])
+    assert reuse == {0: 1, 1: 2}
+    assert stale == [3]
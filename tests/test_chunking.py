@@ -0,0 +1,79 @@
+import random
+
+import pytest
+
+from services.chunking import StreamingChunker, chunk_text, iter_chunks
+
+SENTENCES = [
+    "Привет, мир.", "Это тест!", "Как дела?", "Hello world.",
+    "Т.е. пример из г. Москва.", "Новый абзац\n\nначинается здесь.",
+]
+
+
+def sample_text(n: int = 5000) -> str:
+    rnd = random.Random(42)
+    return " ".join(rnd.choice(SENTENCES) for _ in range(n))
+
+
+async def _pages(pages):
+    for page in pages:
+        yield page
+
+
+def test_chunks_respect_size_overlap_and_offsets():
+    text = sample_text()
+    chunks = chunk_text(text, chunk_size=500, overlap=100)
+
+    assert all(0 < len(c.text) <= 500 for c in chunks)
+    assert all(text[c.start:c.end] == c.text for c in chunks)
+    for prev, cur in zip(chunks, chunks[1:]):
+        assert cur.start > prev.start
+        assert prev.end - cur.start <= 100
+    assert chunks[-1].end == len(text.rstrip())
+
+
+def test_early_boundary_does_not_shrink_step():
+    text = sample_text()
+    chunks = chunk_text(text, chunk_size=500, overlap=100)
+    # Граница раньше конца окна урезает перекрытие, а не шаг
+    for prev, cur in zip(chunks, chunks[1:]):
+        assert cur.start >= min(prev.end, prev.start + 500 - 100)
+
+
+def test_prefers_sentence_boundaries_over_abbreviations():
+    text = sample_text()
+    chunks = chunk_text(text, chunk_size=300, overlap=0)
+    for c in chunks[:-1]:
+        paragraph_end = text[c.end:c.end + 2] == "\n\n"
+        assert c.text[-1] in ".!?" or paragraph_end, c.text[-30:]
+        assert not c.text.endswith(("Т.е.", "г."))
+
+
+def test_streaming_matches_whole_text():
+    text = sample_text()
+    chunker = StreamingChunker(chunk_size=400, overlap=80)
+    streamed = []
+    for i in range(0, len(text), 37):
+        streamed.extend(chunker.feed(text[i:i + 37]))
+    streamed.extend(chunker.finish())
+
+    assert streamed == chunk_text(text, chunk_size=400, overlap=80)
+
+
+def test_long_word_is_cut_hard_without_overlap():
+    # Перекрытие не начинается с середины слова, поэтому при жёстком разрезе его нет
+    chunks = chunk_text("а" * 2500, chunk_size=1000, overlap=200)
+    assert [len(c.text) for c in chunks] == [1000, 1000, 500]
+
+
+def test_overlap_must_be_smaller_than_chunk():
+    with pytest.raises(ValueError):
+        StreamingChunker(chunk_size=100, overlap=100)
+
+
+@pytest.mark.asyncio
+async def test_iter_chunks_offsets_in_joined_pages():
+    pages = [sample_text(100), sample_text(150), sample_text(50)]
+    chunks = [c async for c in iter_chunks(_pages(pages), chunk_size=500, overlap=100, separator="\n")]
+    joined = "\n".join(pages)
+    assert all(joined[c.start:c.end] == c.text for c in chunks)
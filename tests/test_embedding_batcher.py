@@ -0,0 +1,63 @@
+import asyncio
+
+import pytest
+
+from services.embedding_batcher import EmbeddingBatcher
+
+
+@pytest.mark.asyncio
+async def test_identical_texts_share_one_call():
+    calls = []
+
+    async def fetch_one(text):
+        calls.append(text)
+        await asyncio.sleep(0.01)
+        return [float(len(text))]
+
+    batcher = EmbeddingBatcher(fetch_one, window=0.001)
+    results = await asyncio.gather(*(batcher.embed("тарифы") for _ in range(10)), batcher.embed("цены"))
+    assert results[0] == [6.0] and results[-1] == [4.0]
+    assert sorted(calls) == ["тарифы", "цены"]
+    assert batcher.stats()["deduplicated"] == 9
+
+
+@pytest.mark.asyncio
+async def test_batch_hook_receives_coalesced_texts():
+    batches = []
+
+    async def fetch_batch(texts):
+        batches.append(list(texts))
+        return [[float(i)] for i, _ in enumerate(texts)]
+
+    batcher = EmbeddingBatcher(fetch_one=None, fetch_batch=fetch_batch, window=0.01, max_batch=3)
+    results = await asyncio.gather(*(batcher.embed(t) for t in ["a", "b", "c", "d"]))
+    assert [len(b) for b in batches] == [3, 1]
+    assert results == [[0.0], [1.0], [2.0], [0.0]]
+
+
+@pytest.mark.asyncio
+async def test_errors_propagate_to_all_waiters():
+    async def fetch_one(text):
+        raise RuntimeError("upstream down")
+
+    batcher = EmbeddingBatcher(fetch_one, window=0.001)
+    results = await asyncio.gather(batcher.embed("x"), batcher.embed("x"), return_exceptions=True)
+    assert all(isinstance(r, RuntimeError) for r in results)
+
+
+@pytest.mark.asyncio
+async def test_fanout_is_bounded():
+    active = 0
+    peak = 0
+
+    async def fetch_one(text):
+        nonlocal active, peak
+        active += 1
+        peak = max(peak, active)
+        await asyncio.sleep(0.01)
+        active -= 1
+        return [0.0]
+
+    batcher = EmbeddingBatcher(fetch_one, window=0.001, max_fanout=2)
+    await asyncio.gather(*(batcher.embed(str(i)) for i in range(8)))
+    assert peak == 2
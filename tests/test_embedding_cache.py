@@ -0,0 +1,64 @@
+import pytest
+
+import services.embeddings as embeddings
+from services.embedding_cache import _PRUNE_BATCH, EmbeddingCache
+
+
+@pytest.mark.asyncio
+async def test_memory_tier_lru_and_counters():
+    cache = EmbeddingCache(max_entries=2, ttl=60, persistent=False, max_rows=0)
+    await cache.put("m", "a", [1.0, 0.0])
+    await cache.put("m", "b", [0.0, 1.0])
+    assert await cache.get("m", "a") == [1.0, 0.0]
+    await cache.put("m", "c", [1.0, 1.0])  # вытесняет "b"
+    assert await cache.get("m", "b") is None
+    assert await cache.get("other-model", "a") is None
+    stats = cache.stats()
+    assert stats["memory_hits"] == 1
+    assert stats["misses"] == 2
+
+
+@pytest.mark.asyncio
+async def test_memory_tier_ttl():
+    cache = EmbeddingCache(max_entries=10, ttl=-1, persistent=False, max_rows=0)
+    await cache.put("m", "a", [1.0])
+    assert await cache.get("m", "a") is None
+
+
+@pytest.mark.asyncio
+async def test_get_embedding_uses_cache(monkeypatch):
+    calls = []
+
+    async def fake_fetch(text):
+        calls.append(text)
+        return [0.5, 0.5]
+
+    monkeypatch.setattr(embeddings, "fetch_embedding", fake_fetch)
+    monkeypatch.setattr(
+        embeddings, "embedding_cache", EmbeddingCache(max_entries=10, ttl=60, persistent=False, max_rows=0)
+    )
+    assert await embeddings.get_embedding("сколько стоит") == [0.5, 0.5]
+    assert await embeddings.get_embedding("сколько стоит") == [0.5, 0.5]
+    assert calls == ["сколько стоит"]
+
+
+@pytest.mark.asyncio
+async def test_prune_deletes_by_cutoff_in_bounded_batches():
+    calls = []
+
+    class FakeConn:
+        async def fetchval(self, query, *args):
+            calls.append((query, args))
+            return "2026-01-01T00:00:00+00:00"
+
+        async def execute(self, query, *args):
+            calls.append((query, args))
+            return "DELETE 3"
+
+    cache = EmbeddingCache(max_entries=10, ttl=3600, persistent=True, max_rows=100)
+    await cache.prune(FakeConn())
+
+    (cutoff_sql, cutoff_args), (delete_sql, delete_args) = calls
+    assert "OFFSET $1 LIMIT 1" in cutoff_sql and cutoff_args == (99,)
+    assert "LIMIT $3" in delete_sql
+    assert delete_args == (3600.0, "2026-01-01T00:00:00+00:00", _PRUNE_BATCH)
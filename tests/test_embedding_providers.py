@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+import services.embeddings as embeddings
+from services.embedding_cache import EmbeddingCache
+from services.embedding_providers import LocalHashEmbeddingProvider, create_embedding_provider
+
+
+@pytest.mark.asyncio
+async def test_local_provider_is_deterministic_and_normalized():
+    provider = LocalHashEmbeddingProvider(dimension=64)
+    a = np.asarray(await provider.embed("Доставка по Москве бесплатно"))
+    b = np.asarray((await provider.embed_batch(["Доставка по Москве бесплатно"]))[0])
+    assert a.shape == (64,)
+    assert np.allclose(a, b)
+    assert np.isclose(np.linalg.norm(a), 1.0)
+    assert provider.model_id == "local:hash-64"
+
+
+@pytest.mark.asyncio
+async def test_local_provider_similar_texts_are_closer():
+    provider = LocalHashEmbeddingProvider(dimension=256)
+    query = np.asarray(await provider.embed("сколько стоит доставка"))
+    near = np.asarray(await provider.embed("доставка стоит 300 рублей"))
+    far = np.asarray(await provider.embed("гарантия на ремонт техники"))
+    assert query @ near > query @ far
+
+
+def test_unknown_provider():
+    with pytest.raises(ValueError):
+        create_embedding_provider("word2vec")
+
+
+@pytest.mark.asyncio
+async def test_get_embedding_goes_through_selected_provider(monkeypatch):
+    monkeypatch.setattr(
+        embeddings, "embedding_cache", EmbeddingCache(max_entries=10, ttl=60, persistent=False, max_rows=0)
+    )
+    provider = LocalHashEmbeddingProvider(dimension=32)
+    embeddings.set_embedding_provider(provider)
+    try:
+        result = await embeddings.get_embedding("прайс")
+        assert result == provider.vector("прайс")
+        assert embeddings.embedding_model_id() == "local:hash-32"
+    finally:
+        embeddings.set_embedding_provider(None)
@@ -0,0 +1,48 @@
+import pytest
+
+from config import settings
+from services.chunking import iter_chunks
+from services.embeddings import extract_text_from_file
+from services.extraction import iter_document_text
+from services.ingest_jobs import SpooledUpload
+
+
+@pytest.mark.asyncio
+async def test_txt_is_streamed_in_blocks_across_utf8_boundaries(monkeypatch):
+    monkeypatch.setattr(settings, "upload_buffer_size", 7)
+    text = "Прайс-лист: доставка — бесплатно. " * 10
+    upload = SpooledUpload("price.TXT", "text/plain")
+    upload.write(text.encode("utf-8"))
+    upload.rewind()
+
+    pieces = [piece async for piece in iter_document_text(upload)]
+
+    assert len(pieces) > 1
+    assert all(len(p.encode("utf-8")) <= 7 + 3 for p in pieces)
+    assert "".join(pieces) == text
+    upload.close()
+
+
+@pytest.mark.asyncio
+async def test_unsupported_extension():
+    upload = SpooledUpload("price.docx", None)
+    with pytest.raises(ValueError):
+        [piece async for piece in iter_document_text(upload)]
+    upload.close()
+
+
+@pytest.mark.asyncio
+async def test_multiblock_txt_chunks_are_byte_exact(monkeypatch):
+    monkeypatch.setattr(settings, "upload_buffer_size", 16)
+    text = "Привет мир. Это длинный текст без переводов строк. " * 40
+    upload = SpooledUpload("notes.txt", "text/plain")
+    upload.write(text.encode("utf-8"))
+    upload.rewind()
+
+    chunks = [c async for c in iter_chunks(iter_document_text(upload), chunk_size=300, overlap=50)]
+
+    assert "\n" not in "".join(c.text for c in chunks)
+    assert all(text[c.start:c.end] == c.text for c in chunks)
+    upload.rewind()
+    assert await extract_text_from_file(upload) == text
+    upload.close()
@@ -0,0 +1,25 @@
+import pytest
+
+from services.ingest_client_docs import LocalFolderSource
+
+
+@pytest.mark.asyncio
+async def test_local_source_lists_supported_files(tmp_path):
+    folder = tmp_path / "feedtech"
+    folder.mkdir()
+    (folder / "b.txt").write_text("прайс", encoding="utf-8")
+    (folder / "a.PDF").write_bytes(b"%PDF")
+    (folder / "notes.docx").write_bytes(b"")
+    (folder / "nested").mkdir()
+
+    files = await LocalFolderSource(str(tmp_path)).list_files("feedtech")
+
+    assert [f.filename for f in files] == ["a.PDF", "b.txt"]
+    assert files[1].content_type == "text/plain"
+    assert await files[1].read() == "прайс".encode("utf-8")
+
+
+@pytest.mark.asyncio
+async def test_local_source_missing_folder(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        await LocalFolderSource(str(tmp_path)).list_files("нет")
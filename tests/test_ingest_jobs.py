@@ -0,0 +1,77 @@
+import re
+
+import pytest
+
+from services import ingest_jobs
+
+
+@pytest.mark.parametrize("sql", [
+    ingest_jobs.INSERT_JOB_SQL, ingest_jobs.INSERT_PART_SQL,
+    ingest_jobs.DUPLICATE_JOB_SQL, ingest_jobs.FINALIZE_JOB_SQL,
+])
+def test_enqueue_sql_is_usable_from_psycopg2(sql):
+    # Админка подставляет параметры позиционно — номера должны идти подряд без повторов
+    numbers = [int(n) for n in re.findall(r"\$(\d+)", sql)]
+    assert numbers == list(range(1, len(numbers) + 1))
+    assert ingest_jobs.pyformat(sql).count("%s") == len(numbers)
+
+
+class FakeJobsConn:
+    """ingest_jobs в памяти: документы здесь не хранятся, как и в настоящей таблице задач."""
+
+    def __init__(self, jobs):
+        self.jobs = jobs
+
+    def transaction(self):
+        return self
+
+    async def __aenter__(self):
+        self.snapshot = [dict(job) for job in self.jobs]
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.jobs[:] = self.snapshot
+
+    async def fetchval(self, query, *args):
+        if query is ingest_jobs.INSERT_JOB_SQL:
+            job = {"id": len(self.jobs) + 1, "client_id": args[0], "filename": args[1], "status": "queued", "sha": None}
+            self.jobs.append(job)
+            return job["id"]
+        assert query is ingest_jobs.DUPLICATE_JOB_SQL
+        client_id, sha, job_id = args
+        matches = [
+            job["id"] for job in self.jobs
+            if job["client_id"] == client_id and job["sha"] == sha and job["id"] != job_id
+            and f"'{job['status']}'" in query
+        ]
+        return max(matches, default=None)
+
+    async def execute(self, query, *args):
+        if query is ingest_jobs.FINALIZE_JOB_SQL:
+            size, sha, job_id = args
+            self.jobs[job_id - 1]["sha"] = sha
+
+
+class Stream:
+    def __init__(self, data: bytes):
+        self.data = data
+
+    async def read(self, size: int) -> bytes:
+        block, self.data = self.data[:size], self.data[size:]
+        return block
+
+
+@pytest.mark.asyncio
+async def test_reupload_after_delete_is_not_a_duplicate():
+    conn = FakeJobsConn([])
+    data = "Доставка 300 ₽".encode("utf-8")
+
+    first = await ingest_jobs.enqueue_ingest_job(conn, "c1", "price.txt", "text/plain", Stream(data), {}, dedupe=True)
+    with pytest.raises(ingest_jobs.DuplicateUpload) as error:
+        await ingest_jobs.enqueue_ingest_job(conn, "c1", "price.txt", "text/plain", Stream(data), {}, dedupe=True)
+    assert error.value.job_id == first
+
+    # Задача выполнена, затем документ удалён из documents — ingest_jobs об этом не знает
+    conn.jobs[first - 1]["status"] = "done"
+    again = await ingest_jobs.enqueue_ingest_job(conn, "c1", "price.txt", "text/plain", Stream(data), {}, dedupe=True)
+    assert again != first
@@ -0,0 +1,34 @@
+import pytest
+
+from services.lead_json import LeadJsonStripper, extract_patch
+
+REPLY = 'Понял, записал <3 <LEAD_JSON>\n{"name": "Иван", "phone": "+79990000000"}\n</LEAD_JSON> До связи.'
+
+
+def _run(deltas):
+    stripper = LeadJsonStripper()
+    visible = "".join(stripper.feed(d) for d in deltas)
+    tail, patch = stripper.finish()
+    return visible + tail, patch
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 5, 11, 1000])
+def test_stripper_removes_block_at_any_split(size):
+    deltas = [REPLY[i:i + size] for i in range(0, len(REPLY), size)]
+    text, patch = _run(deltas)
+    assert text == "Понял, записал <3  До связи."
+    assert patch == {"name": "Иван", "phone": "+79990000000"}
+    assert patch == extract_patch(REPLY)
+
+
+def test_stripper_holds_back_only_possible_tag_prefix():
+    stripper = LeadJsonStripper()
+    assert stripper.feed("Привет <LEAD") == "Привет "
+    assert stripper.feed("ER>") == "<LEADER>"
+    assert stripper.finish() == ("", {})
+
+
+def test_unclosed_block_is_hidden():
+    text, patch = _run(["Ответ <LEAD_JSON>", '{"name": "А"}'])
+    assert text == "Ответ "
+    assert patch == {"name": "А"}
@@ -0,0 +1,57 @@
+import asyncio
+
+import httpx
+import pytest
+
+from services import llm
+from services.llm import close_llm_clients, extract_content, get_llm_client, stream_chat_completion
+
+
+@pytest.mark.asyncio
+async def test_client_reused_per_provider_and_closed_on_shutdown():
+    first = get_llm_client("deepseek")
+    assert get_llm_client("deepseek") is first
+    assert get_llm_client("openai") is not first
+    assert str(first.base_url).startswith("https://api.deepseek.com")
+    assert first.timeout.connect != first.timeout.read
+
+    await close_llm_clients()
+    assert first.is_closed
+    assert not llm._clients
+    assert get_llm_client("deepseek") is not first
+    await close_llm_clients()
+
+
+@pytest.mark.asyncio
+async def test_unknown_provider():
+    with pytest.raises(ValueError):
+        get_llm_client("nope")
+
+
+def test_extract_content():
+    assert extract_content({"choices": [{"message": {"content": "ок"}}]}) == "ок"
+    assert extract_content({"choices": [{"text": "t"}]}) == "t"
+    assert extract_content({"error": "x"}) is None
+
+
+@pytest.mark.asyncio
+async def test_stream_chat_completion_yields_deltas():
+    body = (
+        'data: {"choices": [{"delta": {"role": "assistant"}}]}\n\n'
+        'data: {"choices": [{"delta": {"content": "При"}}]}\n\n'
+        ': keep-alive\n\n'
+        'data: {"choices": [{"delta": {"content": "вет"}}]}\n\n'
+        'data: [DONE]\n\n'
+    )
+
+    def handler(request):
+        assert b'"stream": true' in request.content or b'"stream":true' in request.content
+        return httpx.Response(200, text=body, headers={"Content-Type": "text/event-stream"})
+
+    client = httpx.AsyncClient(base_url="https://llm.test", transport=httpx.MockTransport(handler))
+    llm._clients["deepseek"] = (client, asyncio.get_running_loop())
+    try:
+        deltas = [d async for d in stream_chat_completion([{"role": "user", "content": "hi"}], provider="deepseek")]
+    finally:
+        await close_llm_clients()
+    assert deltas == ["При", "вет"]
@@ -0,0 +1,86 @@
+import asyncio
+
+import pytest
+
+from services.llm_router import LLMRouter
+
+
+def _router(**kwargs):
+    return LLMRouter(["deepseek", "openai"], hedge_delay=0.05, min_delay=0.01, **kwargs)
+
+
+@pytest.mark.asyncio
+async def test_fast_primary_is_not_hedged():
+    calls = []
+
+    async def call(provider):
+        calls.append(provider)
+        return provider
+
+    router = _router()
+    assert await router.complete(call) == "deepseek"
+    assert calls == ["deepseek"]
+    assert router.stats()["hedged"] == 0
+
+
+@pytest.mark.asyncio
+async def test_slow_primary_is_hedged_and_cancelled():
+    cancelled = []
+
+    async def call(provider):
+        if provider == "deepseek":
+            try:
+                await asyncio.sleep(1)
+            except asyncio.CancelledError:
+                cancelled.append(provider)
+                raise
+        return provider
+
+    router = _router()
+    assert await router.complete(call) == "openai"
+    assert cancelled == ["deepseek"]
+    stats = router.stats()
+    assert stats["hedged"] == 1 and stats["hedge_wins"] == 1
+
+
+@pytest.mark.asyncio
+async def test_failover_and_traffic_shift_on_errors():
+    async def call(provider):
+        if provider == "deepseek":
+            raise RuntimeError("502")
+        await asyncio.sleep(0.001)
+        return provider
+
+    router = _router(hedge=False)
+    for _ in range(5):
+        assert await router.complete(call) == "openai"
+    assert router.stats()["failovers"] >= 1
+    assert router.order() == ["openai", "deepseek"]
+
+
+@pytest.mark.asyncio
+async def test_all_providers_failing_raises_last_error():
+    async def call(provider):
+        raise RuntimeError(provider)
+
+    with pytest.raises(RuntimeError, match="openai"):
+        await _router().complete(call)
+
+
+@pytest.mark.asyncio
+async def test_stream_hedges_on_first_token_and_closes_loser():
+    closed = []
+
+    async def open_stream(provider):
+        try:
+            if provider == "deepseek":
+                await asyncio.sleep(1)
+            for part in ("При", "вет"):
+                yield f"{provider}:{part}"
+        finally:
+            closed.append(provider)
+
+    router = _router()
+    parts = [p async for p in router.stream(open_stream)]
+    assert parts == ["openai:При", "openai:вет"]
+    assert sorted(closed) == ["deepseek", "openai"]
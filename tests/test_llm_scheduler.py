@@ -0,0 +1,79 @@
+import asyncio
+
+import pytest
+
+from services.llm_scheduler import FairScheduler, LLMQueueTimeout, parse_weights
+
+
+async def _hold(scheduler, client_id, order, release: asyncio.Event):
+    async with scheduler.slot(client_id):
+        order.append(client_id)
+        await release.wait()
+
+
+@pytest.mark.asyncio
+async def test_capacity_and_fair_order_across_tenants():
+    scheduler = FairScheduler(capacity=1)
+    order = []
+    gate = asyncio.Event()
+    blocker = asyncio.create_task(_hold(scheduler, "blocker", order, gate))
+    await asyncio.sleep(0)
+
+    done = asyncio.Event()
+    done.set()
+    noisy = [asyncio.create_task(_hold(scheduler, "noisy", order, done)) for _ in range(6)]
+    await asyncio.sleep(0)
+    quiet = asyncio.create_task(_hold(scheduler, "quiet", order, done))
+    await asyncio.sleep(0)
+    assert scheduler.stats()["queue_depth"] == 7
+    assert scheduler.stats()["in_flight"] == 1
+
+    gate.set()
+    await asyncio.gather(blocker, quiet, *noisy)
+    # Единичный запрос тихого клиента не ждёт всю очередь шумного
+    assert order.index("quiet") <= 2
+    assert scheduler.stats()["in_flight"] == 0
+    assert scheduler.stats()["granted"] == 8
+
+
+@pytest.mark.asyncio
+async def test_weights_share_slots_proportionally():
+    scheduler = FairScheduler(capacity=1, weights={"gold": 3})
+    order = []
+    gate = asyncio.Event()
+    blocker = asyncio.create_task(_hold(scheduler, "blocker", order, gate))
+    await asyncio.sleep(0)
+    done = asyncio.Event()
+    done.set()
+    tasks = [asyncio.create_task(_hold(scheduler, name, order, done)) for name in ["basic"] * 8 + ["gold"] * 8]
+    await asyncio.sleep(0)
+    gate.set()
+    await asyncio.gather(blocker, *tasks)
+    first = order[1:9]
+    assert first.count("gold") == 6 and first.count("basic") == 2
+
+
+@pytest.mark.asyncio
+async def test_queue_deadline_rejects_and_frees_queue():
+    scheduler = FairScheduler(capacity=1, deadline=0.02)
+    gate = asyncio.Event()
+    blocker = asyncio.create_task(_hold(scheduler, "a", [], gate))
+    await asyncio.sleep(0)
+    with pytest.raises(LLMQueueTimeout):
+        await scheduler.acquire("b")
+    assert scheduler.stats()["rejected"] == 1
+    assert scheduler.stats()["queue_depth"] == 0
+
+    waiter = asyncio.create_task(scheduler.acquire("c", deadline=0))
+    await asyncio.sleep(0)
+    waiter.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
+    gate.set()
+    await blocker
+    assert scheduler.stats()["in_flight"] == 0
+
+
+def test_parse_weights():
+    assert parse_weights("a:2, b:0.5,") == {"a": 2.0, "b": 0.5}
+    assert parse_weights("") == {}
@@ -0,0 +1,70 @@
+import pytest
+
+import scripts.migrate_embeddings as migrate
+
+
+class FakeConn:
+    def __init__(self, skipped_ids):
+        self.skipped_ids = skipped_ids
+        self.verified = False
+
+    async def fetch(self, query, *args):
+        if "NOT CASE" in query:
+            return [{"id": i} for i in self.skipped_ids]
+        return [{"id": 1, "embedding": "[1.0, 0.0]", "embedding_vec": "[1.0, 0.0]"}]
+
+    async def fetchval(self, query, *args):
+        return 0  # всё, что можно перенести, перенесено
+
+    async def execute(self, query, *args):
+        if "'verified'" in query:
+            self.verified = True
+
+
+class FakePool:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def acquire(self):
+        return self
+
+    async def __aenter__(self):
+        return self.conn
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+@pytest.fixture
+def conn_for(monkeypatch):
+    async def fake_notify(conn, client_id):
+        pass
+
+    def make(skipped_ids):
+        conn = FakeConn(skipped_ids)
+        monkeypatch.setattr(migrate, "get_db_pool", lambda: FakePool(conn))
+        monkeypatch.setattr(migrate, "notify_documents_changed", fake_notify)
+        return conn
+
+    return make
+
+
+@pytest.mark.asyncio
+async def test_tenant_with_skipped_rows_is_not_verified(conn_for):
+    conn = conn_for([7, 9])
+    assert await migrate.verify_tenant("c1", sample=10) is False
+    assert conn.verified is False
+
+
+@pytest.mark.asyncio
+async def test_force_verifies_despite_skipped_rows(conn_for):
+    conn = conn_for([7])
+    assert await migrate.verify_tenant("c1", sample=10, force=True) is True
+    assert conn.verified is True
+
+
+@pytest.mark.asyncio
+async def test_clean_tenant_is_verified(conn_for):
+    conn = conn_for([])
+    assert await migrate.verify_tenant("c1", sample=10) is True
+    assert conn.verified is True
@@ -0,0 +1,63 @@
+import pytest
+
+import services.deepseek as deepseek
+from services.llm import PromptCacheStats
+from services.prompt import STATIC, VOLATILE, PromptSegment, assemble_system_prompt
+
+
+def test_segments_ordered_from_static_to_volatile():
+    text = assemble_system_prompt([
+        PromptSegment("docs", "Документы", VOLATILE),
+        PromptSegment("base", "Роль", STATIC),
+        PromptSegment("empty", "  ", STATIC),
+        PromptSegment("rules", "Правила", STATIC),
+    ])
+    assert text == "Роль\n\nПравила\n\nДокументы"
+
+
+@pytest.mark.asyncio
+async def test_rag_prompt_keeps_tenant_instructions_as_stable_prefix(monkeypatch):
+    turns = iter([[{"content": "Доставка 300 ₽", "metadata": {"filename": "a.txt"}}], []])
+
+    async def fake_retrieve(query, user_id):
+        return next(turns)
+
+    monkeypatch.setattr(deepseek, "retrieve_relevant_docs", fake_retrieve)
+    instructions = "Длинные правила квалификации лида"
+    first, sources = await deepseek.build_rag_messages(
+        "Сколько стоит доставка?", "c1", system_extra=instructions, system_dynamic="История: 1"
+    )
+    second, _ = await deepseek.build_rag_messages(
+        "А самовывоз?", "c1", system_extra=instructions,
+        context_info='{"greeted": true}', system_dynamic="История: 1, 2"
+    )
+    assert sources == ["a.txt"]
+    prefix = f"Ты — корпоративный ИИ-ассистент компании клиента.\n\n{instructions}\n\n"
+    assert first[0]["content"].startswith(prefix)
+    assert second[0]["content"].startswith(prefix)
+    assert first[0]["content"].index("Доставка 300") < first[0]["content"].index("История: 1")
+    assert first[1] == {"role": "user", "content": "Сколько стоит доставка?"}
+
+
+def test_prompt_cache_stats_reads_deepseek_and_openai_usage():
+    stats = PromptCacheStats()
+    stats.record("deepseek", {"prompt_tokens": 1000, "prompt_cache_hit_tokens": 768,
+                              "prompt_cache_miss_tokens": 232, "completion_tokens": 50})
+    stats.record("openai", {"prompt_tokens": 1000, "prompt_tokens_details": {"cached_tokens": 512},
+                            "completion_tokens": 10})
+    stats.record("openai", None)
+    assert stats.stats() == {
+        "requests": 2, "prompt_tokens": 2000, "cached_tokens": 1280,
+        "completion_tokens": 60, "cache_hit_ratio": 0.64,
+    }
+
+
+def test_after_handoff_prompt_is_static_and_dates_go_to_dialog_state():
+    telegram_bot = pytest.importorskip("telegram_bot")
+    collected = {"preferred_date": "20.10.2026 15:00"}
+
+    prompt = telegram_bot.build_after_handoff_prompt()
+    state = telegram_bot.build_dialog_state("", collected, after_handoff=True)
+
+    assert "15:00" not in prompt and "2026" not in prompt
+    assert "Время в заявке: 15:00" in state and "Послезавтра:" in state
@@ -0,0 +1,24 @@
+import asyncio
+import time
+
+import pytest
+
+from services.rate_limit import TokenBucket
+
+
+@pytest.mark.asyncio
+async def test_token_bucket_limits_rate():
+    bucket = TokenBucket(rate=50, capacity=5)
+    started = time.monotonic()
+    await asyncio.gather(*(bucket.acquire() for _ in range(15)))
+    # 5 токенов сразу, ещё 10 — со скоростью 50/с
+    assert time.monotonic() - started >= 0.18
+
+
+@pytest.mark.asyncio
+async def test_token_bucket_penalize_delays_next_acquire():
+    bucket = TokenBucket(rate=100, capacity=10)
+    bucket.penalize(0.1)
+    started = time.monotonic()
+    await bucket.acquire()
+    assert time.monotonic() - started >= 0.1
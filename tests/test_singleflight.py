@@ -0,0 +1,91 @@
+import asyncio
+
+import httpx
+import pytest
+
+from services import llm
+from services.llm import chat_completion, close_llm_clients
+from services.singleflight import SingleFlight, StreamFlight
+
+
+@pytest.mark.asyncio
+async def test_singleflight_ttl_reuses_result_then_expires():
+    calls = []
+
+    async def fn():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return len(calls)
+
+    flight = SingleFlight(ttl=0.05)
+    assert await asyncio.gather(*(flight.do("k", fn) for _ in range(5))) == [1] * 5
+    assert await flight.do("k", fn) == 1
+    await asyncio.sleep(0.06)
+    assert await flight.do("k", fn) == 2
+    assert flight.stats()["calls"] == 2
+    assert flight.stats()["shared"] == 4
+    assert flight.stats()["reused"] == 1
+
+
+@pytest.mark.asyncio
+async def test_singleflight_does_not_keep_errors():
+    attempts = []
+
+    async def fn():
+        attempts.append(1)
+        raise RuntimeError("boom")
+
+    flight = SingleFlight(ttl=10)
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            await flight.do("k", fn)
+    assert len(attempts) == 2
+
+
+@pytest.mark.asyncio
+async def test_streamflight_late_reader_gets_replay():
+    release = asyncio.Event()
+
+    async def source():
+        yield "a"
+        yield "b"
+        await release.wait()
+        yield "c"
+
+    flight = StreamFlight(ttl=1)
+
+    async def read():
+        return [x async for x in flight.stream("k", source)]
+
+    first = asyncio.create_task(read())
+    await asyncio.sleep(0.01)
+    second = asyncio.create_task(read())
+    await asyncio.sleep(0.01)
+    release.set()
+    assert await first == await second == ["a", "b", "c"]
+    assert await read() == ["a", "b", "c"]
+    assert flight.stats()["calls"] == 1
+    assert flight.stats()["shared"] == 1
+    assert flight.stats()["reused"] == 1
+
+
+@pytest.mark.asyncio
+async def test_identical_llm_requests_share_one_upstream_call():
+    requests = []
+
+    async def handler(request):
+        requests.append(request)
+        await asyncio.sleep(0.02)
+        return httpx.Response(200, json={"choices": [{"message": {"content": "Цены в прайсе"}}]})
+
+    client = httpx.AsyncClient(base_url="https://llm.test", transport=httpx.MockTransport(handler))
+    llm._clients["deepseek"] = (client, asyncio.get_running_loop())
+    messages = [{"role": "user", "content": "Сколько стоит? (singleflight)"}]
+    try:
+        results = await asyncio.gather(*(chat_completion(messages, provider="deepseek") for _ in range(10)))
+        other = await chat_completion(messages, temperature=0.7, provider="deepseek")
+    finally:
+        await close_llm_clients()
+    assert len(requests) == 2
+    assert all(r is results[0] for r in results)
+    assert other is not results[0]
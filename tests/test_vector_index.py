@@ -0,0 +1,203 @@
+import asyncio
+import json
+
+import numpy as np
+import pytest
+
+from services.vector_index import TenantIndex, VectorIndexManager
+
+
+def make_rows(ids, dim=4, filename="a.txt"):
+    return [
+        {
+            "id": i,
+            "content": f"chunk {i}",
+            "metadata": json.dumps({"filename": filename}),
+            "embedding": json.dumps([float(i)] * dim),
+        }
+        for i in ids
+    ]
+
+
+def test_from_rows_decodes_jsonb():
+    index = TenantIndex.from_rows("c1", make_rows([1, 2, 3]))
+    assert len(index) == 3
+    assert index.matrix.dtype == np.float32
+    assert index.matrix.flags["C_CONTIGUOUS"]
+    assert index.metadata[0]["filename"] == "a.txt"
+
+
+def test_upsert_replaces_and_appends():
+    index = TenantIndex.from_rows("c1", make_rows([1, 2]))
+    index = index.upsert(TenantIndex.from_rows("c1", make_rows([2, 3], filename="b.txt")))
+    assert sorted(index.ids.tolist()) == [1, 2, 3]
+    assert index.metadata[index.ids.tolist().index(2)]["filename"] == "b.txt"
+
+
+def test_without_filename():
+    index = TenantIndex.from_rows("c1", make_rows([1, 2]) + make_rows([3], filename="b.txt"))
+    index = index.without_filename("a.txt")
+    assert index.ids.tolist() == [3]
+
+
+@pytest.mark.asyncio
+async def test_manager_lru_eviction():
+    rows = make_rows(range(1, 11), dim=64)
+    one = TenantIndex.from_rows("x", rows).nbytes
+    manager = VectorIndexManager(max_bytes=int(one * 2.5))
+
+    async def fake_load(client_id):
+        return TenantIndex.from_rows(client_id, rows)
+
+    manager._load = fake_load
+    await manager.get("a")
+    await manager.get("b")
+    await manager.get("a")  # "a" свежее, чем "b"
+    await manager.get("c")
+    assert set(manager._indexes) == {"a", "c"}
+    assert manager.stats()["evictions"] == 1
+    assert manager.stats()["hits"] == 1
+
+
+@pytest.mark.asyncio
+async def test_manager_incremental_updates():
+    manager = VectorIndexManager(max_bytes=1 << 30)
+
+    async def fake_load(client_id):
+        return TenantIndex.from_rows(client_id, make_rows([1, 2]))
+
+    manager._load = fake_load
+    await manager.get("a")
+    manager.upsert("a", make_rows([5]))
+    assert (await manager.get("a")).ids.tolist() == [1, 2, 5]
+    manager.remove("a", [1])
+    assert (await manager.get("a")).ids.tolist() == [2, 5]
+    manager.invalidate("a")
+    assert "a" not in manager._indexes
+
+
+@pytest.mark.asyncio
+async def test_load_racing_clear_is_not_cached():
+    manager = VectorIndexManager(max_bytes=1 << 30)
+    loading = asyncio.Event()
+    release = asyncio.Event()
+
+    async def fake_load(client_id):
+        loading.set()
+        await release.wait()
+        return TenantIndex.from_rows(client_id, make_rows([1, 2]))
+
+    manager._load = fake_load
+    task = asyncio.ensure_future(manager.get("a"))
+    await loading.wait()
+    manager.clear()  # переподключение слушателя или NOTIFY без client_id
+    release.set()
+    assert (await task).ids.tolist() == [1, 2]
+    assert "a" not in manager._indexes
+
+
+def test_search_matches_bruteforce():
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(200, 32)).astype(np.float32)
+    rows = [
+        {"id": i, "content": str(i), "metadata": {}, "embedding": vectors[i].tolist()}
+        for i in range(len(vectors))
+    ]
+    index = TenantIndex.from_rows("c1", rows)
+    query = rng.normal(size=32).astype(np.float32)
+
+    expected = sorted(
+        (
+            (float(np.dot(v / np.linalg.norm(v), query / np.linalg.norm(query))), i)
+            for i, v in enumerate(vectors)
+        ),
+        reverse=True,
+    )
+    expected = [i for score, i in expected if score >= 0.1][:5]
+
+    results = index.search(query, 5, 0.1)
+    assert [r["id"] for r in results] == expected
+    assert all(r["score"] >= 0.1 for r in results)
+
+    batch = index.search_batch(np.stack([query, query]), 5, 0.1)
+    assert [r["id"] for r in batch[0]] == expected
+    assert [r["id"] for r in batch[1]] == expected
+
+
+def test_search_threshold_filters_everything():
+    index = TenantIndex.from_rows("c1", make_rows([1, 2]))
+    assert index.search(np.array([-1.0, -1.0, -1.0, -1.0]), 5, 0.5) == []
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("backend,converted,expected", [
+    ("memory", True, "indexes"),
+    ("pgvector", False, "indexes"),
+    ("pgvector", True, "pgvector"),
+])
+async def test_retrieve_without_client_uses_pgvector_only_after_full_migration(monkeypatch, backend, converted, expected):
+    import services.rag as rag
+    from config import settings
+
+    used = []
+
+    async def fake_embedding(text):
+        return [1.0, 0.0]
+
+    async def fake_converted():
+        return converted
+
+    async def fake_pgvector(*args):
+        used.append("pgvector")
+        return []
+
+    async def fake_all_tenants(*args):
+        used.append("indexes")
+        return []
+
+    monkeypatch.setattr(settings, "rag_backend", backend)
+    monkeypatch.setattr(rag, "get_embedding", fake_embedding)
+    monkeypatch.setattr(rag, "all_tenants_converted", fake_converted)
+    monkeypatch.setattr(rag, "search_pgvector", fake_pgvector)
+    monkeypatch.setattr(rag, "_search_all_tenants", fake_all_tenants)
+
+    await rag.retrieve_relevant_docs("Привет")
+    assert used == [expected]
+
+
+@pytest.mark.asyncio
+async def test_search_without_client_merges_tenant_indexes(monkeypatch):
+    import services.rag as rag
+
+    class FakeConn:
+        async def fetch(self, query):
+            return [{"client_id": "a"}, {"client_id": "b"}, {"client_id": "other-model"}]
+
+    class FakePool:
+        def acquire(self):
+            return self
+
+        async def __aenter__(self):
+            return FakeConn()
+
+        async def __aexit__(self, *exc):
+            return False
+
+    vectors = {
+        "a": {1: [1.0, 0.0], 2: [0.0, 1.0]},
+        "b": {3: [0.9, 0.1]},
+        "other-model": {4: [1.0, 0.0, 0.0]},
+    }
+    manager = VectorIndexManager(max_bytes=1 << 30)
+
+    async def fake_load(client_id):
+        rows = [{"id": i, "content": str(i), "metadata": {}, "embedding": v} for i, v in vectors[client_id].items()]
+        return TenantIndex.from_rows(client_id, rows)
+
+    manager._load = fake_load
+    monkeypatch.setattr(rag, "get_db_pool", lambda: FakePool())
+    monkeypatch.setattr(rag, "vector_index", manager)
+
+    results = await rag._search_all_tenants([1.0, 0.0], top_k=2, threshold=0.1)
+    assert [doc["id"] for doc in results] == [1, 3]
+    assert set(manager._indexes) == {"a", "b", "other-model"}